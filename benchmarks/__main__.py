@@ -0,0 +1,68 @@
+"""Offline benchmark suite for the hot handlers.
+
+    python -m benchmarks --characters 5000 --users 2000 --inventory 200
+    python -m benchmarks --mongo-url mongodb://localhost:27017 --only inline harem
+
+Handlers run against an in-memory motor stand-in unless ``--mongo-url``
+points at a local mongod. Telegram is replaced by a stub bot, so the numbers
+are handler + database cost only.
+"""
+
+import argparse
+import json
+import sys
+
+import shivu
+
+from benchmarks import env, handlers
+from benchmarks.fakes import StubBot
+from benchmarks.runner import format_table, measure
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=1000, help='catalog size')
+    parser.add_argument('--users', type=int, default=500, help='number of users with a collection')
+    parser.add_argument('--inventory', type=int, default=100, help='characters owned per user')
+    parser.add_argument('--groups', type=int, default=100, help='number of groups with totals')
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed calls per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='calls in flight at once')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='benchmark against a local mongod instead of the fake')
+    parser.add_argument('--only', nargs='*', help='scenario name prefixes to run')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    core = env.install(db)
+    catalog, group_ids = await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+    from shivu.startup import warm_up
+    await warm_up()
+    bot = StubBot()
+
+    results = []
+    for scenario in handlers.build(core, bot, catalog, group_ids, args.users, args.only):
+        result = await measure(scenario, args.iterations, args.warmup, args.concurrency, db, bot)
+        results.append(result.as_dict())
+        if args.json:
+            print(json.dumps(result.as_dict()), flush=True)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Run on pyrogram's loop so the handlers it registers at import time settle.
+    results = shivu.shivuu.loop.run_until_complete(run(args))
+    if not args.json:
+        print(f'catalog={args.characters} users={args.users} inventory={args.inventory} '
+              f'groups={args.groups} iterations={args.iterations}')
+        print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
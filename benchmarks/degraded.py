@@ -0,0 +1,149 @@
+"""Handler latency while Mongo stalls or goes away, and what is left once it is back.
+
+    python -m benchmarks.degraded --iterations 200 --timeout 0.2 --stall 1
+
+Runs guesses, /harem, /ctop week and inline queries in four phases: healthy, with every
+database call stalled past the per-call timeout, with the database refusing
+connections, and after it recovers. While stalled, only the calls before the
+breaker opens wait for the timeout; the rest fail at once and are answered
+from the last known user documents. Catches made while degraded are deferred
+and the report checks that each of them reached the database after recovery.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import sys
+
+import shivu
+from benchmarks import env, fakes
+from benchmarks.fakedb import FakeDatabase
+from benchmarks.runner import Scenario, format_table, measure
+
+
+async def dispatch(handler, update, context):
+    """Call ``handler`` the way the application does, with ``DatabaseUnavailable`` answered by the error handler."""
+    from shivu.health import DatabaseUnavailable, reply_degraded
+    try:
+        await handler(update, context)
+    except DatabaseUnavailable:
+        await reply_degraded(update)
+
+
+def scenarios(core, bot, catalog, group_ids, users):
+    harem = importlib.import_module('shivu.modules.harem')
+    inline = importlib.import_module('shivu.modules.inlinequery')
+    board = importlib.import_module('shivu.modules.leaderboard')
+    leaderboards = importlib.import_module('shivu.leaderboards')
+
+    def chat_of(i):
+        return group_ids[i % len(group_ids)]
+
+    def user_of(i):
+        return i % users + 1
+
+    async def prepare_guess(i):
+        core.last_characters[chat_of(i)] = dict(catalog[(i * 7919) % len(catalog)])
+        core.first_correct_guesses.pop(chat_of(i), None)
+
+    async def guess(i):
+        name = core.last_characters[chat_of(i)]['name']
+        await dispatch(core.guess, fakes.message_update(bot, chat_of(i), user_of(i)),
+                       fakes.make_context(bot, name.split()))
+
+    async def harem_command(i):
+        await dispatch(harem.harem, fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot))
+
+    async def inline_collection(i):
+        inline.results_cache.clear()
+        update = fakes.inline_update(bot, user_of(i), f'collection.{user_of(i)}')
+        await dispatch(inline.inlinequery, update, fakes.make_context(bot))
+
+    async def ctop_week(i):
+        # Past the cached tops, so every call reads the day buckets.
+        leaderboards.catch_buckets.tops.clear()
+        await dispatch(board.ctop, fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot, ['week']))
+
+    # /ctop week runs first in each phase, so it is what meets the stall before the breaker opens.
+    return [Scenario('ctop.week', ctop_week), Scenario('guess', guess, prepare_guess),
+            Scenario('harem', harem_command), Scenario('inline.collection', inline_collection)]
+
+
+async def owned_total(db):
+    total = 0
+    async for user in db[shivu.user_collection.name].find({}, {'characters': 1}):
+        total += len(user.get('characters', ()))
+    return total
+
+
+async def run(args):
+    db = FakeDatabase(latency=args.db_latency / 1000)
+    core = env.install(db)
+    catalog, group_ids = await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+    from shivu.health import mongo_health
+    from shivu.startup import warm_up
+    await warm_up()
+    mongo_health.timeout = args.timeout
+    mongo_health.cooldown = args.cooldown
+
+    bot = fakes.StubBot()
+    plans = scenarios(core, bot, catalog, group_ids or [-1000000000], args.users)
+    owned_before = await owned_total(db)
+
+    rows, phases = [], []
+    for phase in ('healthy', 'stalled', 'down', 'recovered'):
+        if phase == 'stalled':
+            db.stall = args.stall
+        elif phase == 'down':
+            db.stall, db.down = 0.0, True
+        elif phase == 'recovered':
+            db.down = False
+            await asyncio.sleep(args.cooldown)
+            await mongo_health.ping()
+            while mongo_health.deferred and not mongo_health.degraded:
+                await asyncio.sleep(0.01)
+        deferred = len(mongo_health.deferred)
+        for scenario in plans:
+            result = await measure(scenario, args.iterations, 0, args.concurrency, db, bot)
+            rows.append({**result.as_dict(), 'scenario': f'{phase}.{scenario.name}'})
+        phases.append({'phase': phase, 'deferred_during_phase': len(mongo_health.deferred) - deferred,
+                       **{k: v for k, v in mongo_health.stats().items() if k in ('state', 'opens', 'rejected',
+                                                                                  'timeouts', 'errors')}})
+
+    # Every guess in every phase was a catch; the deferred ones must have landed too.
+    expected = owned_before + 4 * args.iterations
+    check = {'expected_owned': expected, 'owned': await owned_total(db), 'replayed': mongo_health.replayed,
+             'dropped': mongo_health.dropped, 'still_deferred': len(mongo_health.deferred)}
+    return rows, phases, check
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.degraded', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--characters', type=int, default=500)
+    parser.add_argument('--inventory', type=int, default=20)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=0.2, help='seconds each query may take (MONGO_TIMEOUT)')
+    parser.add_argument('--cooldown', type=float, default=0.5, help='seconds the breaker stays open')
+    parser.add_argument('--stall', type=float, default=1.0, help='seconds added to every call while stalled')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    rows, phases, check = shivu.shivuu.loop.run_until_complete(run(args))
+    if args.json:
+        print(json.dumps({'results': rows, 'phases': phases, 'check': check}))
+    else:
+        print(format_table(rows))
+        for phase in phases:
+            print(' '.join(f'{k}={v}' for k, v in phase.items()))
+        print(' '.join(f'{k}={v}' for k, v in check.items()))
+    return 0 if check['owned'] == check['expected_owned'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Point the ``shivu`` package at a benchmark database before handlers import it."""
+
+import importlib
+import random
+from datetime import datetime, timedelta, timezone
+
+import shivu
+
+COLLECTIONS = ('collection', 'user_totals_collection', 'user_collection',
+               'group_user_totals_collection', 'top_global_groups_collection', 'pm_users',
+               'catch_buckets_collection', 'propagation_jobs_collection',
+               'events_collection', 'event_checkpoints_collection', 'character_stats_collection',
+               'user_stats_collection', 'image_checks_collection')
+
+RARITIES = ["⚪ Common", "🟣 Rare", "🟡 Legendary", "🟢 Medium", "💮 Special edition"]
+
+
+def open_database(mongo_url=None, latency=0.0):
+    """Return the fake database, or a scratch database on a local mongod."""
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url)['shivu_bench']
+    from benchmarks.fakedb import FakeDatabase
+    return FakeDatabase(latency=latency)
+
+
+def install(db, application=None):
+    """Swap every collection exported by ``shivu`` and load the handler modules.
+
+    Passing ``application`` replaces ``shivu.application`` too, so handlers
+    register on an application that talks to a fake Bot API server.
+    """
+    if application is not None:
+        shivu.application = application
+    shivu.db = db
+    for attr in COLLECTIONS:
+        setattr(shivu, attr, db[getattr(shivu, attr).name])
+    core = importlib.import_module('shivu.__main__')
+    # Benchmarks load the catalog from their own database, never a leftover snapshot.
+    importlib.import_module('shivu.snapshot').catalog_sync.path = None
+    return core
+
+
+def make_character(index, animes):
+    return {
+        'img_url': f'https://example.invalid/chars/{index}.jpg',
+        'name': f'Name{index} Surname{index % 97}',
+        'anime': f'Anime {index % animes}',
+        'rarity': RARITIES[index % len(RARITIES)],
+        'id': str(index).zfill(2),
+        'message_id': index,
+    }
+
+
+async def seed(db, characters=1000, users=1000, inventory=100, groups=100, seed=1):
+    """Fill the benchmark database and return the generated catalog."""
+    rng = random.Random(seed)
+    for attr in COLLECTIONS:
+        await shivu_collection(db, attr).drop()
+
+    animes = max(1, characters // 20)
+    catalog = [make_character(i, animes) for i in range(characters)]
+    await shivu_collection(db, 'collection').insert_many([dict(c) for c in catalog])
+
+    user_docs = []
+    for user_id in range(1, users + 1):
+        owned = [dict(rng.choice(catalog)) for _ in range(inventory)]
+        user_docs.append({
+            'id': user_id,
+            'username': f'user{user_id}',
+            'first_name': f'User{user_id}',
+            'characters': owned,
+            'favorites': [owned[0]['id']] if owned and user_id % 2 else [],
+        })
+    for start in range(0, len(user_docs), 1000):
+        await shivu_collection(db, 'user_collection').insert_many(user_docs[start:start + 1000])
+
+    group_ids = [-1000000000 - g for g in range(groups)]
+    totals = []
+    for group_id in group_ids:
+        for user_id in rng.sample(range(1, users + 1), min(users, 20)):
+            totals.append({'user_id': user_id, 'group_id': group_id, 'username': f'user{user_id}',
+                           'first_name': f'User{user_id}', 'count': rng.randint(1, 500)})
+    if totals:
+        await shivu_collection(db, 'group_user_totals_collection').insert_many(totals)
+    if group_ids:
+        await shivu_collection(db, 'top_global_groups_collection').insert_many(
+            [{'group_id': g, 'group_name': f'Group {g}', 'count': sum(t['count'] for t in totals if t['group_id'] == g)}
+             for g in group_ids])
+
+    # A month of per-day catch buckets for the windowed leaderboards.
+    today = datetime.now(timezone.utc).date()
+    buckets = []
+    for n in range(30):
+        day = (today - timedelta(days=n)).isoformat()
+        user_counts, group_counts = {}, {}
+        for total in totals:
+            count = rng.randint(0, 5)
+            if not count:
+                continue
+            user, group = str(total['user_id']), str(total['group_id'])
+            user_counts[user] = user_counts.get(user, 0) + count
+            group_counts[group] = group_counts.get(group, 0) + count
+        for group in group_ids:
+            members = [t for t in totals if t['group_id'] == group]
+            buckets.extend({'scope': f'group:{group}', 'day': day, 'id': str(t['user_id']),
+                            'name': [t['username'], t['first_name']], 'count': rng.randint(1, 5)} for t in members)
+        buckets.extend({'scope': 'users', 'day': day, 'id': user, 'name': [f'user{user}', f'User{user}'], 'count': count}
+                       for user, count in user_counts.items())
+        buckets.extend({'scope': 'groups', 'day': day, 'id': group, 'name': f'Group {group}', 'count': count}
+                       for group, count in group_counts.items())
+    if buckets:
+        await shivu_collection(db, 'catch_buckets_collection').insert_many(buckets)
+    return catalog, group_ids
+
+
+def shivu_collection(db, attr):
+    return db[getattr(shivu, attr).name]
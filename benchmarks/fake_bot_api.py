@@ -0,0 +1,171 @@
+"""Local stand-in for the Telegram Bot API HTTP server.
+
+Answers ``/bot<token>/<method>`` with minimal valid payloads, adds configurable
+latency and injects 429 flood waits, and counts every call so a replay can
+report what the bot would have sent.
+
+    python -m benchmarks.fake_bot_api --port 8081 --latency 40 --flood-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': True,
+            'supports_inline_queries': True}
+
+
+class FakeBotAPI:
+    """aiohttp app that imitates the Bot API methods the bot uses.
+
+    ``latency`` and ``jitter`` are in seconds. ``flood_rate`` is the chance a
+    call gets a 429; ``chat_limit`` additionally enforces Telegram's roughly
+    20 messages per minute per group with real ``retry_after`` values.
+    """
+
+    SENDING = {'sendPhoto', 'sendMessage', 'forwardMessage', 'sendDocument', 'copyMessage'}
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1,
+                 chat_limit=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.chat_limit = chat_limit
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.floods = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._chat_sends = defaultdict(deque)
+        self._message_ids = 0
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+        self.app.router.add_get('/bot{token}/{method}', self.handle)
+        self._runner = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{self.port}/bot'
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self.calls.clear()
+        self.floods.clear()
+        self.max_in_flight = 0
+        self._chat_sends.clear()
+
+    async def _params(self, request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+        return params
+
+    def _flooded(self, method, params):
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            return self.retry_after
+        if self.chat_limit and method in self.SENDING and 'chat_id' in params:
+            now = time.monotonic()
+            sends = self._chat_sends[params['chat_id']]
+            while sends and now - sends[0] > 60:
+                sends.popleft()
+            if len(sends) >= self.chat_limit:
+                return max(1, int(60 - (now - sends[0])) + 1)
+            sends.append(now)
+        return None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.calls[method] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            retry_after = self._flooded(method, params)
+            if retry_after is not None:
+                self.floods[method] += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }, status=429)
+            return web.json_response({'ok': True, 'result': self.result(method, params)})
+        finally:
+            self.in_flight -= 1
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('getUpdates', 'getChatAdministrators'):
+            return []
+        if method == 'getChatMember':
+            return {'status': 'member', 'user': {'id': int(params.get('user_id', 0)), 'is_bot': False,
+                                                 'first_name': 'Member'}}
+        if method in self.SENDING or method.startswith('edit'):
+            self._message_ids += 1
+            chat_id = params.get('chat_id', 0)
+            message = {
+                'message_id': self._message_ids,
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, 'type': 'supergroup'},
+                'from': BOT_USER,
+            }
+            if 'text' in params:
+                message['text'] = params['text']
+            if 'caption' in params:
+                message['caption'] = params['caption']
+            return message
+        return True
+
+    def summary(self):
+        return {
+            'calls': dict(self.calls),
+            'floods': dict(self.floods),
+            'max_in_flight': self.max_in_flight,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.fake_bot_api', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='ms added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra ms per call')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='probability of a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds in injected 429s')
+    parser.add_argument('--chat-limit', type=int, help='messages per minute per chat before 429')
+    args = parser.parse_args(argv)
+
+    api = FakeBotAPI(args.latency / 1000, args.jitter / 1000, args.flood_rate, args.retry_after,
+                     args.chat_limit)
+    web.run_app(api.app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,899 @@
+"""In-memory stand-in for the subset of motor the bot uses.
+
+Equality lookups on fields passed to ``create_index`` are served from a hash
+index; everything else is a collection scan, which is roughly what Atlas does
+for the same query shapes.
+"""
+
+import asyncio
+import re
+from itertools import islice
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import AutoReconnect
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+_MISSING = object()
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _resolve(doc, path):
+    """Return every value reachable at a dotted path, descending into arrays."""
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = found
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat.extend(value)
+        flat.append(value)
+    return flat
+
+
+def _get(doc, path, default=None):
+    for part in path.split('.'):
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        elif isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return default
+    return doc
+
+
+def _compare(op, values, arg):
+    if op == '$eq':
+        return any(_equal(v, arg) for v in values)
+    if op == '$ne':
+        return not any(_equal(v, arg) for v in values)
+    if op == '$in':
+        return any(_equal(v, a) for v in values for a in arg)
+    if op == '$nin':
+        return not any(_equal(v, a) for v in values for a in arg)
+    if op == '$exists':
+        return bool(values) == bool(arg)
+    if op == '$regex':
+        pattern = arg if isinstance(arg, re.Pattern) else re.compile(arg)
+        return any(isinstance(v, str) and pattern.search(v) for v in values)
+    if op == '$size':
+        return any(isinstance(v, list) and len(v) == arg for v in values)
+    if op == '$elemMatch':
+        return any(isinstance(v, dict) and matches(v, arg) for v in values)
+    comparisons = {
+        '$gt': lambda a, b: a > b,
+        '$gte': lambda a, b: a >= b,
+        '$lt': lambda a, b: a < b,
+        '$lte': lambda a, b: a <= b,
+    }
+    if op in comparisons:
+        check = comparisons[op]
+        for v in values:
+            try:
+                if v is not None and check(v, arg):
+                    return True
+            except TypeError:
+                continue
+        return False
+    raise NotImplementedError(f'fakedb: unsupported operator {op}')
+
+
+def _equal(value, arg):
+    if isinstance(arg, re.Pattern):
+        return isinstance(value, str) and arg.search(value) is not None
+    return value == arg
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == '$or':
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == '$and':
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == '$nor':
+            if any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        values = _resolve(doc, key)
+        if isinstance(cond, dict) and cond and all(k.startswith('$') for k in cond):
+            if '$regex' in cond and '$options' in cond:
+                cond = dict(cond)
+                flags = re.IGNORECASE if 'i' in cond.pop('$options') else 0
+                cond['$regex'] = re.compile(cond['$regex'], flags)
+            if '$elemMatch' in cond:
+                values = [v for v in _resolve(doc, key) if isinstance(v, dict)]
+            if not all(_compare(op, values, arg) for op, arg in cond.items()):
+                return False
+        elif cond is None:
+            if values and not any(v is None for v in values):
+                return False
+        elif not any(_equal(v, cond) for v in values):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return _copy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = {k: v for k, v in projection.items() if k != '_id' and v}
+    if include:
+        out = {}
+        if projection.get('_id', 1):
+            out['_id'] = doc.get('_id')
+        for field, spec in include.items():
+            if isinstance(spec, dict) and '$slice' in spec:
+                value = _get(doc, field, _MISSING)
+                if value is not _MISSING:
+                    out[field] = _copy(value[spec['$slice']] if isinstance(spec['$slice'], int) and spec['$slice'] >= 0
+                                       else value[spec['$slice']:] if isinstance(spec['$slice'], int)
+                                       else value[spec['$slice'][0]:spec['$slice'][0] + spec['$slice'][1]])
+                continue
+            if isinstance(spec, dict) and '$elemMatch' in spec:
+                value = _get(doc, field, [])
+                match = next((item for item in value if matches(item, spec['$elemMatch'])), None)
+                if match is not None:
+                    out[field] = [_copy(match)]
+                continue
+            if field.endswith('.$'):
+                continue
+            if '.' in field and isinstance(doc.get(field.split('.')[0]), list):
+                # Mongo projects a path through an array into each element.
+                head, rest = field.split('.', 1)
+                picked = [_project(item, {'_id': 0, rest: 1}) for item in doc[head] if isinstance(item, dict)]
+                existing = out.get(head)
+                if isinstance(existing, list):
+                    for target, extra in zip(existing, picked):
+                        target.update(extra)
+                else:
+                    out[head] = picked
+                continue
+            _set_path(out, field, _copy(_get(doc, field)), create=_get(doc, field, _MISSING) is not _MISSING)
+        return out
+    out = _copy(doc)
+    for field, spec in projection.items():
+        if not spec:
+            _unset_path(out, field)
+    return out
+
+
+def _set_path(doc, path, value, create=True):
+    if not create:
+        return
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, list):
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, {})
+    if isinstance(doc, list):
+        doc[int(parts[-1])] = value
+    else:
+        doc[parts[-1]] = value
+
+
+def _unset_path(doc, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(doc, list):
+            doc = doc[int(part)] if part.isdigit() and int(part) < len(doc) else None
+        else:
+            doc = doc.get(part) if isinstance(doc, dict) else None
+        if doc is None:
+            return
+    if isinstance(doc, dict):
+        doc.pop(parts[-1], None)
+    elif isinstance(doc, list) and parts[-1].isdigit() and int(parts[-1]) < len(doc):
+        # Like mongod, unsetting an array element leaves a null in its place.
+        doc[int(parts[-1])] = None
+
+
+def _filtered_targets(doc, path, array_filters):
+    """Expand ``characters.$[c].name`` style paths into concrete paths."""
+    if '$[' not in path:
+        return [path]
+    head, rest = path.split('.$[', 1)
+    ident, tail = rest.split(']', 1)
+    tail = tail.lstrip('.')
+    conditions = {}
+    for flt in array_filters or []:
+        for key, value in flt.items():
+            name, _, field = key.partition('.')
+            if name == ident:
+                conditions[field] = value
+    array = _get(doc, head, [])
+    targets = []
+    for index, item in enumerate(array):
+        if not ident or matches(item, conditions):
+            targets.extend(_filtered_targets(doc, f'{head}.{index}' + (f'.{tail}' if tail else ''), array_filters))
+    return targets
+
+
+def _positional(doc, path, query):
+    if '.$.' not in path and not path.endswith('.$'):
+        return path
+    head = path.split('.$', 1)[0]
+    array = _get(doc, head, [])
+    sub = {}
+    for key, value in query.items():
+        if key.startswith(head + '.'):
+            sub[key[len(head) + 1:]] = value
+        elif key == head and isinstance(value, dict) and '$elemMatch' in value:
+            sub = value['$elemMatch']
+    for index, item in enumerate(array):
+        if isinstance(item, dict) and matches(item, sub):
+            return path.replace('.$', f'.{index}', 1)
+    return None
+
+
+def _apply_pipeline(doc, pipeline):
+    """An update given as an aggregation pipeline of ``$set``/``$addFields``/``$unset`` stages."""
+    for stage in pipeline:
+        (op, arg), = stage.items()
+        if op in ('$set', '$addFields'):
+            # Every expression in a stage sees the document as it entered the stage.
+            values = {field: _copy(_expression(doc, expr)) for field, expr in arg.items()}
+            for field, value in values.items():
+                _set_path(doc, field, value)
+        elif op == '$unset':
+            for field in [arg] if isinstance(arg, str) else arg:
+                _unset_path(doc, field)
+        else:
+            raise NotImplementedError(f'fakedb: unsupported update stage {op}')
+
+
+def apply_update(doc, update, query=None, array_filters=None, inserting=False):
+    if isinstance(update, list):
+        return _apply_pipeline(doc, update)
+    for op, fields in update.items():
+        if op == '$setOnInsert':
+            if inserting:
+                for path, value in fields.items():
+                    _set_path(doc, path, _copy(value))
+            continue
+        for path, value in fields.items():
+            paths = [_positional(doc, path, query or {})]
+            if paths[0] is None:
+                continue
+            paths = [p for target in paths for p in _filtered_targets(doc, target, array_filters)]
+            for target in paths:
+                if op == '$set':
+                    _set_path(doc, target, _copy(value))
+                elif op == '$unset':
+                    _unset_path(doc, target)
+                elif op == '$inc':
+                    _set_path(doc, target, _get(doc, target, 0) + value)
+                elif op == '$max':
+                    current = _get(doc, target, _MISSING)
+                    if current is _MISSING or value > current:
+                        _set_path(doc, target, _copy(value))
+                elif op == '$min':
+                    current = _get(doc, target, _MISSING)
+                    if current is _MISSING or value < current:
+                        _set_path(doc, target, _copy(value))
+                elif op == '$push':
+                    array = _get(doc, target, _MISSING)
+                    if array is _MISSING:
+                        array = []
+                        _set_path(doc, target, array)
+                    if isinstance(value, dict) and '$each' in value:
+                        array.extend(_copy(value['$each']))
+                    else:
+                        array.append(_copy(value))
+                elif op == '$addToSet':
+                    array = _get(doc, target, _MISSING)
+                    if array is _MISSING:
+                        array = []
+                        _set_path(doc, target, array)
+                    items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                    for item in items:
+                        if item not in array:
+                            array.append(_copy(item))
+                elif op == '$pull':
+                    array = _get(doc, target, [])
+                    if isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+                        keep = [item for item in array if not all(_compare(k, [item], v) for k, v in value.items())]
+                    elif isinstance(value, dict):
+                        keep = [item for item in array if not (isinstance(item, dict) and matches(item, value))]
+                    else:
+                        keep = [item for item in array if item != value]
+                    array[:] = keep
+                elif op == '$pop':
+                    array = _get(doc, target, [])
+                    if array:
+                        array.pop(0 if value < 0 else -1)
+                else:
+                    raise NotImplementedError(f'fakedb: unsupported update operator {op}')
+
+
+def _sort_key(value):
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (4, str(value))
+
+
+def sort_docs(docs, spec):
+    if isinstance(spec, dict):
+        spec = list(spec.items())
+    for field, direction in reversed(spec):
+        docs.sort(key=lambda d: _sort_key(_get(d, field)), reverse=direction < 0)
+    return docs
+
+
+class _Done:
+    """Awaitable that resolves immediately, for calls the caller may not await."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def __await__(self):
+        if False:
+            yield
+        return self.value
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection=None, sort=None, limit=0, skip=0):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = list(sort) if sort else []
+        self._limit = limit
+        self._skip = skip
+        self._buffer = None
+
+    def sort(self, key, direction=1):
+        if isinstance(key, (list, tuple)):
+            self._sort.extend(key)
+        else:
+            self._sort.append((key, direction))
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _materialize(self):
+        docs = self._collection._candidates(self._query)
+        if self._sort:
+            docs = sort_docs(list(docs), self._sort)
+        docs = islice(docs, self._skip, self._skip + self._limit if self._limit else None)
+        return [_project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        await self._collection._tick()
+        docs = self._materialize()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._buffer is None:
+            await self._collection._tick()
+            self._buffer = iter(self._materialize())
+        try:
+            return next(self._buffer)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeAggregateCursor(FakeCursor):
+    def __init__(self, collection, pipeline):
+        super().__init__(collection, {})
+        self._pipeline = pipeline
+
+    def _materialize(self):
+        stages = list(self._pipeline)
+        query = stages.pop(0)['$match'] if stages and '$match' in stages[0] else {}
+        docs = [_copy(doc) for doc in self._collection._candidates(query)]
+        for stage in stages:
+            (op, arg), = stage.items()
+            if op == '$match':
+                docs = [doc for doc in docs if matches(doc, arg)]
+            elif op == '$project':
+                docs = [_aggregate_project(doc, arg) for doc in docs]
+            elif op == '$sort':
+                docs = sort_docs(docs, arg)
+            elif op == '$limit':
+                docs = docs[:arg]
+            elif op == '$skip':
+                docs = docs[arg:]
+            elif op == '$unwind':
+                path = arg.lstrip('$') if isinstance(arg, str) else arg['path'].lstrip('$')
+                docs = [{**doc, path: item} for doc in docs for item in _get(doc, path, [])]
+            elif op == '$group':
+                docs = _aggregate_group(docs, arg)
+            elif op == '$count':
+                docs = [{arg: len(docs)}]
+            else:
+                raise NotImplementedError(f'fakedb: unsupported stage {op}')
+        return docs
+
+
+def _field_path(value, path):
+    """An aggregation ``$a.b`` path, where a path through an array yields an array of values."""
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list):
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return None
+    return value
+
+
+# Values of ``$$name`` while a ``$map`` evaluates its ``in`` expression.
+_variables = {}
+
+
+def _expression(doc, expr):
+    if isinstance(expr, str) and expr.startswith('$$'):
+        name, _, path = expr[2:].partition('.')
+        value = _variables.get(name)
+        return _field_path(value, path) if path else value
+    if isinstance(expr, str) and expr.startswith('$'):
+        return _field_path(doc, expr[1:])
+    if isinstance(expr, dict):
+        (op, arg), = expr.items()
+        if op == '$size':
+            return len(_expression(doc, arg) or [])
+        if op in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte'):
+            left, right = (_expression(doc, item) for item in arg)
+            # BSON order puts null (and missing) before everything else.
+            order = {'$eq': lambda c: c == 0, '$ne': lambda c: c != 0, '$gt': lambda c: c > 0,
+                     '$gte': lambda c: c >= 0, '$lt': lambda c: c < 0, '$lte': lambda c: c <= 0}[op]
+            if left is None or right is None:
+                return order((left is not None) - (right is not None))
+            return order((left > right) - (left < right))
+        if op == '$cond':
+            condition, then, otherwise = arg if isinstance(arg, list) else (arg['if'], arg['then'], arg['else'])
+            return _expression(doc, then if _expression(doc, condition) else otherwise)
+        if op == '$add':
+            return sum(_expression(doc, item) or 0 for item in arg)
+        if op in ('$max', '$min'):
+            values = [value for value in (_expression(doc, item) for item in arg) if value is not None]
+            return (max if op == '$max' else min)(values) if values else None
+        if op == '$literal':
+            return arg
+        if op in ('$map', '$filter'):
+            name = arg.get('as', 'this')
+            saved = _variables.get(name, _MISSING)
+            out = []
+            try:
+                for item in _expression(doc, arg['input']) or []:
+                    _variables[name] = item
+                    if op == '$map':
+                        out.append(_expression(doc, arg['in']))
+                    elif _expression(doc, arg['cond']):
+                        out.append(item)
+            finally:
+                if saved is _MISSING:
+                    _variables.pop(name, None)
+                else:
+                    _variables[name] = saved
+            return out
+        if op == '$indexOfArray':
+            array, value = _expression(doc, arg[0]) or [], _expression(doc, arg[1])
+            return next((i for i, item in enumerate(array) if _equal(item, value)), -1)
+        if op == '$concatArrays':
+            out = []
+            for item in arg:
+                out.extend(_expression(doc, item) or [])
+            return out
+        if op == '$slice':
+            array, *bounds = [_expression(doc, item) for item in arg]
+            array = array or []
+            if len(bounds) == 1:
+                n = bounds[0]
+                return array[:n] if n >= 0 else array[n:]
+            start, n = bounds
+            return array[start:start + n]
+        if op == '$setIntersection':
+            first, *others = [_expression(doc, item) or [] for item in arg]
+            out = []
+            for value in first:
+                if value not in out and all(value in other for other in others):
+                    out.append(value)
+            return out
+        if op == '$ifNull':
+            value = _expression(doc, arg[0])
+            return _expression(doc, arg[1]) if value is None else value
+        raise NotImplementedError(f'fakedb: unsupported expression {op}')
+    return expr
+
+
+def _aggregate_project(doc, spec):
+    out = {}
+    if spec.get('_id', 1):
+        out['_id'] = doc.get('_id')
+    for field, expr in spec.items():
+        if field == '_id':
+            continue
+        if expr in (1, True):
+            value = _get(doc, field, _MISSING)
+            if value is not _MISSING:
+                out[field] = value
+        else:
+            out[field] = _expression(doc, expr)
+    return out
+
+
+def _aggregate_group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _expression(doc, spec['_id'])
+        hashable = tuple(sorted(key.items())) if isinstance(key, dict) else key
+        group = groups.setdefault(hashable, {'_id': key})
+        for field, acc in spec.items():
+            if field == '_id':
+                continue
+            (op, arg), = acc.items()
+            value = _expression(doc, arg)
+            if op == '$sum':
+                group[field] = group.get(field, 0) + (value or 0)
+            elif op == '$max':
+                group[field] = value if field not in group else max(group[field], value)
+            elif op == '$min':
+                group[field] = value if field not in group else min(group[field], value)
+            elif op == '$first':
+                group.setdefault(field, value)
+            elif op == '$last':
+                group[field] = value
+            elif op == '$push':
+                group.setdefault(field, []).append(value)
+            elif op == '$addToSet':
+                bucket = group.setdefault(field, [])
+                if value not in bucket:
+                    bucket.append(value)
+            else:
+                raise NotImplementedError(f'fakedb: unsupported accumulator {op}')
+    return list(groups.values())
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = {}
+        self._indexes = {}
+        self._index_specs = {'_id_': {'key': [('_id', 1)]}}
+        self.ops = 0
+
+    async def _tick(self):
+        self.ops += 1
+        await self.database._tick()
+
+    # -- indexing -----------------------------------------------------------
+
+    def _index_keys(self, doc, field):
+        keys = set()
+        for value in _resolve(doc, field):
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            keys.add(value)
+        return keys
+
+    def _reindex(self, doc, old_keys=None):
+        for field, index in self._indexes.items():
+            if old_keys is not None:
+                for key in old_keys.get(field, ()):
+                    bucket = index.get(key)
+                    if bucket is not None:
+                        bucket.pop(doc['_id'], None)
+                        if not bucket:
+                            del index[key]
+            for key in self._index_keys(doc, field):
+                index.setdefault(key, {})[doc['_id']] = doc
+
+    def _keys_of(self, doc):
+        return {field: self._index_keys(doc, field) for field in self._indexes}
+
+    def _candidates(self, query):
+        for field, cond in query.items():
+            if field in self._indexes and not isinstance(cond, (dict, re.Pattern)) and not field.startswith('$'):
+                try:
+                    bucket = self._indexes[field].get(cond, {})
+                except TypeError:
+                    break
+                return [doc for doc in list(bucket.values()) if matches(doc, query)]
+        if '_id' in query and not isinstance(query['_id'], dict):
+            doc = self._docs.get(query['_id'])
+            return [doc] if doc is not None and matches(doc, query) else []
+        return [doc for doc in list(self._docs.values()) if matches(doc, query)]
+
+    def create_index(self, keys, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = list(keys)
+        field = keys[0][0]
+        name = kwargs.get('name') or '_'.join(f'{k}_{d}' for k, d in keys)
+        self._index_specs[name] = {'key': keys}
+        if field not in self._indexes:
+            self._indexes[field] = {}
+            for doc in self._docs.values():
+                for key in self._index_keys(doc, field):
+                    self._indexes[field].setdefault(key, {})[doc['_id']] = doc
+        return _Done(name)
+
+    async def index_information(self):
+        return _copy(self._index_specs)
+
+    def create_indexes(self, indexes):
+        return _Done([self.create_index(index.document['key'].items()).value for index in indexes])
+
+    # -- reads --------------------------------------------------------------
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        return FakeCursor(self, filter, projection, sort, limit, skip)
+
+    async def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        await self._tick()
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        docs = self._candidates(filter or {})
+        if sort:
+            docs = sort_docs(list(docs), sort)
+        return _project(docs[0], projection) if docs else None
+
+    async def count_documents(self, filter, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)
+        if kwargs.get('limit'):
+            return min(len(docs), kwargs['limit'])
+        return len(docs)
+
+    async def estimated_document_count(self, **kwargs):
+        await self._tick()
+        return len(self._docs)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        await self._tick()
+        seen = []
+        for doc in self._candidates(filter or {}):
+            for value in _resolve(doc, key):
+                if not isinstance(value, list) and value not in seen:
+                    seen.append(value)
+        return seen
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeAggregateCursor(self, pipeline)
+
+    # -- writes -------------------------------------------------------------
+
+    def _insert(self, document):
+        document.setdefault('_id', ObjectId())
+        if document['_id'] in self._docs:
+            raise KeyError(f"fakedb: duplicate _id {document['_id']!r} in {self.name}")
+        doc = _copy(document)
+        self._docs[doc['_id']] = doc
+        self._reindex(doc)
+        return doc
+
+    async def insert_one(self, document, **kwargs):
+        await self._tick()
+        doc = self._insert(document)
+        return InsertOneResult(doc['_id'], True)
+
+    async def insert_many(self, documents, **kwargs):
+        await self._tick()
+        ids = [self._insert(document)['_id'] for document in documents]
+        return InsertManyResult(ids, True)
+
+    def _update(self, filter, update, upsert=False, many=False, array_filters=None):
+        docs = self._candidates(filter)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            old_keys = self._keys_of(doc)
+            apply_update(doc, update, filter, array_filters)
+            self._reindex(doc, old_keys)
+        if not docs and upsert:
+            seed = {k: v for k, v in filter.items() if not k.startswith('$') and not isinstance(v, dict)}
+            doc = self._insert(seed)
+            old_keys = self._keys_of(doc)
+            apply_update(doc, update, filter, array_filters, inserting=True)
+            self._reindex(doc, old_keys)
+            return 0, 0, doc['_id']
+        return len(docs), len(docs), None
+
+    async def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        await self._tick()
+        matched, modified, upserted = self._update(filter, update, upsert, False, array_filters)
+        return UpdateResult({'n': matched or (1 if upserted else 0), 'nModified': modified, 'upserted': upserted}, True)
+
+    async def update_many(self, filter, update, upsert=False, array_filters=None, **kwargs):
+        await self._tick()
+        matched, modified, upserted = self._update(filter, update, upsert, True, array_filters)
+        return UpdateResult({'n': matched or (1 if upserted else 0), 'nModified': modified, 'upserted': upserted}, True)
+
+    async def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)[:1]
+        if docs:
+            old = docs[0]
+            old_keys = self._keys_of(old)
+            old.clear()
+            old.update(_copy(replacement))
+            old['_id'] = old.get('_id') or ObjectId()
+            self._reindex(old, old_keys)
+            return UpdateResult({'n': 1, 'nModified': 1}, True)
+        if upsert:
+            doc = self._insert(dict(replacement))
+            return UpdateResult({'n': 1, 'nModified': 0, 'upserted': doc['_id']}, True)
+        return UpdateResult({'n': 0, 'nModified': 0}, True)
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, array_filters=None, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)[:1]
+        if docs:
+            before = _copy(docs[0])
+            old_keys = self._keys_of(docs[0])
+            apply_update(docs[0], update, filter, array_filters)
+            self._reindex(docs[0], old_keys)
+            return _project(docs[0] if return_document == ReturnDocument.AFTER else before, projection)
+        if upsert:
+            _, _, upserted = self._update(filter, update, True, False, array_filters)
+            if return_document == ReturnDocument.AFTER:
+                return _project(self._docs[upserted], projection)
+        return None
+
+    def _delete(self, doc):
+        old_keys = self._keys_of(doc)
+        for field, keys in old_keys.items():
+            for key in keys:
+                bucket = self._indexes[field].get(key)
+                if bucket is not None:
+                    bucket.pop(doc['_id'], None)
+                    if not bucket:
+                        del self._indexes[field][key]
+        del self._docs[doc['_id']]
+
+    async def find_one_and_delete(self, filter, projection=None, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)[:1]
+        if not docs:
+            return None
+        self._delete(docs[0])
+        return _project(docs[0], projection)
+
+    async def delete_one(self, filter, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)[:1]
+        for doc in docs:
+            self._delete(doc)
+        return DeleteResult({'n': len(docs)}, True)
+
+    async def delete_many(self, filter, **kwargs):
+        await self._tick()
+        docs = self._candidates(filter)
+        for doc in docs:
+            self._delete(doc)
+        return DeleteResult({'n': len(docs)}, True)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._tick()
+        inserted = matched = modified = deleted = upserted = 0
+        for request in requests:
+            kind = type(request).__name__
+            if kind == 'InsertOne':
+                self._insert(request._doc)
+                inserted += 1
+            elif kind in ('UpdateOne', 'UpdateMany'):
+                n, m, up = self._update(request._filter, request._doc, request._upsert,
+                                        kind == 'UpdateMany', request._array_filters)
+                matched += n
+                modified += m
+                upserted += up is not None
+            elif kind == 'ReplaceOne':
+                await self.replace_one(request._filter, request._doc, request._upsert)
+                matched += 1
+            elif kind in ('DeleteOne', 'DeleteMany'):
+                docs = self._candidates(request._filter)
+                if kind == 'DeleteOne':
+                    docs = docs[:1]
+                for doc in docs:
+                    self._delete(doc)
+                deleted += len(docs)
+            else:
+                raise NotImplementedError(f'fakedb: unsupported bulk request {kind}')
+        return BulkWriteResult({'nInserted': inserted, 'nMatched': matched, 'nModified': modified,
+                                'nRemoved': deleted, 'nUpserted': upserted, 'upserted': []}, True)
+
+    async def drop(self):
+        self._docs.clear()
+        for index in self._indexes.values():
+            index.clear()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.database[f'{self.name}.{name}']
+
+
+class FakeDatabase:
+    def __init__(self, name='Character_catcher', latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.ops = 0
+        # Outage simulation: ``down`` refuses every call, ``stall`` adds seconds to each.
+        self.down = False
+        self.stall = 0.0
+        self._collections = {}
+
+    async def _tick(self):
+        self.ops += 1
+        if self.latency or self.stall:
+            await asyncio.sleep(self.latency + self.stall)
+        if self.down:
+            raise AutoReconnect('fakedb: database is down')
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    async def list_collection_names(self):
+        return list(self._collections)
+
+    async def create_collection(self, name, **kwargs):
+        return self[name]
+
+    async def command(self, command, *args, **kwargs):
+        await self._tick()
+        return {'ok': 1.0}
+
+    def collection_ops(self):
+        return {name: coll.ops for name, coll in self._collections.items() if coll.ops}
+
+    def reset_ops(self):
+        self.ops = 0
+        for coll in self._collections.values():
+            coll.ops = 0
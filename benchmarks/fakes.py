@@ -0,0 +1,155 @@
+"""Synthetic updates, contexts and a stub bot for driving handlers offline."""
+
+import itertools
+from collections import Counter
+from types import SimpleNamespace
+
+_message_ids = itertools.count(1)
+
+
+class StubBot:
+    """Accepts any Bot API / pyrogram call, counts it and returns a stub message."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.id = 1
+        self.username = 'bench_bot'
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            self.calls[name] += 1
+            return StubMessage(self, chat_id=kwargs.get('chat_id'), text=kwargs.get('text'),
+                               caption=kwargs.get('caption'))
+
+        return call
+
+
+class StubMessage:
+    def __init__(self, bot, chat_id=None, text=None, caption=None, from_user=None,
+                 reply_to_message=None, command=None, chat=None):
+        self._bot = bot
+        self.message_id = next(_message_ids)
+        self.chat_id = chat_id
+        self.text = text
+        self.caption = caption
+        self.from_user = from_user
+        self.reply_to_message = reply_to_message
+        self.command = command
+        self.chat = chat
+        self.message_thread_id = None
+
+    async def _record(self, name, text=None, caption=None):
+        self._bot.calls[name] += 1
+        return StubMessage(self._bot, chat_id=self.chat_id, text=text, caption=caption)
+
+    async def reply_text(self, text, *args, **kwargs):
+        return await self._record('reply_text', text=text)
+
+    async def reply_photo(self, photo=None, *args, caption=None, **kwargs):
+        return await self._record('reply_photo', caption=caption)
+
+    async def reply_document(self, document=None, *args, **kwargs):
+        return await self._record('reply_document')
+
+    async def edit_text(self, text, *args, **kwargs):
+        return await self._record('edit_text', text=text)
+
+    async def edit_caption(self, caption, *args, **kwargs):
+        return await self._record('edit_caption', caption=caption)
+
+
+class StubInlineQuery:
+    def __init__(self, bot, user, query, offset=''):
+        self._bot = bot
+        self.id = str(next(_message_ids))
+        self.from_user = user
+        self.query = query
+        self.offset = offset
+        self.answers = []
+
+    async def answer(self, results, *args, **kwargs):
+        self._bot.calls['answer_inline_query'] += 1
+        self.answers.append((results, kwargs))
+        return True
+
+
+class StubCallbackQuery:
+    def __init__(self, bot, user, data, message):
+        self._bot = bot
+        self.id = str(next(_message_ids))
+        self.from_user = user
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        self._bot.calls['answer_callback_query'] += 1
+        return True
+
+    async def edit_message_text(self, text, *args, **kwargs):
+        self._bot.calls['edit_message_text'] += 1
+        return True
+
+    async def edit_message_caption(self, caption=None, *args, **kwargs):
+        self._bot.calls['edit_message_caption'] += 1
+        return True
+
+
+def make_user(user_id, first_name=None, username=None):
+    first_name = first_name or f'User{user_id}'
+    username = username or f'user{user_id}'
+    return SimpleNamespace(id=user_id, first_name=first_name, username=username, is_bot=False,
+                           mention=f'<a href="tg://user?id={user_id}">{first_name}</a>')
+
+
+def make_chat(chat_id, title=None, type='supergroup'):
+    return SimpleNamespace(id=chat_id, title=title or f'Group {chat_id}', type=type, is_forum=False)
+
+
+def message_update(bot, chat_id, user_id, text='hello', title=None):
+    """A PTB-shaped ``Update`` carrying a text message."""
+    user = make_user(user_id)
+    chat = make_chat(chat_id, title, 'private' if chat_id == user_id else 'supergroup')
+    message = StubMessage(bot, chat_id=chat_id, text=text, from_user=user, chat=chat)
+    return SimpleNamespace(update_id=message.message_id, effective_chat=chat, effective_user=user,
+                           effective_message=message, message=message, callback_query=None,
+                           inline_query=None)
+
+
+def inline_update(bot, user_id, query, offset=''):
+    user = make_user(user_id)
+    inline_query = StubInlineQuery(bot, user, query, offset)
+    return SimpleNamespace(update_id=next(_message_ids), effective_chat=None, effective_user=user,
+                           effective_message=None, message=None, callback_query=None,
+                           inline_query=inline_query)
+
+
+def callback_update(bot, chat_id, user_id, data, caption=None):
+    user = make_user(user_id)
+    chat = make_chat(chat_id)
+    message = StubMessage(bot, chat_id=chat_id, caption=caption, chat=chat)
+    query = StubCallbackQuery(bot, user, data, message)
+    return SimpleNamespace(update_id=next(_message_ids), effective_chat=chat, effective_user=user,
+                           effective_message=message, message=None, callback_query=query,
+                           inline_query=None)
+
+
+def make_context(bot, args=None):
+    return SimpleNamespace(bot=bot, args=list(args or []), bot_data={}, chat_data={}, user_data={})
+
+
+def pyrogram_message(bot, chat_id, user_id, command, reply_to_user_id=None):
+    """A pyrogram-shaped ``Message`` for the trade/gift command handlers."""
+    chat = make_chat(chat_id)
+    reply_to = None
+    if reply_to_user_id is not None:
+        reply_to = StubMessage(bot, chat_id=chat_id, from_user=make_user(reply_to_user_id), chat=chat)
+    return StubMessage(bot, chat_id=chat_id, from_user=make_user(user_id), reply_to_message=reply_to,
+                       command=list(command), chat=chat)
+
+
+def pyrogram_callback(bot, chat_id, user_id, data, reply_to_user_id=None):
+    message = pyrogram_message(bot, chat_id, user_id, [], reply_to_user_id)
+    return StubCallbackQuery(bot, make_user(user_id), data, message)
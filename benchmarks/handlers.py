@@ -0,0 +1,193 @@
+"""Scenarios that drive the real handler functions."""
+
+import asyncio
+import importlib
+
+import shivu
+
+from benchmarks import fakes
+from benchmarks.runner import Scenario
+
+
+def build(core, bot, catalog, group_ids, users, only=None):
+    harem = importlib.import_module('shivu.modules.harem')
+    inline = importlib.import_module('shivu.modules.inlinequery')
+    board = importlib.import_module('shivu.modules.leaderboard')
+    trade = importlib.import_module('shivu.modules.trade')
+    progress = importlib.import_module('shivu.modules.progress')
+    scheduler = importlib.import_module('shivu.scheduler')
+    events = importlib.import_module('shivu.events')
+    start = importlib.import_module('shivu.modules.start')
+    registration = importlib.import_module('shivu.registration')
+
+    groups = group_ids or [-1000000000]
+    user_ids = list(range(1, users + 1)) or [1]
+
+    def chat_of(i):
+        return groups[i % len(groups)]
+
+    def user_of(i):
+        return user_ids[i % len(user_ids)]
+
+    def character_of(i):
+        return catalog[(i * 7919) % len(catalog)]
+
+    async def counter(i):
+        await core.message_counter(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot))
+
+    async def spawn(i):
+        await core.send_image(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot))
+
+    async def prepare_guess(i):
+        core.last_characters[chat_of(i)] = dict(character_of(i))
+        core.first_correct_guesses.pop(chat_of(i), None)
+
+    async def correct_guess(i):
+        name = core.last_characters[chat_of(i)]['name']
+        await core.guess(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot, name.split()))
+
+    async def drain_catches(i):
+        # Everything the guesses appended so far, then 100 more, through every consumer.
+        for n in range(100):
+            events.event_log.append(events.CATCH, user_of(i * 100 + n), [character_of(i * 100 + n)['id']],
+                                    username=None, first_name='User', group_id=chat_of(i * 100 + n),
+                                    group_name='Group')
+        await events.event_log.flush()
+        await events.event_log.consume_all()
+
+    async def wrong_guess(i):
+        await core.guess(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot, ['nobody']))
+
+    async def prepare_start(i):
+        # A user who started the bot recently, so their names are in the seen cache.
+        user = fakes.make_user(user_of(i))
+        registration.registrations.seen[user.id] = (user.first_name, user.username)
+
+    async def start_repeat(i):
+        user_id = user_of(i)
+        await start.start(fakes.message_update(bot, user_id, user_id, '/start'), fakes.make_context(bot))
+
+    async def start_new(i):
+        user_id = 10 ** 9 + i
+        await start.start(fakes.message_update(bot, user_id, user_id, '/start'), fakes.make_context(bot))
+
+    def inline_query(query, offset=''):
+        async def run(i):
+            text = query.format(user=user_of(i))
+            await inline.inlinequery(fakes.inline_update(bot, user_of(i), text, offset), fakes.make_context(bot))
+        return run
+
+    async def typing(i):
+        # One user typing "Anime 12": every keystroke is a new inline query.
+        text = 'Anime 12'
+        await asyncio.gather(*(
+            inline.inlinequery(fakes.inline_update(bot, user_of(i), text[:n]), fakes.make_context(bot))
+            for n in range(1, len(text) + 1)))
+
+    async def drop_inline_caches(i):
+        # Cold variants measure the render path rather than the results cache.
+        cache = getattr(inline, 'results_cache', None)
+        if cache is not None:
+            cache.clear()
+
+    async def harem_command(i):
+        await harem.harem(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot))
+
+    async def harem_page(i):
+        user_id = user_of(i)
+        update = fakes.callback_update(bot, chat_of(i), user_id, f'harem:1:{user_id}')
+        await harem.harem_callback(update, fakes.make_context(bot))
+
+    def board_command(command, args=()):
+        async def run(i):
+            await command(fakes.message_update(bot, chat_of(i), user_of(i)), fakes.make_context(bot, args))
+        return run
+
+    timers = scheduler.SpawnScheduler()
+
+    async def timer_touch(i):
+        # Activity spread over 50k chats, as message_counter reports it.
+        timers.touch(-1000000000 - (i * 7919) % 50000, 600)
+
+    owned = {}
+
+    async def owned_character(user_id):
+        if user_id not in owned:
+            user = await shivu.user_collection.find_one({'id': user_id})
+            owned[user_id] = user['characters'][0]['id'] if user and user['characters'] else None
+        return owned[user_id]
+
+    def trade_pair(i):
+        sender = user_of(2 * i)
+        receiver = user_of(2 * i + 1)
+        return sender, receiver
+
+    async def trade_command(i):
+        sender, receiver = trade_pair(i)
+        mine, theirs = await owned_character(sender), await owned_character(receiver)
+        message = fakes.pyrogram_message(bot, chat_of(i), sender, ['trade', mine, theirs], receiver)
+        await trade.trade(None, message)
+        trade.pending_trades.clear()
+
+    async def prepare_trade(i):
+        sender, receiver = trade_pair(i)
+        owned.pop(sender, None)
+        owned.pop(receiver, None)
+        trade.pending_trades.clear()
+        trade.pending_trades[(sender, receiver)] = (await owned_character(sender), await owned_character(receiver))
+
+    async def confirm_trade(i):
+        sender, receiver = trade_pair(i)
+        query = fakes.pyrogram_callback(bot, chat_of(i), receiver, 'confirm_trade', sender)
+        await trade.trade_callback(None, query)
+
+    async def prepare_gift(i):
+        sender, receiver = trade_pair(i)
+        owned.pop(sender, None)
+        user = await shivu.user_collection.find_one({'id': sender})
+        trade.pending_gifts.clear()
+        trade.pending_gifts[(sender, receiver)] = {
+            'character': user['characters'][0],
+            'receiver_username': f'user{receiver}',
+            'receiver_first_name': f'User{receiver}',
+        }
+
+    async def confirm_gift(i):
+        sender, receiver = trade_pair(i)
+        query = fakes.pyrogram_callback(bot, chat_of(i), sender, 'confirm_gift', receiver)
+        await trade.gift_callback(None, query)
+
+    scenarios = [
+        Scenario('message_counter', counter),
+        Scenario('send_image', spawn),
+        Scenario('guess.correct', correct_guess, prepare_guess),
+        Scenario('guess.wrong', wrong_guess, prepare_guess),
+        Scenario('events.drain100', drain_catches),
+        Scenario('start.repeat', start_repeat, prepare_start),
+        Scenario('start.new', start_new),
+        Scenario('inline.catalog', inline_query('')),
+        Scenario('inline.catalog.page20', inline_query('', '950')),
+        Scenario('inline.search', inline_query('Anime 1')),
+        Scenario('inline.collection', inline_query('collection.{user}')),
+        Scenario('inline.catalog.cold', inline_query(''), drop_inline_caches),
+        Scenario('inline.typing.cold', typing, drop_inline_caches),
+        Scenario('inline.search.cold', inline_query('Anime 1'), drop_inline_caches),
+        Scenario('inline.collection.cold', inline_query('collection.{user}'), drop_inline_caches),
+        Scenario('scheduler.touch', timer_touch),
+        Scenario('progress', board_command(progress.progress)),
+        Scenario('progress.anime', board_command(progress.progress, ['Anime', '1'])),
+        Scenario('harem', harem_command),
+        Scenario('harem_callback', harem_page),
+        Scenario('leaderboard', board_command(board.leaderboard)),
+        Scenario('leaderboard.week', board_command(board.leaderboard, ['week'])),
+        Scenario('ctop', board_command(board.ctop)),
+        Scenario('ctop.month', board_command(board.ctop, ['month'])),
+        Scenario('global_leaderboard', board_command(board.global_leaderboard)),
+        Scenario('global_leaderboard.week', board_command(board.global_leaderboard, ['week'])),
+        Scenario('trade', trade_command),
+        Scenario('trade.confirm', confirm_trade, prepare_trade),
+        Scenario('gift.confirm', confirm_gift, prepare_gift),
+    ]
+    if only:
+        scenarios = [s for s in scenarios if any(s.name.startswith(prefix) for prefix in only)]
+    return scenarios
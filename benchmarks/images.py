@@ -0,0 +1,177 @@
+"""Catalog image checks against a local image server with planted failures.
+
+    python -m benchmarks.images --characters 5000 --concurrency 1 16 64 --latency 50
+
+Serves PNG and JPEG images (honouring Range, or ignoring it for some), and
+404s, HTML pages, images over Telegram's 5 MiB and URLs that never answer
+in time. Every ``--broken-every``-th character gets one of the failures, and
+as many again are flaky: they answer 503 or 429 the first time, then work.
+For each concurrency, ``ImageScanner.scan`` checks the whole catalog from
+scratch, then retries until transient failures have had their
+``IMAGE_TRANSIENT_FAILURES`` chances; the report gives checks per second
+and whether exactly the planted failures (and none of the flaky URLs) ended
+up quarantined.
+"""
+
+import argparse
+import asyncio
+import json
+import struct
+import sys
+import time
+import zlib
+
+from aiohttp import web
+
+import shivu
+from benchmarks import env
+from benchmarks.runner import format_table
+
+FAILURES = ('missing', 'html', 'huge', 'slow', 'tall')
+FLAKY = ('unavailable', 'limited')
+
+
+def png(width, height, size):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    return header + chunk(b'IDAT', b'\0' * max(0, size - len(header) - 24)) + chunk(b'IEND', b'')
+
+
+def jpeg(width, height, size):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0\1\1\0\0\1\0\1\0\0'
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\1\x11\0'
+    body = b'\xff\xd8' + app0 + sof
+    return body + b'\0' * max(0, size - len(body) - 2) + b'\xff\xd9'
+
+
+class ImageServer:
+
+    def __init__(self, latency, timeout):
+        self.latency = latency
+        self.timeout = timeout
+        self.requests = 0
+        self.bytes_sent = 0
+        self.flaked = set()
+        self.images = {'png': png(800, 1200, 300 * 1024), 'jpg': jpeg(1280, 720, 200 * 1024),
+                       'tall': png(300, 9000, 50 * 1024)}
+        self.app = web.Application()
+        self.app.router.add_get('/{kind}/{name}', self.handle)
+        self._runner = None
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request):
+        self.requests += 1
+        kind = request.match_info['kind']
+        await asyncio.sleep(self.latency + (self.timeout + 1 if kind == 'slow' else 0))
+        if kind in FLAKY and request.path not in self.flaked:
+            self.flaked.add(request.path)
+            return web.Response(status=503 if kind == 'unavailable' else 429, text='try again later')
+        if kind == 'missing':
+            return web.Response(status=404, text='not found')
+        if kind == 'html':
+            return web.Response(text='<html>moved</html>', content_type='text/html')
+        body = self.images['tall' if kind == 'tall' else 'jpg' if kind == 'jpg' else 'png']
+        total = 8 * 1024 * 1024 if kind == 'huge' else len(body)
+        content_type = 'image/jpeg' if kind == 'jpg' else 'image/png'
+        byte_range = request.headers.get('Range', '')
+        if kind != 'norange' and byte_range.startswith('bytes=0-'):
+            end = min(int(byte_range[8:]), len(body) - 1)
+            self.bytes_sent += end + 1
+            return web.Response(status=206, body=body[:end + 1], content_type=content_type,
+                                headers={'Content-Range': f'bytes 0-{end}/{total}'})
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type=content_type)
+
+
+def url_of(base, i, broken_every):
+    if broken_every and i % broken_every == 0:
+        return f'{base}/{FAILURES[(i // broken_every) % len(FAILURES)]}/{i}'
+    if broken_every and i % broken_every == broken_every // 2:
+        return f'{base}/{FLAKY[(i // broken_every) % len(FLAKY)]}/{i}'
+    return f"{base}/{('png', 'jpg', 'norange')[i % 3]}/{i}"
+
+
+async def run(args):
+    server = ImageServer(args.latency / 1000, args.timeout)
+    base = await server.start()
+    db = env.open_database(args.mongo_url)
+    env.install(db)
+    catalog_docs, _ = await env.seed(db, args.characters, 1, 1, 1)
+    for i, character in enumerate(catalog_docs):
+        await shivu.collection.update_one({'id': character['id']}, {'$set': {'img_url': url_of(base, i, args.broken_every)}})
+    planted = {c['id'] for i, c in enumerate(catalog_docs) if args.broken_every and i % args.broken_every == 0}
+
+    from shivu import images
+    from shivu.catalog import catalog
+    from shivu.sampling import sampler
+    from shivu.startup import setup_indexes
+    await setup_indexes()
+    await catalog.load()
+    images.PASS_SIZE = max(images.PASS_SIZE, args.characters)
+
+    rows = []
+    try:
+        for concurrency in args.concurrency:
+            await shivu.image_checks_collection.drop()
+            for character_id in list(sampler.quarantined):
+                sampler.release(character_id)
+            # interval=0: a transient failure is due again on the very next pass.
+            scanner = images.ImageScanner(concurrency, 0, 3600, 600, args.timeout, shivu.IMAGE_TRANSIENT_FAILURES)
+            scanner.report = lambda newly_broken: asyncio.sleep(0)
+            server.requests = server.bytes_sent = 0
+            server.flaked.clear()
+            start = time.perf_counter()
+            checked = await scanner.scan()
+            elapsed = time.perf_counter() - start
+            retried = 0
+            for _ in range(shivu.IMAGE_TRANSIENT_FAILURES - 1):
+                retried += await scanner.scan()
+            quarantined = set(scanner.broken)
+            rescan = await scanner.scan()
+            await scanner.stop()
+            rows.append({
+                'concurrency': concurrency,
+                'checked': checked,
+                'seconds': round(elapsed, 2),
+                'checks_per_sec': round(checked / elapsed, 1),
+                'kib_per_check': round(server.bytes_sent / 1024 / max(1, server.requests), 1),
+                'quarantined': len(quarantined),
+                'planted': len(planted),
+                'retried': retried,
+                'exact': quarantined == planted,
+                'rescanned_immediately': rescan,
+            })
+    finally:
+        await server.stop()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.images', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--latency', type=float, default=50.0, help='ms the image server takes per request')
+    parser.add_argument('--timeout', type=float, default=1.0, help='seconds one check may take')
+    parser.add_argument('--broken-every', type=int, default=50)
+    parser.add_argument('--mongo-url', help='store checks on a local mongod instead of the fake')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    rows = shivu.shivuu.loop.run_until_complete(run(args))
+    print(json.dumps(rows) if args.json else format_table(rows))
+    return 0 if all(row['exact'] for row in rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
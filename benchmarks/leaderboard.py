@@ -0,0 +1,150 @@
+"""/ctop and /TopGroups across many groups: the old aggregation, index misses and the cache.
+
+    python -m benchmarks.leaderboard --groups 100000 --members 5 --cache-size 10000
+
+``ctop.aggregate`` is the pipeline ``/ctop`` used to run. ``ctop.miss`` is the
+indexed fallback the cache uses when a group isn't cached. ``ctop.hit`` is a
+cached group, and ``catch`` is the in-place update a guess makes. ``mixed``
+sends 90% catches and 10% ``/ctop`` to random groups, with a cache smaller
+than the number of groups, so evictions happen.
+"""
+
+import argparse
+import json
+import random
+import sys
+
+import shivu
+from benchmarks import env
+from benchmarks.runner import Scenario, format_table, measure
+
+
+async def seed(db, groups, members, seed=1):
+    rng = random.Random(seed)
+    totals = db[shivu.group_user_totals_collection.name]
+    await totals.drop()
+    rows, group_rows = [], []
+    for g in range(groups):
+        group_id = -1000000000 - g
+        total = 0
+        for m in range(members):
+            count = rng.randint(1, 500)
+            total += count
+            user_id = g * members + m + 1
+            rows.append({'group_id': group_id, 'user_id': user_id, 'username': f'user{user_id}',
+                         'first_name': f'User{user_id}', 'count': count})
+        group_rows.append({'group_id': group_id, 'group_name': f'Group {g}', 'count': total})
+    for start in range(0, len(rows), 10000):
+        await totals.insert_many(rows[start:start + 10000])
+    groups_collection = db[shivu.top_global_groups_collection.name]
+    await groups_collection.drop()
+    for start in range(0, len(group_rows), 10000):
+        await groups_collection.insert_many(group_rows[start:start + 10000])
+
+
+async def run(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db)
+    await seed(db, args.groups, args.members)
+    from shivu import leaderboards
+    from shivu.startup import setup_indexes
+    await setup_indexes()
+
+    boards = leaderboards.Leaderboard('bench_group_leaderboards', 'user_id', leaderboards.repository.group_top,
+                                      maxsize=args.cache_size)
+    rng = random.Random(2)
+    group_ids = [-1000000000 - g for g in range(args.groups)]
+    counts = {}
+
+    def group_of(i):
+        return group_ids[(i * 7919) % len(group_ids)]
+
+    async def aggregate(i):
+        cursor = shivu.group_user_totals_collection.aggregate([
+            {"$match": {"group_id": group_of(i)}},
+            {"$project": {"username": 1, "first_name": 1, "character_count": "$count"}},
+            {"$sort": {"character_count": -1}},
+            {"$limit": 10}
+        ])
+        await cursor.to_list(length=10)
+
+    async def forget(i):
+        boards.forget(group_of(i))
+
+    async def ctop(i):
+        await boards.top(group_of(i))
+
+    async def warm(i):
+        await boards.top(group_of(i))
+
+    def catch_row(group_id):
+        user_id = rng.randrange(args.members * args.groups) + 1
+        count = counts[user_id] = counts.get(user_id, 500) + 1
+        return {'user_id': user_id, 'username': f'user{user_id}', 'first_name': f'User{user_id}', 'count': count}
+
+    async def catch(i):
+        group_id = group_of(i)
+        boards.bumped(group_id, catch_row(group_id))
+
+    async def mixed(i):
+        group_id = group_ids[rng.randrange(len(group_ids))]
+        if rng.random() < 0.9:
+            boards.bumped(group_id, catch_row(group_id))
+        else:
+            await boards.top(group_id)
+
+    async def top_groups(i):
+        await leaderboards.top_groups.top()
+
+    async def top_groups_miss(i):
+        leaderboards.top_groups.forget()
+        await leaderboards.top_groups.top()
+
+    scenarios = [
+        Scenario('ctop.aggregate', aggregate, iterations=min(args.iterations, 20)),
+        Scenario('ctop.miss', ctop, forget),
+        Scenario('ctop.hit', ctop, warm),
+        Scenario('catch', catch, warm),
+        Scenario('mixed', mixed),
+        Scenario('topgroups.miss', top_groups_miss, iterations=min(args.iterations, 20)),
+        Scenario('topgroups.hit', top_groups),
+    ]
+    if args.only:
+        scenarios = [s for s in scenarios if any(s.name.startswith(prefix) for prefix in args.only)]
+
+    results = []
+    for scenario in scenarios:
+        results.append((await measure(scenario, args.iterations, args.warmup, 1, db)).as_dict())
+    return results, boards
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.leaderboard', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=100000)
+    parser.add_argument('--members', type=int, default=5, help='rows per group in group_user_totals')
+    parser.add_argument('--cache-size', type=int, default=10000, help='groups kept in the cache')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='benchmark against a local mongod instead of the fake')
+    parser.add_argument('--only', nargs='*', help='scenario name prefixes to run')
+    parser.add_argument('--json', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results, boards = shivu.shivuu.loop.run_until_complete(run(args))
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f'groups={args.groups} members={args.members} cache_size={args.cache_size} '
+              f'cached={len(boards.boards)} hit_rate={boards.boards.hit_rate:.1%}')
+        print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Bytes per character and per cached user, as dicts and as interned records.
+
+    python -m benchmarks.memory --characters 20000 --users 2000 --inventory 200
+
+Documents go through a BSON round trip first, so every embedded character is
+a separate dict with its own strings and ``_id``, as motor hands them over.
+"Before" keeps them that way; "after" converts the catalog to ``Character``
+records and interns user collections the way ``shivu.inventory`` does.
+"""
+
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+import bson
+
+from benchmarks import env
+from shivu.catalog import Catalog, Character
+
+
+def allocated(build):
+    """Return what ``build()`` returns and the bytes still allocated for it."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def run(args):
+    rng = random.Random(1)
+    animes = max(1, args.characters // 20)
+    docs = [env.make_character(i, animes) for i in range(args.characters)]
+    for doc in docs:
+        doc['_id'] = bson.ObjectId()
+    encoded_catalog = [bson.encode(doc) for doc in docs]
+    encoded_users = [bson.encode({
+        '_id': bson.ObjectId(), 'id': user_id, 'username': f'user{user_id}', 'first_name': f'User{user_id}',
+        'characters': [rng.choice(docs) for _ in range(args.inventory)],
+    }) for user_id in range(args.users)]
+
+    report = {'characters': args.characters, 'users': args.users, 'inventory': args.inventory}
+
+    _, size = allocated(lambda: [bson.decode(raw) for raw in encoded_catalog])
+    report['bytes_per_character_before'] = round(size / args.characters)
+    _, size = allocated(lambda: [bson.decode(raw) for raw in encoded_users])
+    report['bytes_per_user_before'] = round(size / max(args.users, 1))
+
+    catalog = Catalog()
+
+    def load():
+        catalog.characters = [Character.from_doc(bson.decode(raw)) for raw in encoded_catalog]
+        catalog.by_id = {c.id: c for c in catalog.characters}
+
+    _, size = allocated(load)
+    report['bytes_per_character_after'] = round(size / args.characters)
+
+    def users():
+        result = []
+        for raw in encoded_users:
+            user = bson.decode(raw)
+            user['characters'] = [catalog.intern(c) for c in user['characters']]
+            result.append(user)
+        return result
+
+    _, size = allocated(users)
+    report['bytes_per_user_after'] = round(size / max(args.users, 1))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.memory', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--inventory', type=int, default=100)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    print(json.dumps(run(parse_args(argv)), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
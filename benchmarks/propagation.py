@@ -0,0 +1,84 @@
+"""Catch latency while an /update is copied into every owner's collection.
+
+    python -m benchmarks.propagation --users 20000 --db-latency 1 --duty 0.25
+
+Seeds users who all own the edited character, then times the writes a
+correct guess makes, first alone and then while ``Propagator`` works through
+the owners. Also reports how long the propagation took. Run against a real
+mongod with ``--mongo-url`` to see actual contention. The fake database
+applies a whole batch on the event loop, so there the catch p99 mostly
+reflects ``--batch-size``.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from bson import ObjectId
+
+import shivu
+from benchmarks import env
+from benchmarks.runner import Scenario, format_table, measure
+
+
+async def run(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db)
+    catalog, group_ids = await env.seed(db, args.characters, args.users, args.inventory, 10)
+    from shivu import repository
+    from shivu.propagation import Propagator
+    from shivu.startup import setup_indexes
+    await setup_indexes()
+
+    edited = dict(catalog[0])
+    await shivu.user_collection.update_many({}, {'$push': {'characters': edited}})
+
+    async def catch(i):
+        user_id = i % args.users + 1
+        await repository.add_character(user_id, catalog[i % len(catalog)], f'user{user_id}', f'User{user_id}')
+        await repository.group_members_caught(
+            {(group_ids[i % len(group_ids)], user_id): ([ObjectId()], f'user{user_id}', f'User{user_id}')})
+
+    results = [(await measure(Scenario('catch', catch), args.iterations, args.warmup, 1, db)).as_dict()]
+
+    propagator = Propagator(args.batch_size, args.duty)
+    job = await propagator.enqueue(edited['id'], {'name': 'Renamed Character'})
+    start = time.perf_counter()
+    task = asyncio.ensure_future(propagator.run_job(job))
+    results.append((await measure(Scenario('catch.during_propagation', catch), args.iterations, 0, 1, db)).as_dict())
+    await task
+    elapsed = time.perf_counter() - start
+    return results, {'owners': job['processed'], 'propagation_s': round(elapsed, 3),
+                     'owners_per_sec': round(job['processed'] / elapsed, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.propagation', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--characters', type=int, default=500)
+    parser.add_argument('--inventory', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=shivu.PROPAGATION_BATCH_SIZE)
+    parser.add_argument('--duty', type=float, default=shivu.PROPAGATION_DUTY_CYCLE)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='benchmark against a local mongod instead of the fake')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    results, summary = shivu.shivuu.loop.run_until_complete(run(args))
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        print(json.dumps(summary))
+    else:
+        print(' '.join(f'{k}={v}' for k, v in summary.items()))
+        print(format_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""Every named query in ``shivu.repository``, timed and checked against the indexes.
+
+    python -m benchmarks.queries --users 1000 --characters 5000
+    python -m benchmarks.queries --mongo-url mongodb://localhost:27017 --only users.
+
+Each query runs against a seeded database after ``setup_indexes``. The
+``index`` column names the index sharing the longest prefix with the fields
+the query filters and sorts on; ``MISSING`` means it would scan the
+collection, and makes the run exit with status 1. Queries that read a whole
+collection on purpose show ``-``.
+"""
+
+import argparse
+import json
+import sys
+
+from bson import ObjectId
+
+import shivu
+from benchmarks import env
+from benchmarks.runner import Scenario, format_table, measure
+
+# Whole-collection reads are slow by design; keep their iteration count small.
+SCANS = ('characters.all', 'users.first_names', 'users.top_by_collection_size', 'chat_settings.all',
+         'groups.names', 'group_members.counts', 'image_checks.ids')
+
+
+async def index_for(target, keys):
+    if not keys:
+        return '-'
+    best, matched = 'MISSING', 0
+    for name, spec in (await target.index_information()).items():
+        fields = [field for field, _ in spec['key']]
+        n = 0
+        while n < min(len(fields), len(keys)) and fields[n] == keys[n]:
+            n += 1
+        if n > matched:
+            best, matched = name, n
+    return best
+
+
+def calls(repository, leaderboards, args, catalog, group_ids):
+    ids = [c['id'] for c in catalog]
+
+    def character(i):
+        return ids[(i * 7919) % len(ids)]
+
+    def user(i):
+        return (i * 104729) % args.users + 1
+
+    def group(i):
+        return group_ids[i % len(group_ids)]
+
+    async def drain(cursor):
+        return await cursor.to_list(length=None)
+
+    async def owned_copies(i, apply):
+        owners = await repository.owners_after(character(i), None, 200)
+        if apply is repository.update_owned_copies:
+            await apply([owner['_id'] for owner in owners], character(i), {'name': f'Renamed {i}'})
+        else:
+            await apply([owner['_id'] for owner in owners], character(i))
+
+    async def checkpoint(i):
+        job = await shivu.propagation_jobs_collection.find_one({}, {'_id': 1})
+        await repository.checkpoint_propagation_job(job['_id'], {'processed': i})
+
+    def bump(i):
+        key = ('users', leaderboards.bucket_days('day')[0], str(user(i)))
+        return {key: ([ObjectId()], [f'user{user(i)}', f'User{user(i)}'], None)}
+
+    def event(i):
+        return {'type': 'catch', 'user_id': user(i), 'users': [user(i)], 'characters': [character(i)],
+                'group_id': group(i), 'group_name': f'Group {group(i)}', 'username': f'user{user(i)}',
+                'first_name': f'User{user(i)}'}
+
+    def image_check(i):
+        ok = i % 20 != 0
+        return {'url': f'https://example.invalid/chars/{i}.jpg', 'status': 206 if ok else 404,
+                'content_type': 'image/jpeg' if ok else 'text/html', 'bytes': 120000, 'format': 'jpeg',
+                'width': 800, 'height': 1200, 'error': None, 'problem': None if ok else 'HTTP 404', 'ok': ok,
+                'transient': False, 'quarantined': not ok,
+                'checked_at': i, 'next_check_at': i + 3600}
+
+    async def events_after(i):
+        checkpoint = await repository.get_event_checkpoint('bench')
+        events = await repository.events_after(checkpoint and checkpoint['after'], 100)
+        if events:
+            await repository.set_event_checkpoint('bench', {'after': events[-1]['_id']})
+
+    async def users_page(i):
+        page = await repository.users_after(None, 100)
+        await repository.users_after(page[-1]['_id'], 100)
+
+    async def repair_users(i):
+        page = await repository.users_after(None, 10)
+        await repository.repair_users({user['_id']: ({f'missing{i}'}, {f'missing{i}'}) for user in page})
+
+    return {
+        'characters.all': lambda i: repository.all_characters(),
+        'characters.changed_since': lambda i: repository.characters_changed_since(0),
+        'characters.count': lambda i: repository.count_characters(estimated=i % 2 == 0),
+        'characters.get': lambda i: repository.get_character(character(i)),
+        'characters.existing': lambda i: repository.existing_character_ids([character(i + n) for n in range(50)] + ['gone']),
+        'characters.insert': lambda i: repository.insert_character(
+            {**catalog[i % len(catalog)], 'id': f'bench{i}'}),
+        'characters.delete': lambda i: repository.delete_character(f'bench{i}'),
+        'characters.set_fields': lambda i: repository.set_character_fields(character(i), {'message_id': i}),
+        'sequences.get': lambda i: repository.sequence_value('character_id'),
+        'sequences.next': lambda i: repository.next_sequence_value('character_id', upsert=True),
+        'sequences.insert': lambda i: repository.insert_sequence(f'bench{i}', 0),
+        'users.get': lambda i: repository.get_user(user(i)),
+        'users.owned_character': lambda i: repository.owned_character(user(i), character(i)),
+        'users.add_character': lambda i: repository.add_character(
+            user(i), catalog[i % len(catalog)], f'user{user(i)}', f'User{user(i)}'),
+        'users.swap_character': lambda i: repository.swap_character(
+            user(i), catalog[i % len(catalog)]['id'], catalog[i % len(catalog)], ObjectId()),
+        'users.made_trade': lambda i: repository.made_trade(user(i), ObjectId()),
+        'users.take_character': lambda i: repository.take_character(user(i), catalog[i % len(catalog)]['id']),
+        'users.owners_after': lambda i: repository.owners_after(character(i), None, 200),
+        'users.update_owned_copies': lambda i: owned_copies(i, repository.update_owned_copies),
+        'users.remove_owned_copies': lambda i: owned_copies(i, repository.remove_owned_copies),
+        'users.page': users_page,
+        'users.repair': repair_users,
+        'users.set_favorites': lambda i: repository.set_favorites(user(i), [character(i)]),
+        'users.count': lambda i: repository.count_users(),
+        'users.count_owners': lambda i: repository.count_owners(character(i)),
+        'users.count_owners_many': lambda i: repository.count_owners_many([character(i + n) for n in range(50)]),
+        'users.first_names': lambda i: drain(repository.user_first_names()),
+        'users.top_by_collection_size': lambda i: repository.top_users_by_collection_size(10),
+        'chat_settings.all': lambda i: drain(repository.all_chat_settings({'_id': 0})),
+        'chat_settings.get': lambda i: repository.get_chat_settings(str(group(i)), {'_id': 0}),
+        'chat_settings.set': lambda i: repository.set_chat_setting(str(group(i)), 'message_frequency', 100 + i % 50),
+        'group_members.caught': lambda i: repository.group_members_caught(
+            {(group(i + n), user(i + n)): ([ObjectId()], f'user{user(i + n)}', f'User{user(i + n)}') for n in range(10)}),
+        'group_members.top': lambda i: repository.group_top(group(i), 10),
+        'group_members.counts': lambda i: drain(repository.group_member_counts()),
+        'group_members.group_ids': lambda i: repository.member_group_ids(),
+        'groups.caught': lambda i: repository.groups_caught(
+            {group(i + n): ([ObjectId()], f'Group {group(i + n)}') for n in range(10)}),
+        'groups.top': lambda i: repository.top_groups(10),
+        'groups.counts': lambda i: repository.group_counts([group(i + n) for n in range(10)]),
+        'groups.adjust_counts': lambda i: repository.adjust_group_counts({group(i): 1, group(i + 1): -1}),
+        'groups.names': lambda i: drain(repository.group_names()),
+        'groups.ids': lambda i: repository.group_ids(),
+        'pm_users.register': lambda i: repository.register_pm_user(10 ** 9 + i % 5, f'User{i}', f'user{i}'),
+        'pm_users.ids': lambda i: repository.pm_user_ids(),
+        'catch_buckets.record': lambda i: repository.record_catch_buckets(bump(i)),
+        'catch_buckets.window': lambda i: repository.catch_buckets_window(
+            'users', leaderboards.bucket_days('week'), leaderboards.TOP_SIZE),
+        'propagation_jobs.insert': lambda i: repository.insert_propagation_job(
+            {'character_id': character(i), 'fields': None, 'after': None, 'processed': 0, 'done': i % 10 != 0}),
+        'propagation_jobs.pending': lambda i: repository.pending_propagation_jobs(),
+        'propagation_jobs.checkpoint': checkpoint,
+        'events.insert': lambda i: repository.insert_events([event(i * 10 + n) for n in range(10)]),
+        'events.after': events_after,
+        'events.of_user': lambda i: repository.user_events(user(i), 20),
+        'events.of_character': lambda i: repository.character_events(character(i), 20),
+        'event_checkpoints.get': lambda i: repository.get_event_checkpoint('bench'),
+        'event_checkpoints.set': lambda i: repository.set_event_checkpoint(f'bench{i % 10}', {'after': None}),
+        'character_stats.add': lambda i: repository.add_character_stats(
+            {character(i * 10 + n): {'caught': [ObjectId()]} for n in range(10)}),
+        'character_stats.get': lambda i: repository.get_character_stats(character(i)),
+        'character_stats.delete': lambda i: repository.delete_character_stats(character(i)),
+        'character_stats.clear': lambda i: repository.clear_character_stats(),
+        'user_stats.add': lambda i: repository.add_user_stats({user(i + n): {'caught': [ObjectId()]} for n in range(10)}),
+        'user_stats.get': lambda i: repository.get_user_stats(user(i)),
+        'user_stats.clear': lambda i: repository.clear_user_stats(),
+        'image_checks.record': lambda i: repository.record_image_checks(
+            {character(i * 10 + n): image_check(i * 10 + n) for n in range(10)}),
+        'image_checks.due': lambda i: repository.images_due(i, 100),
+        'image_checks.broken': lambda i: repository.broken_images(),
+        'image_checks.ids': lambda i: repository.image_check_ids(),
+        'image_checks.get': lambda i: repository.get_image_check(character(i)),
+        'image_checks.delete': lambda i: repository.delete_image_checks([character(i + 1000)]),
+    }
+
+
+async def run(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db)
+    catalog, group_ids = await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+    from shivu import leaderboards, repository
+    from shivu.startup import setup_indexes
+    await setup_indexes()
+
+    queries = calls(repository, leaderboards, args, catalog, group_ids)
+    unbenchmarked = sorted(set(repository.QUERIES) - set(queries))
+    results = []
+    for name, (fn, target, keys) in repository.QUERIES.items():
+        if name not in queries or (args.only and not any(name.startswith(p) for p in args.only)):
+            continue
+        call = queries[name]
+
+        async def one(i, call=call):
+            await call(i)
+
+        scenario = Scenario(name, one, iterations=min(args.iterations, 20) if name in SCANS else None)
+        result = (await measure(scenario, args.iterations, args.warmup, 1, db)).as_dict()
+        del result['bot_calls_per_call']
+        result['index'] = await index_for(target, keys)
+        results.append(result)
+    return results, unbenchmarked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.queries', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--inventory', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='benchmark against a local mongod instead of the fake')
+    parser.add_argument('--only', nargs='*', help='query name prefixes to run')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    results, unbenchmarked = shivu.shivuu.loop.run_until_complete(run(args))
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(format_table(results))
+    if unbenchmarked:
+        print(f'no benchmark for: {", ".join(unbenchmarked)}', file=sys.stderr)
+    missing = [r['scenario'] for r in results if r['index'] == 'MISSING']
+    if missing:
+        print(f'not covered by an index: {", ".join(missing)}', file=sys.stderr)
+    return 1 if missing or unbenchmarked else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
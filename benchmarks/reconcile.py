@@ -0,0 +1,69 @@
+"""Throughput of the aggregate reconciliation, on a seeded database with known drift.
+
+    python -m benchmarks.reconcile --users 100000 --batch-size 1000
+
+Seeds users and group totals, then breaks some of them: copies of
+characters missing from the catalog, favorites no longer owned and group
+counts off by a few. Runs ``shivu.reconcile.Reconciler`` as a dry run and
+with ``--fix``, then once more to check nothing is left, and reports users
+and member rows per second. Use ``--mongo-url`` for numbers that carry over
+to production; the fake database scans every page filter.
+"""
+
+import argparse
+import json
+import random
+import sys
+
+import shivu
+from benchmarks import env
+
+SUMMARY = ('users', 'orphaned_copies', 'stale_favorites', 'users_repaired', 'group_rows', 'groups_off',
+           'group_count_delta', 'users_s', 'users_per_sec', 'groups_s', 'group_rows_per_sec')
+
+
+async def run(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db)
+    catalog, group_ids = await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+    from shivu.reconcile import Reconciler
+    from shivu.startup import warm_up
+    await warm_up()
+
+    rng = random.Random(2)
+    drifted = rng.sample(range(1, args.users + 1), max(1, args.users * args.drift // 100))
+    for user_id in drifted:
+        await shivu.user_collection.update_one(
+            {'id': user_id}, {'$push': {'characters': {'id': 'deleted', 'name': 'Gone'}, 'favorites': 'not-owned'}})
+    for group_id in group_ids[::max(1, len(group_ids) // 10)]:
+        await shivu.top_global_groups_collection.update_one({'group_id': group_id}, {'$inc': {'count': -3}})
+
+    results = []
+    for fix in (False, True, False):
+        report = await Reconciler(args.batch_size, fix).run()
+        results.append({'fix': fix, **{key: report[key] for key in SUMMARY}})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.reconcile', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--characters', type=int, default=1000)
+    parser.add_argument('--inventory', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--drift', type=int, default=5, help='percent of users given drifted data')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='benchmark against a local mongod instead of the fake')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = shivu.shivuu.loop.run_until_complete(run(args))
+    for result in results:
+        print(json.dumps(result) if args.json else ' '.join(f'{k}={v}' for k, v in result.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
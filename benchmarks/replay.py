@@ -0,0 +1,204 @@
+"""Replay recorded or synthetic updates through the full ``application`` pipeline.
+
+Record production traffic by setting ``RECORD_UPDATES`` in ``shivu/config.py``,
+or generate a synthetic load, then replay it against a local fake Bot API:
+
+    python -m benchmarks.replay generate load.jsonl --groups 500 --rate 0.2 --duration 60
+    python -m benchmarks.replay run load.jsonl --speed 10 --api-latency 40 --chat-limit 20 --rate-limit
+
+Updates are fed into ``application.update_queue`` at their recorded spacing
+divided by ``--speed``, so every handler, filter and group runs exactly as in
+production. Only the PTB pipeline is replayed; pyrogram handlers (trade, gift,
+changetime) are not reached.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import Application
+
+import shivu
+from benchmarks import env
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.runner import Result
+
+
+def read_updates(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield record['ts'], record['update']
+
+
+def generate(path, groups, users_per_group, rate, duration, guess_ratio, inline_ratio,
+             characters, seed=1):
+    """Write a synthetic JSONL load: ``groups`` chats each sending ``rate`` msgs/s."""
+    rng = random.Random(seed)
+    animes = max(1, characters // 20)
+    total = int(groups * rate * duration)
+    start = time.time()
+    update_id = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for n in range(total):
+            update_id += 1
+            ts = start + rng.uniform(0, duration)
+            group = rng.randrange(groups)
+            chat = {'id': -1000000000 - group, 'type': 'supergroup', 'title': f'Group {group}'}
+            user_id = group * users_per_group + rng.randrange(users_per_group) + 1
+            user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+            roll = rng.random()
+            if roll < inline_ratio:
+                update = {'update_id': update_id, 'inline_query': {
+                    'id': str(update_id), 'from': user, 'query': rng.choice(['', f'collection.{user_id}', 'Anime 1']),
+                    'offset': ''}}
+            else:
+                if roll < inline_ratio + guess_ratio:
+                    name = env.make_character(rng.randrange(characters), animes)['name']
+                    text = f'/guess {name}'
+                    entities = [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+                else:
+                    text = f'message {n}'
+                    entities = []
+                update = {'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': int(ts), 'chat': chat, 'from': user,
+                    'text': text, 'entities': entities}}
+            f.write(json.dumps({'ts': ts, 'update': update}) + '\n')
+    # Keep the file in arrival order, as a recording would be.
+    with open(path, encoding='utf-8') as f:
+        lines = sorted(f, key=lambda line: json.loads(line)['ts'])
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    return total
+
+
+async def replay(args):
+    api = FakeBotAPI(args.api_latency / 1000, args.api_jitter / 1000, args.flood_rate,
+                     args.retry_after, args.chat_limit, seed=1)
+    base_url = await api.start()
+    from shivu.transport import PooledRequest
+    request = PooledRequest.from_config(shivu.Config, pool_size=args.pool_size)
+    builder = Application.builder().token(shivu.TOKEN).base_url(base_url).request(request)
+    limiter = None
+    if args.rate_limit:
+        from shivu.ratelimit import PriorityRateLimiter
+        limiter = PriorityRateLimiter(shivu.Config.RATE_LIMIT_OVERALL, shivu.Config.RATE_LIMIT_GROUP,
+                                      shivu.Config.RATE_LIMIT_PRIVATE, shivu.Config.RATE_LIMIT_RETRIES)
+        builder = builder.rate_limiter(limiter)
+    application = builder.build()
+
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db, application)
+    await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+
+    errors = Counter()
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(on_error)
+    await application.initialize()
+    api.reset()
+    await application.start()
+
+    updates = list(read_updates(args.path))
+    if args.limit:
+        updates = updates[:args.limit]
+    first_ts = updates[0][0] if updates else 0
+    lags = []
+    max_depth = 0
+    start = time.perf_counter()
+    for ts, data in updates:
+        target = start + (ts - first_ts) / args.speed
+        delay = target - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, time.perf_counter() - target))
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        max_depth = max(max_depth, application.update_queue.qsize())
+    fed = time.perf_counter() - start
+
+    await application.update_queue.join()
+    await application.stop()
+    elapsed = time.perf_counter() - start
+    await application.shutdown()
+    await api.stop()
+
+    span = (updates[-1][0] - first_ts) / args.speed if updates else 0
+    lag = Result('lag', len(lags), fed, lags)
+    return {
+        'updates': len(updates),
+        'speed': args.speed,
+        'scheduled_s': round(span, 2),
+        'elapsed_s': round(elapsed, 2),
+        'updates_per_sec': round(len(updates) / elapsed, 1) if elapsed else 0,
+        'drain_s': round(elapsed - fed, 2),
+        'feed_lag_p50_ms': round(lag.percentile(50) * 1000, 2),
+        'feed_lag_p99_ms': round(lag.percentile(99) * 1000, 2),
+        'max_queue_depth': max_depth,
+        'db_ops': getattr(db, 'ops', None),
+        'handler_errors': dict(errors),
+        **api.summary(),
+        **({'rate_limiter': limiter.stats()} if limiter else {}),
+        'transport': request.stats(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help='write a synthetic update stream')
+    gen.add_argument('path')
+    gen.add_argument('--groups', type=int, default=100)
+    gen.add_argument('--users-per-group', type=int, default=20)
+    gen.add_argument('--rate', type=float, default=0.5, help='messages per second per group')
+    gen.add_argument('--duration', type=float, default=60, help='seconds of traffic')
+    gen.add_argument('--guess-ratio', type=float, default=0.02)
+    gen.add_argument('--inline-ratio', type=float, default=0.01)
+    gen.add_argument('--characters', type=int, default=1000)
+
+    run = sub.add_parser('run', help='replay a JSONL file into the application')
+    run.add_argument('path')
+    run.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier, e.g. 1 to 100')
+    run.add_argument('--limit', type=int, help='replay only the first N updates')
+    run.add_argument('--api-latency', type=float, default=30.0, help='ms per fake Bot API call')
+    run.add_argument('--api-jitter', type=float, default=10.0, help='random extra ms per call')
+    run.add_argument('--flood-rate', type=float, default=0.0, help='probability of an injected 429')
+    run.add_argument('--retry-after', type=int, default=1)
+    run.add_argument('--chat-limit', type=int, help='messages per minute per chat before 429')
+    run.add_argument('--rate-limit', action='store_true',
+                     help="send through the bot's PriorityRateLimiter, as in production")
+    run.add_argument('--pool-size', type=int, default=None,
+                     help='Bot API connections (default: BOT_API_POOL_SIZE from Config)')
+    run.add_argument('--characters', type=int, default=1000)
+    run.add_argument('--users', type=int, default=2000)
+    run.add_argument('--inventory', type=int, default=50)
+    run.add_argument('--groups', type=int, default=100)
+    run.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    run.add_argument('--mongo-url', help='replay against a local mongod instead of the fake')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'generate':
+        total = generate(args.path, args.groups, args.users_per_group, args.rate, args.duration,
+                         args.guess_ratio, args.inline_ratio, args.characters)
+        print(f'wrote {total} updates to {args.path}')
+        return 0
+    report = shivu.shivuu.loop.run_until_complete(replay(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
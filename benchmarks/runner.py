@@ -0,0 +1,95 @@
+"""Timing loop and report formatting shared by every benchmark."""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Scenario:
+    name: str
+    run: callable
+    prepare: callable = None
+    iterations: int = None
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    elapsed: float
+    latencies: list = field(repr=False)
+    db_ops: int = 0
+    bot_calls: int = 0
+
+    @property
+    def throughput(self):
+        return self.iterations / self.elapsed if self.elapsed else float('inf')
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def as_dict(self):
+        return {
+            'scenario': self.name,
+            'iterations': self.iterations,
+            'ops_per_sec': round(self.throughput, 1),
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'db_ops_per_call': round(self.db_ops / self.iterations, 2) if self.iterations else 0,
+            'bot_calls_per_call': round(self.bot_calls / self.iterations, 2) if self.iterations else 0,
+        }
+
+
+async def measure(scenario, iterations, warmup=0, concurrency=1, db=None, bot=None):
+    """Run ``scenario`` and collect per-call latency.
+
+    ``prepare(i)`` runs outside the timed region so scenarios can reset
+    per-chat state between calls without skewing the numbers.
+    """
+    iterations = scenario.iterations or iterations
+    for i in range(warmup):
+        if scenario.prepare:
+            await scenario.prepare(i)
+        await scenario.run(i)
+
+    db_before = getattr(db, 'ops', 0)
+    bot_before = sum(bot.calls.values()) if bot else 0
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            if scenario.prepare:
+                await scenario.prepare(i)
+            start = time.perf_counter()
+            await scenario.run(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        for i in range(warmup, warmup + iterations):
+            await one(i)
+    else:
+        await asyncio.gather(*(one(i) for i in range(warmup, warmup + iterations)))
+    elapsed = time.perf_counter() - start
+
+    return Result(scenario.name, iterations, elapsed, latencies,
+                  db_ops=getattr(db, 'ops', 0) - db_before,
+                  bot_calls=(sum(bot.calls.values()) - bot_before) if bot else 0)
+
+
+def format_table(rows):
+    if not rows:
+        return ''
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    lines = ['  '.join(c.ljust(widths[c]) for c in columns)]
+    lines.append('  '.join('-' * widths[c] for c in columns))
+    for row in rows:
+        lines.append('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+    return '\n'.join(lines)
@@ -0,0 +1,93 @@
+"""Import time and time-to-ready of the bot.
+
+    python -m benchmarks.startup --characters 20000 --chats 5000
+
+Import time is measured in fresh interpreters; time-to-ready runs
+``shivu.startup.warm_up`` against a seeded database (pyrogram is not started,
+so the figure covers indexes, catalog and chat settings only). It is reported
+twice: loading the catalog from the database, then from a local snapshot.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import subprocess
+import sys
+import time
+
+import shivu
+from benchmarks import env
+
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import shivu
+package = time.perf_counter()
+import shivu.__main__
+print(json.dumps({'shivu': package - start, 'shivu.__main__': time.perf_counter() - start}))
+"""
+
+
+def import_times(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: round(statistics.median(s[key] for s in samples) * 1000, 1) for key in samples[0]}
+
+
+async def time_to_ready(args):
+    db = env.open_database(args.mongo_url, args.db_latency / 1000)
+    env.install(db)
+    await env.seed(db, args.characters, args.users, args.inventory, args.groups)
+    settings = shivu.user_totals_collection
+    await settings.insert_many([{'chat_id': str(-1000000000 - i), 'message_frequency': 100 + i % 50}
+                                for i in range(args.chats)])
+
+    from shivu import startup
+    from shivu.snapshot import catalog_sync
+
+    async def runs():
+        samples = []
+        for _ in range(args.runs):
+            startup.ready.clear()
+            start = time.perf_counter()
+            await startup.warm_up()
+            samples.append(time.perf_counter() - start)
+        return (round(statistics.median(samples) * 1000, 1),
+                {k: round(v * 1000, 1) for k, v in startup.timings.items() if v is not None})
+
+    report = {}
+    report['time_to_ready_ms'], report['steps_ms'] = await runs()
+    with tempfile.TemporaryDirectory() as directory:
+        catalog_sync.path = os.path.join(directory, 'catalog.snapshot')
+        await catalog_sync.save()
+        report['snapshot_bytes'] = os.path.getsize(catalog_sync.path)
+        report['time_to_ready_snapshot_ms'], report['snapshot_steps_ms'] = await runs()
+        catalog_sync.path = None
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--inventory', type=int, default=10)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--chats', type=int, default=2000, help='chats with a custom message frequency')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='simulated ms per fake db call')
+    parser.add_argument('--mongo-url', help='warm up from a local mongod instead of the fake')
+    args = parser.parse_args(argv)
+
+    report = {'import_ms': import_times(args.runs)}
+    report.update(shivu.shivuu.loop.run_until_complete(time_to_ready(args)))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
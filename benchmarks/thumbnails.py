@@ -0,0 +1,189 @@
+"""Making inline thumbnails in threads or processes, and serving them.
+
+    python -m benchmarks.thumbnails --characters 200 --workers 1 4
+
+A local server hands out distinct 1200x1800 JPEGs. For each worker count the
+catalog's thumbnails are made from scratch, once with a thread pool and
+once with the process pool the bot uses, while a ticker measures how late
+the event loop wakes up (the lag every handler would see). Then the
+endpoint is hit with ``--requests`` GETs, half of them revalidations with
+``If-None-Match``, to show serving throughput and 304s.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import shivu
+from benchmarks import env
+from benchmarks.runner import format_table
+
+
+def source_image(i: int) -> bytes:
+    from PIL import Image
+    gradient = Image.linear_gradient('L').resize((1200, 1800))
+    image = Image.merge('RGB', (gradient, gradient.rotate(90 + i % 180).resize((1200, 1800)),
+                                Image.new('L', (1200, 1800), (i * 37) % 256)))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+async def start_app(app):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+class Ticker:
+    """Sleeps ``interval`` over and over and records how late it wakes up."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def percentile(self, pct):
+        ordered = sorted(self.lags) or [0.0]
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+async def make_all(args, mode, workers):
+    from shivu.thumbnails import Thumbnails
+    directory = tempfile.mkdtemp(prefix='thumbs-')
+    thumbnails = Thumbnails(directory, args.size, args.format, 80, workers, 'http://127.0.0.1/thumbnails', None)
+    await thumbnails.start()
+    if mode == 'threads':
+        thumbnails.pool.shutdown()
+        thumbnails.pool = ThreadPoolExecutor(workers)
+    # Let the worker processes start before timing.
+    await asyncio.get_running_loop().run_in_executor(thumbnails.pool, sum, ())
+    start = time.perf_counter()
+    with Ticker() as ticker:
+        while not thumbnails.queue.qsize() and not thumbnails.made:
+            await asyncio.sleep(0.001)
+        await thumbnails.queue.join()
+    elapsed = time.perf_counter() - start
+    await thumbnails.stop()
+    stats = thumbnails.stats()
+    row = {
+        'mode': f'{mode}={workers}',
+        'made': stats['made'],
+        'failed': stats['failed'],
+        'seconds': round(elapsed, 2),
+        'per_sec': round(stats['made'] / elapsed, 1),
+        'loop_lag_p99_ms': round(ticker.percentile(99) * 1000, 1),
+        'loop_lag_max_ms': round(max(ticker.lags or [0]) * 1000, 1),
+        'source_kib': stats['source_kib_avg'],
+        'thumbnail_kib': stats['thumbnail_kib_avg'],
+    }
+    return row, thumbnails, directory
+
+
+async def serve(args, thumbnails):
+    runner, base = await start_app(thumbnails.app())
+    names = [entry[1] for entry in thumbnails.entries.values()]
+    semaphore = asyncio.Semaphore(50)
+    statuses, cache_control = {}, None
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def one(i):
+                nonlocal cache_control
+                name = names[i % len(names)]
+                headers = {'If-None-Match': f'"{name.split(".")[0]}"'} if i % 2 else {}
+                async with semaphore, session.get(f'{base}/{name}', headers=headers) as response:
+                    await response.read()
+                    cache_control = cache_control or response.headers.get('Cache-Control')
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    return {'requests': args.requests, 'per_sec': round(args.requests / elapsed, 1),
+            'statuses': statuses, 'cache_control': cache_control}
+
+
+async def run(args):
+    sources = [source_image(i) for i in range(args.characters)]
+
+    async def image(request):
+        return web.Response(body=sources[int(request.match_info['i'])], content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get('/{i}.jpg', image)
+    runner, base = await start_app(app)
+
+    db = env.open_database()
+    env.install(db)
+    catalog_docs, _ = await env.seed(db, args.characters, 1, 1, 1)
+    for i, character in enumerate(catalog_docs):
+        await shivu.collection.update_one({'id': character['id']}, {'$set': {'img_url': f'{base}/{i}.jpg'}})
+    from shivu.catalog import catalog
+    await catalog.load()
+
+    rows, served, last = [], None, None
+    try:
+        for workers in args.workers:
+            for mode in ('threads', 'processes'):
+                row, thumbnails, directory = await make_all(args, mode, workers)
+                rows.append(row)
+                if last:
+                    shutil.rmtree(last[1], ignore_errors=True)
+                last = (thumbnails, directory)
+        served = await serve(args, last[0])
+    finally:
+        if last:
+            shutil.rmtree(last[1], ignore_errors=True)
+        await runner.cleanup()
+    return rows, served
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.thumbnails', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--characters', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 2])
+    parser.add_argument('--size', type=int, default=320)
+    parser.add_argument('--format', default='JPEG', choices=['JPEG', 'WEBP'])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    rows, served = shivu.shivuu.loop.run_until_complete(run(args))
+    if args.json:
+        print(json.dumps({'make': rows, 'serve': served}))
+    else:
+        print(format_table(rows))
+        print(' '.join(f'{k}={v}' for k, v in served.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
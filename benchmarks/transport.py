@@ -0,0 +1,101 @@
+"""Concurrent Bot API calls through PTB's default transport and through ``PooledRequest``.
+
+    python -m benchmarks.transport --calls 2000 --concurrency 200 --api-latency 40
+
+Starts the fake Bot API server and sends ``--calls`` ``sendPhoto`` requests,
+``--concurrency`` at a time, as many ``block=False`` handlers would. The
+``default`` row is PTB's ``HTTPXRequest()`` (one connection, one second pool
+timeout); the ``pool=N`` rows use ``PooledRequest`` with the transport
+settings from ``Config`` and N slots. Reports calls per second, end-to-end
+latency, pool wait, pool timeouts and how many requests the server saw at once.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from telegram import Bot
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+import shivu
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.runner import format_table
+from shivu.transport import PooledRequest
+
+
+async def measure(api, base_url, name, request, calls, concurrency):
+    api.reset()
+    bot = Bot(shivu.TOKEN, base_url=base_url, request=request)
+    await bot.initialize()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, timeouts = [], 0
+
+    async def one(i):
+        nonlocal timeouts
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await bot.send_photo(-1000000000 - i % 500, 'https://example.invalid/chars/1.jpg', caption='bench')
+            except TimedOut:
+                timeouts += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - start
+    await bot.shutdown()
+
+    latencies.sort()
+    row = {
+        'transport': name,
+        'sent': len(latencies),
+        'timed_out': timeouts,
+        'calls_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0,
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1) if latencies else 0,
+        'server_max_in_flight': api.max_in_flight,
+    }
+    if isinstance(request, PooledRequest):
+        stats = request.stats()
+        row.update({'pool_wait_p99_ms': stats['pool_wait_p99_ms'], 'peak_in_use': stats['peak_in_use']})
+    else:
+        row.update({'pool_wait_p99_ms': '-', 'peak_in_use': '-'})
+    return row
+
+
+async def run(args):
+    api = FakeBotAPI(args.api_latency / 1000, args.api_jitter / 1000, seed=1)
+    base_url = await api.start()
+    rows = []
+    try:
+        rows.append(await measure(api, base_url, 'default', HTTPXRequest(), args.calls, args.concurrency))
+        for size in args.pool_sizes:
+            request = PooledRequest.from_config(shivu.Config, pool_size=size)
+            rows.append(await measure(api, base_url, f'pool={size}', request, args.calls, args.concurrency))
+    finally:
+        await api.stop()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.transport', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[8, 16, 64, 256])
+    parser.add_argument('--api-latency', type=float, default=40.0, help='ms the fake server takes per call')
+    parser.add_argument('--api-jitter', type=float, default=10.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    rows = shivu.shivuu.loop.run_until_complete(run(args))
+    print(json.dumps(rows) if args.json else format_table(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
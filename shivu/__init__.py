@@ -4,19 +4,18 @@ from pyrogram import Client
 from telegram.ext import Application
 from motor.motor_asyncio import AsyncIOMotorClient
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    handlers=[logging.FileHandler("log.txt"), logging.StreamHandler()],
-    level=logging.INFO,
-)
+from shivu.config import Development as Config
+from shivu.logs import setup_logging
+from shivu.ratelimit import PriorityRateLimiter
+from shivu.transport import PooledRequest
+
+setup_logging(Config)
 
 logging.getLogger("apscheduler").setLevel(logging.ERROR)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger("pyrate_limiter").setLevel(logging.ERROR)
 LOGGER = logging.getLogger(__name__)
 
-from shivu.config import Development as Config
-
 
 api_id = Config.api_id
 api_hash = Config.api_hash
@@ -30,10 +29,58 @@ UPDATE_CHAT = Config.UPDATE_CHAT
 BOT_USERNAME = Config.BOT_USERNAME 
 sudo_users = Config.sudo_users
 OWNER_ID = Config.OWNER_ID 
+RECORD_UPDATES = Config.RECORD_UPDATES
+RARITY_WEIGHTS = Config.RARITY_WEIGHTS
+SPAWN_INTERVAL = Config.SPAWN_INTERVAL
+SPAWN_RATE = Config.SPAWN_RATE
+ADMIN_CACHE_TTL = Config.ADMIN_CACHE_TTL
+LEADERBOARD_CACHE_SIZE = Config.LEADERBOARD_CACHE_SIZE
+CATALOG_SNAPSHOT = Config.CATALOG_SNAPSHOT
+CATALOG_SYNC_INTERVAL = Config.CATALOG_SYNC_INTERVAL
+PROPAGATION_BATCH_SIZE = Config.PROPAGATION_BATCH_SIZE
+PROPAGATION_DUTY_CYCLE = Config.PROPAGATION_DUTY_CYCLE
+EVENT_BATCH_SIZE = Config.EVENT_BATCH_SIZE
+EVENT_FLUSH_INTERVAL = Config.EVENT_FLUSH_INTERVAL
+MONGO_TIMEOUT = Config.MONGO_TIMEOUT
+MONGO_SCAN_TIMEOUT = Config.MONGO_SCAN_TIMEOUT
+MONGO_BREAKER_FAILURES = Config.MONGO_BREAKER_FAILURES
+MONGO_BREAKER_COOLDOWN = Config.MONGO_BREAKER_COOLDOWN
+MONGO_HEALTH_INTERVAL = Config.MONGO_HEALTH_INTERVAL
+IMAGE_SCAN_CONCURRENCY = Config.IMAGE_SCAN_CONCURRENCY
+IMAGE_SCAN_INTERVAL = Config.IMAGE_SCAN_INTERVAL
+IMAGE_RESCAN_AFTER = Config.IMAGE_RESCAN_AFTER
+IMAGE_RETRY_AFTER = Config.IMAGE_RETRY_AFTER
+IMAGE_SCAN_TIMEOUT = Config.IMAGE_SCAN_TIMEOUT
+IMAGE_TRANSIENT_FAILURES = Config.IMAGE_TRANSIENT_FAILURES
+THUMBNAIL_DIR = Config.THUMBNAIL_DIR
+THUMBNAIL_SIZE = Config.THUMBNAIL_SIZE
+THUMBNAIL_FORMAT = Config.THUMBNAIL_FORMAT
+THUMBNAIL_QUALITY = Config.THUMBNAIL_QUALITY
+THUMBNAIL_WORKERS = Config.THUMBNAIL_WORKERS
+THUMBNAIL_PORT = Config.THUMBNAIL_PORT
+THUMBNAIL_BASE_URL = Config.THUMBNAIL_BASE_URL
+PM_SEEN_CACHE_SIZE = Config.PM_SEEN_CACHE_SIZE
+NEW_USER_DIGEST_INTERVAL = Config.NEW_USER_DIGEST_INTERVAL
+TRACK_TASK_AGES = Config.TRACK_TASK_AGES
+LOAD = Config.LOAD
+NO_LOAD = Config.NO_LOAD
 
-application = Application.builder().token(TOKEN).build()
+# Every chat-bound Bot API call goes through one prioritized, flood-aware queue.
+rate_limiter = PriorityRateLimiter(Config.RATE_LIMIT_OVERALL, Config.RATE_LIMIT_GROUP,
+                                   Config.RATE_LIMIT_PRIVATE, Config.RATE_LIMIT_RETRIES)
+# Handlers run with block=False, so outgoing calls need a pool sized for them; the
+# get_updates long poll gets its own connection and never waits behind sends.
+bot_request = PooledRequest.from_config(Config)
+updates_request = PooledRequest.from_config(Config, pool_size=1)
+application = (Application.builder().token(TOKEN).request(bot_request).get_updates_request(updates_request)
+               .rate_limiter(rate_limiter).build())
 shivuu = Client("Shivu", api_id, api_hash, bot_token=TOKEN)
-lol = AsyncIOMotorClient(mongo_url)
+# connect=False defers the first connection to the first query instead of import time.
+# Server selection gives up with the per-call timeout, so a dead cluster doesn't hold
+# motor's worker threads for pymongo's default 30s. A stalled socket read gives up after
+# the scan timeout, which also bounds cursors streamed outside the per-call timeout.
+lol = AsyncIOMotorClient(mongo_url, connect=False, serverSelectionTimeoutMS=int(Config.MONGO_TIMEOUT * 1000),
+                         socketTimeoutMS=int(Config.MONGO_SCAN_TIMEOUT * 1000))
 db = lol['Character_catcher']
 collection = db['anime_characters_lol']
 user_totals_collection = db['user_totals_lmaoooo']
@@ -41,3 +88,16 @@ user_collection = db["user_collection_lmaoooo"]
 group_user_totals_collection = db['group_user_totalsssssss']
 top_global_groups_collection = db['top_global_groups']
 pm_users = db['total_pm_users']
+# Per-day catch counters behind /top, /ctop and /TopGroups day|week|month, one row per
+# (scope, day, id). The old one-document-per-day 'catch_buckets' expires on its own TTL.
+catch_buckets_collection = db['catch_bucket_counts']
+# Checkpointed jobs copying /update and /delete into the characters users own.
+propagation_jobs_collection = db['propagation_jobs']
+# Append-only log of catches, trades, gifts and deletes, the checkpoint of each
+# consumer that reads it, and the per-character and per-user counts two of them keep.
+events_collection = db['events']
+event_checkpoints_collection = db['event_checkpoints']
+character_stats_collection = db['character_stats']
+user_stats_collection = db['user_stats']
+# The last image check of each character: status, content type, size, dimensions.
+image_checks_collection = db['image_checks']
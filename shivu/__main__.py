@@ -8,24 +8,37 @@ from html import escape
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from telegram import Update
-from telegram.ext import CommandHandler, CallbackContext, MessageHandler, filters
-
-from shivu import collection, top_global_groups_collection, group_user_totals_collection, user_collection, user_totals_collection, shivuu
-from shivu import application, SUPPORT_CHAT, UPDATE_CHAT, db, LOGGER
+from telegram.error import BadRequest
+from telegram.ext import CommandHandler, CallbackContext, MessageHandler, TypeHandler, filters
+
+from shivu import shivuu
+from shivu import application, SUPPORT_CHAT, UPDATE_CHAT, RECORD_UPDATES, LOGGER
+from shivu import inventory, repository
+from shivu.catalog import catalog
+from shivu.chat_settings import chat_settings
+from shivu.events import event_log, CATCH
+from shivu.health import DatabaseUnavailable, reply_degraded
+from shivu.images import image_scanner
+from shivu.sampling import sampler
+from shivu.scheduler import spawn_scheduler
+from shivu.logs import bind_update
+from shivu.ratelimit import SPAWN
 from shivu.modules import ALL_MODULES
+from shivu.startup import post_init, post_shutdown
 
 
 locks = {}
 message_counters = {}
 spam_counters = {}
 last_characters = {}
-sent_characters = {}
 first_correct_guesses = {}
 message_counts = {}
 
 
 for module_name in ALL_MODULES:
+    start = time.perf_counter()
     imported_module = importlib.import_module("shivu.modules." + module_name)
+    LOGGER.debug("Imported module %s in %.3fs", module_name, time.perf_counter() - start)
 
 
 last_user = {}
@@ -45,11 +58,7 @@ async def message_counter(update: Update, context: CallbackContext) -> None:
 
     async with lock:
         
-        chat_frequency = await user_totals_collection.find_one({'chat_id': chat_id})
-        if chat_frequency:
-            message_frequency = chat_frequency.get('message_frequency', 100)
-        else:
-            message_frequency = 100
+        message_frequency = await chat_settings.message_frequency(chat_id)
 
         
         if chat_id in last_user and last_user[chat_id]['user_id'] == user_id:
@@ -77,32 +86,41 @@ async def message_counter(update: Update, context: CallbackContext) -> None:
             await send_image(update, context)
             
             message_counts[chat_id] = 0
+            spawn_scheduler.spawned(update.effective_chat.id)
+        else:
+            spawn_interval = await chat_settings.spawn_interval(chat_id)
+            if spawn_interval:
+                spawn_scheduler.touch(update.effective_chat.id, spawn_interval * 60)
             
 async def send_image(update: Update, context: CallbackContext) -> None:
-    chat_id = update.effective_chat.id
+    await spawn(context.bot, update.effective_chat.id)
 
-    all_characters = list(await collection.find({}).to_list(length=None))
-    
-    if chat_id not in sent_characters:
-        sent_characters[chat_id] = []
 
-    if len(sent_characters[chat_id]) == len(all_characters):
-        sent_characters[chat_id] = []
+async def spawn(bot, chat_id: int) -> None:
+    await catalog.ensure_loaded()
+    character = sampler.pick(chat_id, await chat_settings.rarity_weights(str(chat_id)))
+    if character is None:
+        return
 
-    character = random.choice([c for c in all_characters if c['id'] not in sent_characters[chat_id]])
+    try:
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=character['img_url'],
+            caption=f"""A New {character['rarity']} Character Appeared...\n/guess Character Name and add in Your Harem""",
+            parse_mode='Markdown',
+            rate_limit_args=SPAWN)
+    except BadRequest as e:
+        # Most likely the image; the scanner checks it next and quarantines the character if so.
+        LOGGER.warning("Spawning %s in %s failed: %s", character['id'], chat_id, e)
+        image_scanner.request(character)
+        return
 
-    sent_characters[chat_id].append(character['id'])
+    # Only a character the chat has actually seen can be guessed.
     last_characters[chat_id] = character
 
     if chat_id in first_correct_guesses:
         del first_correct_guesses[chat_id]
 
-    await context.bot.send_photo(
-        chat_id=chat_id,
-        photo=character['img_url'],
-        caption=f"""A New {character['rarity']} Character Appeared...\n/guess Character Name and add in Your Harem""",
-        parse_mode='Markdown')
-
 
 async def guess(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
@@ -129,73 +147,20 @@ async def guess(update: Update, context: CallbackContext) -> None:
     
         first_correct_guesses[chat_id] = user_id
         
-        user = await user_collection.find_one({'id': user_id})
-        if user:
-            update_fields = {}
-            if hasattr(update.effective_user, 'username') and update.effective_user.username != user.get('username'):
-                update_fields['username'] = update.effective_user.username
-            if update.effective_user.first_name != user.get('first_name'):
-                update_fields['first_name'] = update.effective_user.first_name
-            if update_fields:
-                await user_collection.update_one({'id': user_id}, {'$set': update_fields})
-            
-            await user_collection.update_one({'id': user_id}, {'$push': {'characters': last_characters[chat_id]}})
-      
-        elif hasattr(update.effective_user, 'username'):
-            await user_collection.insert_one({
-                'id': user_id,
-                'username': update.effective_user.username,
-                'first_name': update.effective_user.first_name,
-                'characters': [last_characters[chat_id]],
-            })
+        username, first_name = update.effective_user.username, update.effective_user.first_name
+        # Written later if Mongo is unavailable, so the catch still counts.
+        saved = await inventory.add_character(user_id, dict(last_characters[chat_id]), username, first_name)
 
-        
-        group_user_total = await group_user_totals_collection.find_one({'user_id': user_id, 'group_id': chat_id})
-        if group_user_total:
-            update_fields = {}
-            if hasattr(update.effective_user, 'username') and update.effective_user.username != group_user_total.get('username'):
-                update_fields['username'] = update.effective_user.username
-            if update.effective_user.first_name != group_user_total.get('first_name'):
-                update_fields['first_name'] = update.effective_user.first_name
-            if update_fields:
-                await group_user_totals_collection.update_one({'user_id': user_id, 'group_id': chat_id}, {'$set': update_fields})
-            
-            await group_user_totals_collection.update_one({'user_id': user_id, 'group_id': chat_id}, {'$inc': {'count': 1}})
-      
-        else:
-            await group_user_totals_collection.insert_one({
-                'user_id': user_id,
-                'group_id': chat_id,
-                'username': update.effective_user.username,
-                'first_name': update.effective_user.first_name,
-                'count': 1,
-            })
-
-
-    
-        group_info = await top_global_groups_collection.find_one({'group_id': chat_id})
-        if group_info:
-            update_fields = {}
-            if update.effective_chat.title != group_info.get('group_name'):
-                update_fields['group_name'] = update.effective_chat.title
-            if update_fields:
-                await top_global_groups_collection.update_one({'group_id': chat_id}, {'$set': update_fields})
-            
-            await top_global_groups_collection.update_one({'group_id': chat_id}, {'$inc': {'count': 1}})
-      
-        else:
-            await top_global_groups_collection.insert_one({
-                'group_id': chat_id,
-                'group_name': update.effective_chat.title,
-                'count': 1,
-            })
+        # Group totals, top groups and windowed counts follow from the event log.
+        event_log.append(CATCH, user_id, [last_characters[chat_id]['id']], username=username,
+                         first_name=first_name, group_id=chat_id, group_name=update.effective_chat.title)
 
 
         
         keyboard = [[InlineKeyboardButton(f"See Harem", switch_inline_query_current_chat=f"collection.{user_id}")]]
 
 
-        await update.message.reply_text(f'<b><a href="tg://user?id={user_id}">{escape(update.effective_user.first_name)}</a></b>💖 ʏᴏᴜʀ ᴘʀᴏᴘᴏsᴀʟ ᴡᴀs ᴀᴄᴄᴇᴘᴛᴇᴅ 🎉 \n\n 💍 ʏᴏᴜ ʜᴀᴠᴇ ᴀᴅᴅᴇᴅ \n\n 🌺𝗡𝗔𝗠𝗘: <b>{last_characters[chat_id]["name"]}</b> \n𝗔𝗡𝗜𝗠𝗘: <b>{last_characters[chat_id]["anime"]}</b> \n🐉𝙍𝘼𝙍𝙄𝙏𝙔: <b>{last_characters[chat_id]["rarity"]}</b>\n\nᴛᴏ ʏᴏᴜʀ ʜᴀʀᴇᴍ 💎 \n\n💡 ᴄʜᴇᴄᴋ ɪᴛ ᴜsɪɴɢ /ᴍʏʜᴀʀᴇᴍ', parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(f'<b><a href="tg://user?id={user_id}">{escape(update.effective_user.first_name)}</a></b>💖 ʏᴏᴜʀ ᴘʀᴏᴘᴏsᴀʟ ᴡᴀs ᴀᴄᴄᴇᴘᴛᴇᴅ 🎉 \n\n 💍 ʏᴏᴜ ʜᴀᴠᴇ ᴀᴅᴅᴇᴅ \n\n 🌺𝗡𝗔𝗠𝗘: <b>{last_characters[chat_id]["name"]}</b> \n𝗔𝗡𝗜𝗠𝗘: <b>{last_characters[chat_id]["anime"]}</b> \n🐉𝙍𝘼𝙍𝙄𝙏𝙔: <b>{last_characters[chat_id]["rarity"]}</b>\n\nᴛᴏ ʏᴏᴜʀ ʜᴀʀᴇᴍ 💎 \n\n💡 ᴄʜᴇᴄᴋ ɪᴛ ᴜsɪɴɢ /ᴍʏʜᴀʀᴇᴍ' + ('' if saved else '\n\n⏳ Saving is delayed, it will show up in your harem shortly.'), parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
     else:
         await update.message.reply_text('Please Write Correct Character Name... ❌️')
@@ -212,40 +177,49 @@ async def fav(update: Update, context: CallbackContext) -> None:
     character_id = context.args[0]
 
     
-    user = await user_collection.find_one({'id': user_id})
-    if not user:
-        await update.message.reply_text('You have not Guessed any characters yet....')
-        return
-
-
-    character = next((c for c in user['characters'] if c['id'] == character_id), None)
+    character = await repository.owned_character(user_id, character_id)
     if not character:
         await update.message.reply_text('This Character is Not In your collection')
         return
 
-    
-    user['favorites'] = [character_id]
-
-    
-    await user_collection.update_one({'id': user_id}, {'$set': {'favorites': user['favorites']}})
+    await repository.set_favorites(user_id, [character_id])
 
     await update.message.reply_text(f'Character {character["name"]} has been added to your favorite...')
     
 
 
 
+async def on_error(update: object, context: CallbackContext) -> None:
+    if isinstance(context.error, DatabaseUnavailable) and isinstance(update, Update):
+        # A clear notice instead of a hang, whatever the handler was doing.
+        await reply_degraded(update)
+        return
+    LOGGER.error("Error while handling an update", exc_info=context.error)
+
+
+spawn_scheduler.spawn = spawn
+
+application.add_handler(TypeHandler(Update, bind_update), group=-2)
+application.add_handler(CommandHandler("fav", fav, block=False))
+application.add_handler(CommandHandler(["guess", "protecc", "collect", "grab", "marry"], guess, block=False))
+application.add_handler(CommandHandler("xfav", fav, block=False))
+application.add_handler(MessageHandler(filters.ALL, message_counter, block=False))
+application.add_error_handler(on_error)
+
+
 def main() -> None:
     """Run bot."""
 
-    application.add_handler(CommandHandler("fav", fav, block=False))
-    application.add_handler(CommandHandler(["guess", "protecc", "collect", "grab", "marry"], guess, block=False))
-    application.add_handler(CommandHandler("xfav", fav, block=False))
-    application.add_handler(MessageHandler(filters.ALL, message_counter, block=False))
+    if RECORD_UPDATES:
+        from shivu import recorder
+        recorder.active = recorder.UpdateRecorder(RECORD_UPDATES)
+        application.add_handler(TypeHandler(Update, recorder.active), group=-1)
 
+    application.post_init = post_init
+    application.post_shutdown = post_shutdown
     application.run_polling(drop_pending_updates=True)
     
 if __name__ == "__main__":
-    shivuu.start()
-    LOGGER.info("Bot started")
+    LOGGER.info("Bot starting")
     main()
 
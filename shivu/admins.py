@@ -0,0 +1,67 @@
+import asyncio
+
+from pyrogram.enums import ChatMemberStatus, ChatMembersFilter
+
+from shivu import shivuu, ADMIN_CACHE_TTL, LOGGER
+from shivu.caches import StatsTTLCache
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+
+class AdminCache:
+    """The admins of each chat, so admin-gated commands skip the network call.
+
+    A chat's admin list is fetched once with a single ``get_chat_members``
+    call, patched from chat-member updates as people are promoted or demoted,
+    and dropped after ``ttl`` seconds in case an update was missed.
+    Concurrent lookups for the same chat share one fetch.
+    """
+
+    def __init__(self, ttl: float):
+        self.admins = StatsTTLCache('chat_admins', maxsize=20000, ttl=ttl)
+        self.fetching = {}
+
+    async def _fetch(self, chat_id: int) -> set:
+        admins = set()
+        async for member in shivuu.get_chat_members(chat_id, filter=ChatMembersFilter.ADMINISTRATORS):
+            admins.add(member.user.id)
+        return admins
+
+    async def get(self, chat_id: int) -> set:
+        admins = self.admins.get(chat_id)
+        if admins is not None:
+            return admins
+        task = self.fetching.get(chat_id)
+        if task is None:
+            task = self.fetching[chat_id] = asyncio.ensure_future(self._fetch(chat_id))
+        try:
+            admins = await asyncio.shield(task)
+        finally:
+            if self.fetching.get(chat_id) is task and task.done():
+                del self.fetching[chat_id]
+        self.admins[chat_id] = admins
+        return admins
+
+    async def is_admin(self, chat_id: int, user_id: int) -> bool:
+        try:
+            return user_id in await self.get(chat_id)
+        except Exception as e:
+            # Private chats and chats where the bot can't list members.
+            LOGGER.warning("Could not list admins of %s: %s", chat_id, e)
+            member = await shivuu.get_chat_member(chat_id, user_id)
+            return member.status in ADMIN_STATUSES
+
+    def member_updated(self, chat_id: int, user_id: int, status) -> None:
+        admins = self.admins.get(chat_id)
+        if admins is None:
+            return
+        if status in ADMIN_STATUSES:
+            admins.add(user_id)
+        else:
+            admins.discard(user_id)
+
+    def forget(self, chat_id: int) -> None:
+        self.admins.pop(chat_id, None)
+
+
+admin_cache = AdminCache(ADMIN_CACHE_TTL)
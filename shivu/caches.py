@@ -0,0 +1,41 @@
+from cachetools import LRUCache, TTLCache
+
+# Every named cache in the process, for /caches and the benchmarks.
+CACHES = {}
+
+_MISSING = object()
+
+
+class _StatsMixin:
+    """Counts hits and misses of ``get`` and registers the cache by name."""
+
+    def _register(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        value = super().get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class StatsLRUCache(_StatsMixin, LRUCache):
+    def __init__(self, name, maxsize, **kwargs):
+        super().__init__(maxsize, **kwargs)
+        self._register(name)
+
+
+class StatsTTLCache(_StatsMixin, TTLCache):
+    def __init__(self, name, maxsize, ttl, **kwargs):
+        super().__init__(maxsize, ttl, **kwargs)
+        self._register(name)
@@ -0,0 +1,249 @@
+import asyncio
+import sys
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from shivu import repository, LOGGER
+
+RARITY_MAP = {1: "⚪ Common", 2: "🟣 Rare", 3: "🟡 Legendary", 4: "🟢 Medium", 5: "💮 Special edition"}
+
+
+def id_key(character_id: str):
+    """Sort key putting sequence ids ("07", "123") in numeric order."""
+    return (len(character_id), character_id)
+
+
+def keyset_page(items: list, keys: list, after: str, limit: int, predicate=None):
+    """Return up to ``limit`` items whose key follows ``after``, plus the resume id.
+
+    ``keys`` is the sorted ``id_key`` of each item. Starting from a bisect
+    instead of an offset keeps page 20 as cheap as page 1. The resume id is
+    empty once there is nothing left.
+    """
+    start = bisect_right(keys, id_key(after)) if after else 0
+    page = []
+    for index in range(start, len(items)):
+        item = items[index]
+        if predicate is None or predicate(item):
+            if len(page) == limit:
+                return page, page[-1]['id']
+            page.append(item)
+    return page, ''
+
+
+class Character:
+    """An immutable catalog entry, shared by every cache that holds the character.
+
+    Reads like the Mongo document it replaces (``character['name']``,
+    ``get``, ``in``, ``dict(character)``) but keeps one copy per character
+    instead of one per owner. Use ``to_doc()`` when writing it back to Mongo.
+    """
+
+    __slots__ = ('id', 'name', 'anime', 'rarity', 'img_url', 'message_id', 'extra')
+
+    FIELDS = ('id', 'name', 'anime', 'rarity', 'img_url', 'message_id')
+    # Stored on the document but not part of the character.
+    SKIP = ('_id', 'revision')
+
+    def __init__(self, id, name, anime, rarity, img_url, message_id=None, extra=None):
+        setattr_ = object.__setattr__
+        setattr_(self, 'id', sys.intern(id))
+        setattr_(self, 'name', name)
+        setattr_(self, 'anime', sys.intern(anime))
+        setattr_(self, 'rarity', sys.intern(rarity))
+        setattr_(self, 'img_url', img_url)
+        setattr_(self, 'message_id', message_id)
+        setattr_(self, 'extra', extra or None)
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> 'Character':
+        extra = {k: v for k, v in doc.items() if k not in cls.FIELDS and k not in cls.SKIP}
+        return cls(doc['id'], doc['name'], doc['anime'], doc['rarity'], doc['img_url'],
+                   doc.get('message_id'), extra)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Character is immutable')
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return [k for k in self.FIELDS if getattr(self, k) is not None] + list(self.extra or ())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_doc(self) -> dict:
+        return {k: self[k] for k in self.keys()}
+
+    def matches(self, doc: dict) -> bool:
+        return (doc.get('id') == self.id and doc.get('name') == self.name and doc.get('anime') == self.anime
+                and doc.get('rarity') == self.rarity and doc.get('img_url') == self.img_url)
+
+    def __repr__(self):
+        return f'Character({self.id!r}, {self.name!r}, {self.anime!r}, {self.rarity!r})'
+
+
+class Catalog:
+    """In-memory copy of the character collection, ordered by id.
+
+    Spawns and catalog-wide inline queries read from here instead of scanning
+    Mongo. ``/upload``, ``/update`` and ``/delete`` keep it in step through
+    ``add``/``update``/``remove``; ``version`` changes on every edit.
+    Entries are ``Character`` records, and ``intern`` maps the copies embedded
+    in user documents back onto them. ``revision`` is the collection's change
+    counter (see ``next_revision``) as of the last load or sync.
+    """
+
+    def __init__(self):
+        self.characters = []
+        self.keys = []
+        self.by_id = {}
+        self.anime_counts = Counter()
+        self.by_anime = defaultdict(set)
+        self.by_rarity = defaultdict(list)
+        # Records for embedded copies that differ from the catalog entry
+        # (edited or deleted since they were caught), shared the same way.
+        self.variants = {}
+        self.version = 0
+        self.revision = 0
+        self.loaded = False
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.characters)
+
+    def __contains__(self, character_id):
+        return character_id in self.by_id
+
+    def get(self, character_id):
+        return self.by_id.get(character_id)
+
+    def intern(self, doc):
+        """Return the shared record for a character document."""
+        if isinstance(doc, Character):
+            return doc
+        shared = self.by_id.get(doc.get('id'))
+        if shared is not None and shared.matches(doc):
+            return shared
+        key = (doc.get('id'), doc.get('name'), doc.get('anime'), doc.get('rarity'), doc.get('img_url'))
+        shared = self.variants.get(key)
+        if shared is None:
+            shared = self.variants[key] = Character.from_doc(doc)
+        return shared
+
+    async def load(self) -> None:
+        revision = await current_revision()
+        docs = await repository.all_characters()
+        self.replace([Character.from_doc(doc) for doc in docs], revision)
+        LOGGER.info("Catalog loaded: %d characters", len(docs))
+
+    def replace(self, docs: list, revision: int) -> None:
+        """Swap in a whole new set of ``Character`` records."""
+        docs.sort(key=lambda c: id_key(c['id']))
+        self.characters = docs
+        self.keys = [id_key(c['id']) for c in docs]
+        self.by_id = {c['id']: c for c in docs}
+        self.anime_counts = Counter(c['anime'] for c in docs)
+        self.by_anime = defaultdict(set)
+        self.by_rarity = defaultdict(list)
+        for c in docs:
+            self.by_anime[c['anime']].add(c['id'])
+            self.by_rarity[c['rarity']].append(c['id'])
+        self.variants = {}
+        self.revision = revision
+        self.version += 1
+        self.loaded = True
+
+    async def ensure_loaded(self) -> None:
+        if self.loaded:
+            return
+        async with self._lock:
+            if not self.loaded:
+                await self.load()
+
+    def page(self, after: str, limit: int, predicate=None):
+        return keyset_page(self.characters, self.keys, after, limit, predicate)
+
+    def _index(self, character_id: str) -> int:
+        return bisect_left(self.keys, id_key(character_id))
+
+    def add(self, character: dict) -> None:
+        character = Character.from_doc(character)
+        self.remove(character['id'])
+        index = self._index(character['id'])
+        self.characters.insert(index, character)
+        self.keys.insert(index, id_key(character['id']))
+        self.by_id[character['id']] = character
+        self.anime_counts[character['anime']] += 1
+        self.by_anime[character['anime']].add(character['id'])
+        self.by_rarity[character['rarity']].append(character['id'])
+        self.version += 1
+
+    def update(self, character_id: str, fields: dict) -> None:
+        character = self.by_id.get(character_id)
+        if character is None:
+            return
+        updated = Character.from_doc({**character.to_doc(), **fields})
+        self.characters[self._index(character_id)] = updated
+        self.by_id[character_id] = updated
+        self.anime_counts[character['anime']] -= 1
+        self.anime_counts[updated['anime']] += 1
+        self._drop_anime(character['anime'], character_id)
+        self.by_anime[updated['anime']].add(character_id)
+        if updated['rarity'] != character['rarity']:
+            self.by_rarity[character['rarity']].remove(character_id)
+            self.by_rarity[updated['rarity']].append(character_id)
+        self.version += 1
+
+    def remove(self, character_id: str) -> None:
+        character = self.by_id.pop(character_id, None)
+        if character is None:
+            return
+        index = self._index(character_id)
+        del self.characters[index]
+        del self.keys[index]
+        self.anime_counts[character['anime']] -= 1
+        self._drop_anime(character['anime'], character_id)
+        self.by_rarity[character['rarity']].remove(character_id)
+        self.version += 1
+
+    def _drop_anime(self, anime: str, character_id: str) -> None:
+        ids = self.by_anime.get(anime)
+        if ids is not None:
+            ids.discard(character_id)
+            if not ids:
+                del self.by_anime[anime]
+
+
+async def current_revision() -> int:
+    return await repository.sequence_value('catalog_revision')
+
+
+async def next_revision() -> int:
+    """Bump the catalog's change counter; every edit stamps the character with it.
+
+    Syncs fetch only characters whose ``revision`` is newer than theirs.
+    """
+    return await repository.next_sequence_value('catalog_revision', upsert=True)
+
+
+catalog = Catalog()
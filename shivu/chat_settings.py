@@ -0,0 +1,61 @@
+from shivu import repository, SPAWN_INTERVAL, LOGGER
+
+DEFAULT_MESSAGE_FREQUENCY = 100
+
+FIELDS = {'_id': 0, 'chat_id': 1, 'message_frequency': 1, 'rarity_weights': 1, 'spawn_interval': 1}
+
+
+class ChatSettings:
+    """Per-chat spawn settings kept in memory.
+
+    ``message_counter`` runs on every group message, so it must not hit Mongo
+    for the chat's ``message_frequency``. Once ``load`` has read the whole
+    collection a missing chat simply means the defaults; before that, chats are
+    fetched and cached one at a time.
+    """
+
+    def __init__(self):
+        self.chats = {}
+        self.loaded = False
+
+    async def load(self) -> None:
+        chats = {}
+        async for doc in repository.all_chat_settings(FIELDS):
+            chats[doc.pop('chat_id')] = doc
+        self.chats.update(chats)
+        self.loaded = True
+        LOGGER.info("Chat settings loaded: %d chats", len(chats))
+
+    async def get(self, chat_id: str) -> dict:
+        settings = self.chats.get(chat_id)
+        if settings is not None:
+            return settings
+        if self.loaded:
+            return {}
+        doc = await repository.get_chat_settings(chat_id, FIELDS)
+        settings = self.chats[chat_id] = doc or {}
+        settings.pop('chat_id', None)
+        return settings
+
+    async def message_frequency(self, chat_id: str) -> int:
+        return (await self.get(chat_id)).get('message_frequency', DEFAULT_MESSAGE_FREQUENCY)
+
+    async def rarity_weights(self, chat_id: str):
+        return (await self.get(chat_id)).get('rarity_weights')
+
+    async def spawn_interval(self, chat_id: str):
+        """Minutes between time-based spawns, or None when they are off."""
+        return (await self.get(chat_id)).get('spawn_interval', SPAWN_INTERVAL)
+
+    def set(self, chat_id: str, field: str, value) -> None:
+        settings = self.chats.setdefault(chat_id, {})
+        if value is None:
+            settings.pop(field, None)
+        else:
+            settings[field] = value
+
+    def set_message_frequency(self, chat_id: str, frequency: int) -> None:
+        self.set(chat_id, 'message_frequency', frequency)
+
+
+chat_settings = ChatSettings()
@@ -15,6 +15,126 @@ class Config(object):
     api_id = 26928136
     api_hash = "1056cd55e07175e8f1bcbb356f4bb8a9"
 
+    # Logging: rotated by size or age and gzip-compressed; JSON lines if LOG_JSON
+    LOG_FILE = "log.txt"
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_ROTATE_INTERVAL = 24 * 60 * 60
+    LOG_JSON = False
+    # Records buffered for the writer thread before new ones are dropped
+    LOG_QUEUE_SIZE = 10000
+    # Same message logged more than LOG_SAMPLE_LIMIT times per LOG_SAMPLE_WINDOW seconds is sampled
+    LOG_SAMPLE_LIMIT = 20
+    LOG_SAMPLE_WINDOW = 60
+
+    # Relative spawn weight of one character of each rarity; groups can override with /rarityweight
+    RARITY_WEIGHTS = {
+        "⚪ Common": 40,
+        "🟢 Medium": 25,
+        "🟣 Rare": 20,
+        "🟡 Legendary": 10,
+        "💮 Special edition": 5,
+    }
+
+    # Minutes between time-based spawns in chats with activity (None = only message-based);
+    # groups can override with /spawntime. SPAWN_RATE caps timed spawns per second overall.
+    SPAWN_INTERVAL = None
+    SPAWN_RATE = 20
+
+    # Seconds a chat's admin list is trusted before it is fetched again.
+    ADMIN_CACHE_TTL = 600
+
+    # Groups whose /ctop top 10 is kept in memory.
+    LEADERBOARD_CACHE_SIZE = 10000
+
+    # Local msgpack copy of the catalog so restarts serve without a full Mongo scan
+    # (None disables it), and how often it is synced with Mongo, in seconds.
+    CATALOG_SNAPSHOT = "catalog.snapshot"
+    CATALOG_SYNC_INTERVAL = 300
+
+    # Owners updated per bulk write when /update or /delete reaches owned copies, and the
+    # share of time that job may spend writing (it sleeps the rest, so catches come first).
+    PROPAGATION_BATCH_SIZE = 200
+    PROPAGATION_DUTY_CYCLE = 0.25
+
+    # Outgoing Bot API calls: messages per second overall, per minute in a group and per second
+    # in a private chat, and how often a call is retried after a flood wait.
+    RATE_LIMIT_OVERALL = 30
+    RATE_LIMIT_GROUP = 20
+    RATE_LIMIT_PRIVATE = 1
+    RATE_LIMIT_RETRIES = 3
+
+    # Catches, trades, gifts and deletes are appended to the event log in batches of up to
+    # EVENT_BATCH_SIZE, at most EVENT_FLUSH_INTERVAL seconds after they happen. The consumers
+    # keeping leaderboards and stats current read it in batches of the same size.
+    EVENT_BATCH_SIZE = 500
+    EVENT_FLUSH_INTERVAL = 0.5
+
+    # Seconds a database call may take before it counts as failed (whole-collection reads get
+    # MONGO_SCAN_TIMEOUT), failures in a row that open the circuit breaker, seconds it stays
+    # open before one call probes Mongo again, and seconds between health pings.
+    MONGO_TIMEOUT = 5
+    MONGO_SCAN_TIMEOUT = 120
+    MONGO_BREAKER_FAILURES = 5
+    MONGO_BREAKER_COOLDOWN = 15
+    MONGO_HEALTH_INTERVAL = 10
+
+    # Telegram HTTP transport: requests in flight at once (one connection each on HTTP/1.1),
+    # idle connections kept alive and for how many seconds, HTTP version ("2" needs
+    # python-telegram-bot[http2]) and timeouts in seconds. POOL_TIMEOUT is how long a call
+    # waits for a free slot before failing. get_updates long-polls on a connection of its own.
+    # 16 slots at 40ms a call is ~400 calls/s, well past what Telegram lets one bot send, and
+    # in `python -m benchmarks.transport` it was the steadiest size; raise it if /sendq shows
+    # calls waiting for the pool.
+    BOT_API_POOL_SIZE = 16
+    BOT_API_KEEPALIVE = 16
+    BOT_API_KEEPALIVE_EXPIRY = 30
+    BOT_API_HTTP_VERSION = "1.1"
+    BOT_API_CONNECT_TIMEOUT = 5
+    BOT_API_READ_TIMEOUT = 10
+    BOT_API_WRITE_TIMEOUT = 20
+    BOT_API_POOL_TIMEOUT = 10
+
+    # Catalog image checks: URLs fetched at once, seconds between scan passes, seconds before a
+    # working image is checked again and before a broken one is retried, and seconds one check
+    # may take. Broken characters don't spawn until a check finds them working. A failure that
+    # may pass on its own (a timeout, a 5xx or 429) quarantines only after
+    # IMAGE_TRANSIENT_FAILURES checks in a row; a 404 or a file Telegram refuses does at once.
+    IMAGE_SCAN_CONCURRENCY = 16
+    IMAGE_SCAN_INTERVAL = 600
+    IMAGE_RESCAN_AFTER = 3 * 24 * 3600
+    IMAGE_RETRY_AFTER = 3600
+    IMAGE_SCAN_TIMEOUT = 15
+    IMAGE_TRANSIENT_FAILURES = 3
+
+    # Inline result thumbnails: directory they're kept in, longest side in pixels, format
+    # ("JPEG" or "WEBP") and quality, processes scaling them, the port the bot serves them on
+    # and the public URL that port is reachable at. Without THUMBNAIL_BASE_URL inline results
+    # use the full images as thumbnails.
+    THUMBNAIL_DIR = "thumbnails"
+    THUMBNAIL_SIZE = 320
+    THUMBNAIL_FORMAT = "JPEG"
+    THUMBNAIL_QUALITY = 80
+    THUMBNAIL_WORKERS = 2
+    THUMBNAIL_PORT = 8080
+    THUMBNAIL_BASE_URL = None
+
+    # Users remembered as recently started (their repeat /start skips Mongo), and seconds
+    # between the digest messages announcing new users in GROUP_ID.
+    PM_SEEN_CACHE_SIZE = 100000
+    NEW_USER_DIGEST_INTERVAL = 300
+
+    # Record when every task is created so /tasks can list the oldest; wraps task creation,
+    # so it is off unless needed.
+    TRACK_TASK_AGES = False
+
+    # Module names under shivu/modules to load (empty = all) and to skip
+    LOAD = []
+    NO_LOAD = []
+
+    # Path of a JSONL file to record incoming updates to, for `python -m benchmarks.replay`
+    RECORD_UPDATES = None
+
     
 class Production(Config):
     LOGGER = True
@@ -0,0 +1,287 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from shivu import repository, EVENT_BATCH_SIZE, EVENT_FLUSH_INTERVAL, LOGGER
+from shivu.leaderboards import group_tops, top_groups, catch_buckets
+
+CATCH, TRADE, GIFT, DELETE = 'catch', 'trade', 'gift', 'delete'
+
+# Seconds before a failed flush or consumer batch is tried again.
+RETRY_DELAY = 5
+# Buffered events kept while Mongo refuses writes; the oldest are dropped past it.
+MAX_PENDING = 100000
+
+
+class Consumer:
+    """Keeps one aggregate current by reading the event log in order.
+
+    ``apply(events)`` gets the events of ``types`` in each batch; the
+    checkpoint (the last ``_id`` read) is saved after it returns, so a batch
+    interrupted by a crash is applied again; each aggregate row keeps the
+    newest event it counted and skips older ones (``repository._count_once``),
+    so applying a batch twice changes nothing. Consumers with a ``reset`` own
+    an aggregate built only from the log and can be rebuilt by replaying it.
+    """
+
+    def __init__(self, name: str, types, apply, reset=None):
+        self.name = name
+        self.types = frozenset(types)
+        self.apply = apply
+        self.reset = reset
+        self.after = None
+        self.processed = 0
+        self.loaded = False
+        self.error = None
+        self.lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        if not self.loaded:
+            checkpoint = await repository.get_event_checkpoint(self.name) or {}
+            self.after = checkpoint.get('after')
+            self.processed = checkpoint.get('processed', 0)
+            self.loaded = True
+
+
+class EventLog:
+    """The append-only ``events`` collection and the consumers that tail it.
+
+    Handlers call ``append``, which only buffers the event; one task writes
+    the buffer with a single ordered ``insert_many`` every ``interval``
+    seconds, or as soon as ``batch_size`` events are waiting. Event ids are
+    ObjectIds made at append time, so they follow append order, and a
+    second task feeds each consumer the events after its checkpoint.
+    Aggregates therefore trail the catch that changed them by about one
+    flush; events still buffered when the process dies are lost.
+    """
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending = []
+        self.consumers = {}
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.newest = None
+        self.wakeup = asyncio.Event()
+        self.flushed = asyncio.Event()
+        self._tasks = []
+
+    def consumer(self, name: str, types, reset=None):
+        def register(apply):
+            self.consumers[name] = Consumer(name, types, apply, reset)
+            return apply
+        return register
+
+    def append(self, kind: str, user_id, characters, to_user_id=None, **fields) -> dict:
+        users = [user_id] if to_user_id is None else [user_id, to_user_id]
+        event = {'_id': ObjectId(), 'type': kind, 'at': datetime.now(timezone.utc), 'user_id': user_id,
+                 'to_user_id': to_user_id, 'users': users, 'characters': list(characters), **fields}
+        self.pending.append(event)
+        self.appended += 1
+        self.trim()
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+        return event
+
+    def trim(self) -> None:
+        """Drop the oldest buffered events past MAX_PENDING, counting them."""
+        excess = len(self.pending) - MAX_PENDING
+        if excess > 0:
+            del self.pending[:excess]
+            self.dropped += excess
+
+    async def _write(self, batch: list) -> None:
+        while batch:
+            try:
+                await repository.insert_events(batch)
+                return
+            except BulkWriteError as e:
+                # A retried batch may be partly in already; skip what is.
+                error = e.details['writeErrors'][0]
+                if error['code'] != 11000:
+                    raise
+                batch = batch[error['index'] + 1:]
+
+    async def flush(self) -> int:
+        written = 0
+        while self.pending:
+            # Off the list while in flight, so trimming in append only ever drops unsent events.
+            batch = self.pending[:self.batch_size]
+            del self.pending[:len(batch)]
+            try:
+                await self._write(batch)
+            except BaseException:
+                self.pending[:0] = batch
+                self.trim()
+                raise
+            self.newest = batch[-1]['_id']
+            written += len(batch)
+        self.written += written
+        if written:
+            self.flushed.set()
+        return written
+
+    async def consume(self, consumer: Consumer) -> int:
+        """Feed ``consumer`` every event after its checkpoint; return how many were read."""
+        read = 0
+        async with consumer.lock:
+            await consumer.load()
+            while True:
+                events = await repository.events_after(consumer.after, self.batch_size)
+                if not events:
+                    return read
+                relevant = [event for event in events if event['type'] in consumer.types]
+                if relevant:
+                    await consumer.apply(relevant)
+                consumer.after = events[-1]['_id']
+                consumer.processed += len(relevant)
+                await repository.set_event_checkpoint(consumer.name, {
+                    'after': consumer.after, 'processed': consumer.processed, 'updated_at': time.time()})
+                read += len(events)
+
+    async def consume_all(self) -> None:
+        for consumer in self.consumers.values():
+            try:
+                await self.consume(consumer)
+                consumer.error = None
+            except Exception as e:
+                consumer.error = str(e)
+                LOGGER.warning("Event consumer %s failed, retrying: %s", consumer.name, e)
+
+    async def replay(self, name: str) -> int:
+        """Rebuild a consumer's aggregate from the whole log; return the events read."""
+        consumer = self.consumers[name]
+        if consumer.reset is None:
+            raise ValueError(f"{name} counts data older than the event log and can't be replayed")
+        async with consumer.lock:
+            await consumer.reset()
+            consumer.after, consumer.processed, consumer.loaded = None, 0, True
+            await repository.set_event_checkpoint(name, {'after': None, 'processed': 0, 'updated_at': time.time()})
+        return await self.consume(consumer)
+
+    async def run_writer(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                LOGGER.warning("Writing %d events failed, retrying in %ds: %s", len(self.pending), RETRY_DELAY, e)
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def run_consumers(self) -> None:
+        while True:
+            self.flushed.clear()
+            await self.consume_all()
+            if any(consumer.error for consumer in self.consumers.values()):
+                await asyncio.sleep(RETRY_DELAY)
+            else:
+                await self.flushed.wait()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self.run_writer()), asyncio.create_task(self.run_consumers())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        try:
+            await self.flush()
+        except Exception as e:
+            LOGGER.warning("Lost %d events that could not be written: %s", len(self.pending), e)
+
+    def lag(self, consumer: Consumer):
+        """Seconds between the newest event written here and the last one ``consumer`` read."""
+        if self.newest is None or (consumer.after is not None and consumer.after >= self.newest):
+            return 0.0
+        if consumer.after is None:
+            return None
+        return (self.newest.generation_time - consumer.after.generation_time).total_seconds()
+
+    def stats(self) -> dict:
+        return {
+            'appended': self.appended,
+            'written': self.written,
+            'pending': len(self.pending),
+            'dropped': self.dropped,
+            'consumers': {name: {'processed': c.processed, 'lag_s': self.lag(c), 'error': c.error}
+                          for name, c in self.consumers.items()},
+        }
+
+
+event_log = EventLog(EVENT_BATCH_SIZE, EVENT_FLUSH_INTERVAL)
+
+
+@event_log.consumer('group_totals', [CATCH])
+async def count_group_catches(events: list) -> None:
+    # Member rows and group rows move together under one checkpoint, so
+    # reconciliation can compare them while holding this consumer's lock.
+    members, groups = {}, {}
+    for event in events:
+        key = (event['group_id'], event['user_id'])
+        event_ids = members[key][0] if key in members else []
+        event_ids.append(event['_id'])
+        members[key] = (event_ids, event['username'], event['first_name'])
+        group_id = event['group_id']
+        event_ids = groups[group_id][0] if group_id in groups else []
+        event_ids.append(event['_id'])
+        groups[group_id] = (event_ids, event['group_name'])
+    for row in await repository.group_members_caught(members):
+        group_tops.bumped(row.pop('group_id'), row)
+    for row in await repository.groups_caught(groups):
+        top_groups.bumped(None, row)
+
+
+@event_log.consumer('catch_buckets', [CATCH])
+async def count_catch_buckets(events: list) -> None:
+    await catch_buckets.record(events)
+
+
+@event_log.consumer('character_stats', [CATCH, TRADE, GIFT, DELETE], reset=repository.clear_character_stats)
+async def count_characters(events: list) -> None:
+    counts = {}
+    field = {CATCH: 'caught', TRADE: 'traded', GIFT: 'gifted'}
+    for event in events:
+        if event['type'] == DELETE:
+            if counts:
+                await repository.add_character_stats(counts)
+                counts = {}
+            await repository.delete_character_stats(event['characters'][0])
+            continue
+        for character_id in event['characters']:
+            fields = counts.setdefault(character_id, {})
+            fields.setdefault(field[event['type']], []).append(event['_id'])
+    if counts:
+        await repository.add_character_stats(counts)
+
+
+@event_log.consumer('user_stats', [CATCH, TRADE, GIFT], reset=repository.clear_user_stats)
+async def count_users(events: list) -> None:
+    counts = {}
+
+    def count(user_id, field, event_id):
+        counts.setdefault(user_id, {}).setdefault(field, []).append(event_id)
+
+    for event in events:
+        if event['type'] == CATCH:
+            count(event['user_id'], 'caught', event['_id'])
+        elif event['type'] == TRADE:
+            count(event['user_id'], 'traded', event['_id'])
+            count(event['to_user_id'], 'traded', event['_id'])
+        else:
+            count(event['user_id'], 'gifted', event['_id'])
+            count(event['to_user_id'], 'received', event['_id'])
+    await repository.add_user_stats(counts)
@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import inspect
+import time
+from collections import deque
+
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, PyMongoError
+
+from shivu import (db, MONGO_TIMEOUT, MONGO_BREAKER_FAILURES, MONGO_BREAKER_COOLDOWN, MONGO_HEALTH_INTERVAL,
+                   LOGGER)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+DEGRADED_TEXT = ("⚠️ The database is having trouble right now, so this isn't available. "
+                 "Spawns and guesses still work; try again in a minute.")
+
+# Writes held while the breaker is open; past this the oldest are dropped.
+MAX_DEFERRED = 100000
+
+
+class DatabaseUnavailable(Exception):
+    """Mongo timed out, refused the connection, or the breaker is open."""
+
+
+class MongoHealth:
+    """Circuit breaker in front of every query in ``shivu.repository``.
+
+    Each call gets ``timeout`` seconds. Timeouts and connection errors count
+    as failures; after ``failures`` in a row the breaker opens and calls fail
+    at once with ``DatabaseUnavailable`` instead of piling up. After
+    ``cooldown`` seconds one call (usually the monitor's ping) goes through
+    as a probe: success closes the breaker, failure opens it again. Writes
+    that must not be lost can be ``defer``-red while it is open; they are
+    replayed in order once it closes.
+    """
+
+    def __init__(self, timeout, failures, cooldown, interval):
+        self.timeout = timeout
+        self.failures = failures
+        self.cooldown = cooldown
+        self.interval = interval
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.degraded_since = None
+        self.degraded_total = 0.0
+        self.probing = False
+        self.opens = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0
+        self.ping_ms = None
+        self.deferred = deque()
+        self.replayed = 0
+        self.dropped = 0
+        self._replaying = None
+        self._task = None
+
+    @property
+    def degraded(self) -> bool:
+        return self.state != CLOSED
+
+    def admit(self) -> bool:
+        """Whether a call may go to Mongo now; the first after the cooldown becomes the probe."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def succeeded(self) -> None:
+        self.consecutive = 0
+        self.probing = False
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self.degraded_total += time.monotonic() - self.degraded_since
+            LOGGER.warning("Mongo is back after %.1fs, replaying %d deferred writes",
+                           time.monotonic() - self.degraded_since, len(self.deferred))
+            self.degraded_since = None
+            if self.deferred and self._replaying is None:
+                self._replaying = asyncio.ensure_future(self.replay())
+
+    def failed(self, name: str, error: Exception) -> None:
+        self.consecutive += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive >= self.failures):
+            if self.state == CLOSED:
+                self.opens += 1
+                self.degraded_since = time.monotonic()
+                LOGGER.warning("Mongo failing (%s: %r), serving degraded for at least %ss", name, error, self.cooldown)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(self, name: str, fn, args, kwargs, timeout):
+        if not self.admit():
+            self.rejected += 1
+            raise DatabaseUnavailable(f'{name}: circuit open')
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout)
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            self.failed(name, e)
+            raise DatabaseUnavailable(f'{name}: no answer in {timeout}s') from e
+        except (ConnectionFailure, ExecutionTimeout) as e:
+            self.errors += 1
+            self.failed(name, e)
+            raise DatabaseUnavailable(f'{name}: {e}') from e
+        except PyMongoError:
+            # Mongo answered, just not with what the query wanted (a duplicate key, say).
+            self.succeeded()
+            raise
+        except BaseException:
+            # Cancelled, or a bug in the query; either way the probe is over.
+            self.probing = False
+            raise
+        self.succeeded()
+        return result
+
+    def guard(self, name: str, fn, timeout=None):
+        """Wrap a repository query; functions returning cursors are only checked against the breaker.
+
+        Those are the whole-collection streams; their reads are bounded by
+        the client's socketTimeoutMS instead of ``timeout``.
+        """
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def guarded(*args, **kwargs):
+                return await self.call(name, fn, args, kwargs, timeout or self.timeout)
+        else:
+            @functools.wraps(fn)
+            def guarded(*args, **kwargs):
+                if self.degraded:
+                    self.rejected += 1
+                    raise DatabaseUnavailable(f'{name}: circuit open')
+                return fn(*args, **kwargs)
+        return guarded
+
+    def defer(self, fn, *args) -> None:
+        """Run ``fn(*args)`` once Mongo is back."""
+        self.deferred.append((fn, args))
+        if len(self.deferred) > MAX_DEFERRED:
+            self.deferred.popleft()
+            self.dropped += 1
+
+    async def replay(self) -> None:
+        try:
+            while self.deferred and not self.degraded:
+                fn, args = self.deferred[0]
+                try:
+                    await fn(*args)
+                except DatabaseUnavailable:
+                    return
+                except Exception as e:
+                    LOGGER.warning("Dropped deferred %s%r: %s", getattr(fn, '__name__', fn), args, e)
+                    self.dropped += 1
+                else:
+                    self.replayed += 1
+                self.deferred.popleft()
+        finally:
+            self._replaying = None
+
+    async def ping(self) -> None:
+        start = time.perf_counter()
+        await self.call('ping', db.command, ('ping',), {}, self.timeout)
+        self.ping_ms = (time.perf_counter() - start) * 1000
+
+    async def monitor(self) -> None:
+        while True:
+            try:
+                await self.ping()
+            except DatabaseUnavailable:
+                pass
+            except Exception as e:
+                LOGGER.warning("Mongo ping failed: %s", e)
+            await asyncio.sleep(min(self.interval, self.cooldown) if self.degraded else self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.monitor())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        current = time.monotonic() - self.degraded_since if self.degraded_since is not None else 0.0
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive,
+            'opens': self.opens,
+            'degraded_s': round(current, 1),
+            'degraded_total_s': round(self.degraded_total + current, 1),
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'ping_ms': None if self.ping_ms is None else round(self.ping_ms, 1),
+            'deferred': len(self.deferred),
+            'replayed': self.replayed,
+            'dropped': self.dropped,
+        }
+
+
+mongo_health = MongoHealth(MONGO_TIMEOUT, MONGO_BREAKER_FAILURES, MONGO_BREAKER_COOLDOWN, MONGO_HEALTH_INTERVAL)
+
+
+async def reply_degraded(update) -> None:
+    """Tell whoever sent ``update`` (a PTB update) that the database is unavailable."""
+    try:
+        if update.inline_query:
+            from telegram import InlineQueryResultsButton
+            await update.inline_query.answer([], cache_time=5, is_personal=True, button=InlineQueryResultsButton(
+                text='Database busy, try again in a minute', start_parameter='degraded'))
+        elif update.callback_query:
+            await update.callback_query.answer(DEGRADED_TEXT, show_alert=True)
+        elif update.effective_message:
+            await update.effective_message.reply_text(DEGRADED_TEXT)
+    except Exception as e:
+        LOGGER.warning("Could not send the degraded notice: %s", e)
+
+
+def replies_when_degraded(handler):
+    """For pyrogram handlers: answer ``DatabaseUnavailable`` with ``DEGRADED_TEXT``."""
+    @functools.wraps(handler)
+    async def wrapper(client, update):
+        try:
+            return await handler(client, update)
+        except DatabaseUnavailable:
+            if hasattr(update, 'data'):
+                await update.answer(DEGRADED_TEXT, show_alert=True)
+            else:
+                await update.reply_text(DEGRADED_TEXT)
+    return wrapper
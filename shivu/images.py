@@ -0,0 +1,341 @@
+import asyncio
+import struct
+import time
+
+import aiohttp
+
+from shivu import (application, repository, sudo_users, IMAGE_SCAN_CONCURRENCY, IMAGE_SCAN_INTERVAL,
+                   IMAGE_RESCAN_AFTER, IMAGE_RETRY_AFTER, IMAGE_SCAN_TIMEOUT, IMAGE_TRANSIENT_FAILURES, LOGGER)
+from shivu.catalog import catalog
+from shivu.ratelimit import BULK
+from shivu.sampling import sampler
+
+# Bytes asked for with a Range header; enough for the dimensions of nearly every image.
+HEAD_BYTES = 64 * 1024
+# Characters checked per pass; the rest wait for the next one.
+PASS_SIZE = 2000
+# Telegram's limits for photos sent by URL.
+MAX_PHOTO_BYTES = 5 * 1024 * 1024
+MAX_PHOTO_SIDES = 10000
+MAX_PHOTO_RATIO = 20
+# Broken characters listed in one report to sudo users.
+REPORT_SIZE = 30
+
+
+def image_size(data: bytes):
+    """``(format, width, height)`` from the first bytes of a PNG, GIF, JPEG or WebP, or None."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'gif', width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return 'webp', width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return 'webp', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            return 'webp', int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return None
+    if data[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xff:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7 or marker == 0xff:
+                i += 1 if marker == 0xff else 2
+                continue
+            length = struct.unpack('>H', data[i + 2:i + 4])[0]
+            # Start-of-frame markers, except DHT (c4), JPG (c8) and DAC (cc).
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return 'jpeg', width, height
+            i += 2 + length
+    return None
+
+
+def total_size(response):
+    """The full size of the image, from Content-Range on a partial answer or Content-Length."""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('*'):
+        return int(content_range.rsplit('/', 1)[1])
+    if response.status == 200 and response.content_length is not None:
+        return response.content_length
+    return None
+
+
+def problem(result: dict):
+    """Why Telegram would refuse the image ``result`` describes, or None."""
+    if result.get('error'):
+        return result['error']
+    if result['status'] not in (200, 206):
+        return f"HTTP {result['status']}"
+    if result['format'] is None and not (result['content_type'] or '').startswith('image/'):
+        return f"not an image ({result['content_type'] or 'no content type'})"
+    if result['bytes'] and result['bytes'] > MAX_PHOTO_BYTES:
+        return f"{result['bytes'] // 1024} KiB, over Telegram's 5 MiB for photos by URL"
+    width, height = result['width'], result['height']
+    if width and height:
+        if width + height > MAX_PHOTO_SIDES or max(width, height) / min(width, height) > MAX_PHOTO_RATIO:
+            return f'{width}x{height} is outside what Telegram accepts for photos'
+    return None
+
+
+def transient(result: dict) -> bool:
+    """Whether a failed check may pass on its own: no answer, or a status other than 404/410.
+
+    An answer that was read and judged (not an image, too large, wrong
+    dimensions) or a 404/410 is definite.
+    """
+    return result['error'] is not None or result['status'] not in (200, 206, 404, 410)
+
+
+class ImageScanner:
+    """Checks that every catalog ``img_url`` still serves an image Telegram accepts.
+
+    One pooled aiohttp session asks each URL for its first ``HEAD_BYTES``
+    (a Range request, so large images aren't downloaded), ``concurrency`` at
+    a time, and records the status, content type, size and dimensions in
+    ``image_checks``. Every ``interval`` seconds a pass checks characters
+    never checked, then those whose ``next_check_at`` has come: healthy
+    images are checked again after ``rescan_after`` seconds, broken ones
+    after ``retry_after``. Broken characters are quarantined from spawning
+    and from inline results until a check finds them working again, and
+    sudo users get a list of newly broken ones after each pass. A transient
+    failure (see ``transient``) is retried on the next pass and quarantines
+    only after ``transient_failures`` in a row, so a CDN outage or rate limit
+    doesn't empty the spawn pool.
+    """
+
+    def __init__(self, concurrency, interval, rescan_after, retry_after, timeout, transient_failures):
+        self.concurrency = concurrency
+        self.interval = interval
+        self.rescan_after = rescan_after
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self.transient_failures = transient_failures
+        # character id -> the last failed check
+        self.broken = {}
+        # character id -> transient failures in a row, while under transient_failures
+        self.failures = {}
+        # character id -> character to check at the start of the next pass
+        self.requested = {}
+        self.checked = set()
+        self.loaded = False
+        self.scanned = 0
+        self.last_pass = None
+        self.wakeup = asyncio.Event()
+        self._session = None
+        self._task = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=max(1, self.concurrency // 2),
+                                               ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': 'Mozilla/5.0 (compatible; catalog-image-check)'})
+        return self._session
+
+    async def load(self) -> None:
+        if not self.loaded:
+            self.checked = set(await repository.image_check_ids())
+            for check in await repository.broken_images():
+                self.quarantine(check['_id'], check)
+            self.loaded = True
+
+    def quarantine(self, character_id: str, check: dict) -> None:
+        self.broken[character_id] = check
+        sampler.quarantine(character_id)
+
+    def release(self, character_id: str) -> None:
+        self.broken.pop(character_id, None)
+        sampler.release(character_id)
+
+    async def fetch(self, url: str) -> dict:
+        """Status, content type, size and dimensions of the image at ``url``."""
+        result = {'url': url, 'status': None, 'content_type': None, 'bytes': None, 'format': None,
+                  'width': None, 'height': None, 'error': None}
+        try:
+            async with self.session().get(url, headers={'Range': f'bytes=0-{HEAD_BYTES - 1}'},
+                                          allow_redirects=True) as response:
+                result['status'] = response.status
+                result['content_type'] = response.content_type
+                result['bytes'] = total_size(response)
+                if response.status in (200, 206):
+                    # A server ignoring Range sends everything; stop reading once the size is known.
+                    data, size = b'', None
+                    while size is None and len(data) < HEAD_BYTES:
+                        chunk = await response.content.read(HEAD_BYTES - len(data))
+                        if not chunk:
+                            break
+                        data += chunk
+                        size = image_size(data)
+                    if size:
+                        result['format'], result['width'], result['height'] = size
+        except asyncio.TimeoutError:
+            result['error'] = f'no answer in {self.timeout}s'
+        except (aiohttp.ClientError, ValueError) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    async def check(self, character: dict) -> dict:
+        result = await self.fetch(character['img_url'])
+        result['problem'] = problem(result)
+        result['ok'] = result['problem'] is None
+        result['transient'] = not result['ok'] and transient(result)
+        now = time.time()
+        result['checked_at'] = now
+        result['next_check_at'] = now + (self.rescan_after if result['ok'] else self.retry_after)
+        return result
+
+    def judge(self, character_id: str, result: dict) -> bool:
+        """Whether ``result`` quarantines the character; transient failures need several in a row."""
+        if result['ok']:
+            self.failures.pop(character_id, None)
+            return False
+        if not result['transient'] or character_id in self.broken:
+            self.failures.pop(character_id, None)
+            return True
+        failures = self.failures.get(character_id, 0) + 1
+        if failures >= self.transient_failures:
+            self.failures.pop(character_id, None)
+            return True
+        self.failures[character_id] = failures
+        # Look again on the next pass rather than after retry_after.
+        result['next_check_at'] = result['checked_at'] + min(self.interval, self.retry_after)
+        return False
+
+    async def check_many(self, characters: list) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(character):
+            async with semaphore:
+                return character['id'], await self.check(character)
+
+        results = await asyncio.gather(*(one(character) for character in characters))
+        for character_id, result in results:
+            result['quarantined'] = self.judge(character_id, result)
+        await repository.record_image_checks(dict(results))
+        newly_broken = []
+        for character_id, result in results:
+            self.checked.add(character_id)
+            if not result['quarantined']:
+                self.release(character_id)
+            else:
+                if character_id not in self.broken:
+                    newly_broken.append((character_id, result))
+                self.quarantine(character_id, result)
+        self.scanned += len(results)
+        return newly_broken
+
+    async def check_now(self, character: dict) -> dict:
+        """Check one character right away, as after an upload or a failed spawn."""
+        await self.load()
+        newly_broken = await self.check_many([character])
+        if newly_broken:
+            await self.report(newly_broken)
+        return self.broken.get(character['id']) or {'ok': True, 'quarantined': False}
+
+    def request(self, character: dict) -> None:
+        """Have the next pass, started right away, check ``character`` first, as after a failed spawn."""
+        self.requested[character['id']] = character
+        self.wakeup.set()
+
+    async def due(self) -> list:
+        """Requested characters, then those never checked, then those whose next check has come, up to PASS_SIZE."""
+        await catalog.ensure_loaded()
+        characters = list(self.requested.values())
+        self.requested.clear()
+        ids = {c['id'] for c in characters}
+        characters += [c for c in catalog.characters if c['id'] not in self.checked and c['id'] not in ids]
+        characters = characters[:PASS_SIZE]
+        if len(characters) < PASS_SIZE:
+            stale = []
+            for check in await repository.images_due(time.time(), PASS_SIZE - len(characters)):
+                character = catalog.get(check['_id'])
+                if character is None:
+                    stale.append(check['_id'])
+                    self.release(check['_id'])
+                elif character['id'] not in ids:
+                    characters.append(character)
+            if stale:
+                await repository.delete_image_checks(stale)
+                self.checked.difference_update(stale)
+        return characters
+
+    async def scan(self) -> int:
+        """Run one pass; return how many characters it checked."""
+        await self.load()
+        characters = await self.due()
+        if not characters:
+            return 0
+        start = time.perf_counter()
+        newly_broken = await self.check_many(characters)
+        self.last_pass = {'checked': len(characters), 'newly_broken': len(newly_broken),
+                          'seconds': round(time.perf_counter() - start, 2), 'at': time.time()}
+        LOGGER.info("Image scan checked %d characters in %.1fs, %d newly broken, %d quarantined",
+                    len(characters), self.last_pass['seconds'], len(newly_broken), len(self.broken))
+        if newly_broken:
+            await self.report(newly_broken)
+        return len(characters)
+
+    async def report(self, newly_broken: list) -> None:
+        lines = [f'🖼 {len(newly_broken)} character images stopped working and are kept from spawning:']
+        for character_id, result in newly_broken[:REPORT_SIZE]:
+            character = catalog.get(character_id)
+            name = character['name'] if character else '?'
+            lines.append(f"{character_id} {name}: {result['problem']}")
+        if len(newly_broken) > REPORT_SIZE:
+            lines.append(f'... and {len(newly_broken) - REPORT_SIZE} more, see /images')
+        text = '\n'.join(lines)
+        for user_id in sudo_users:
+            try:
+                await application.bot.send_message(int(user_id), text, disable_web_page_preview=True,
+                                                   rate_limit_args=BULK)
+            except Exception as e:
+                LOGGER.warning("Could not report broken images to %s: %s", user_id, e)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                # Keep going while a pass was full; there is more due.
+                while await self.scan() >= PASS_SIZE:
+                    pass
+            except Exception as e:
+                LOGGER.warning("Image scan failed: %s", e)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> dict:
+        return {'checked': len(self.checked), 'quarantined': len(self.broken), 'failing': len(self.failures),
+                'scanned': self.scanned, 'last_pass': self.last_pass}
+
+
+image_scanner = ImageScanner(IMAGE_SCAN_CONCURRENCY, IMAGE_SCAN_INTERVAL, IMAGE_RESCAN_AFTER, IMAGE_RETRY_AFTER,
+                             IMAGE_SCAN_TIMEOUT, IMAGE_TRANSIENT_FAILURES)
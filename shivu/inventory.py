@@ -0,0 +1,54 @@
+from shivu import repository
+from shivu.caches import StatsLRUCache, StatsTTLCache
+from shivu.catalog import catalog
+from shivu.health import mongo_health, DatabaseUnavailable
+
+user_cache = StatsTTLCache('users', maxsize=10000, ttl=60)
+# The same documents without the TTL, served while Mongo is unavailable.
+last_known = StatsLRUCache('users_last_known', maxsize=10000)
+
+# Bumped whenever a user's characters change; caches derived from a user's
+# collection include it in their keys instead of being purged one by one.
+versions = {}
+
+
+def version(user_id: int) -> int:
+    return versions.get(user_id, 0)
+
+
+def changed(*user_ids: int) -> None:
+    for user_id in user_ids:
+        versions[user_id] = versions.get(user_id, 0) + 1
+        user_cache.pop(user_id, None)
+        last_known.pop(user_id, None)
+
+
+async def get_user(user_id: int):
+    user = user_cache.get(user_id)
+    if user is None:
+        try:
+            user = await repository.get_user(user_id)
+        except DatabaseUnavailable:
+            user = last_known.get(user_id)
+            if user is None:
+                raise
+            return user
+        if user:
+            user['characters'] = [catalog.intern(c) for c in user.get('characters', [])]
+            user_cache[user_id] = last_known[user_id] = user
+    return user
+
+
+async def _store_character(user_id: int, character: dict, username, first_name) -> None:
+    await repository.add_character(user_id, character, username, first_name)
+    changed(user_id)
+
+
+async def add_character(user_id: int, character: dict, username, first_name) -> bool:
+    """Give ``character`` to the user; False when Mongo is unavailable and the write was deferred."""
+    try:
+        await _store_character(user_id, character, username, first_name)
+    except DatabaseUnavailable:
+        mongo_health.defer(_store_character, user_id, character, username, first_name)
+        return False
+    return True
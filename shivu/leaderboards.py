@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from shivu import repository, LEADERBOARD_CACHE_SIZE
+from shivu.caches import StatsLRUCache
+
+TOP_SIZE = 10
+
+# Days covered by each windowed leaderboard, counting today.
+WINDOWS = {'day': 1, 'week': 7, 'month': 30}
+# Buckets are deleted by a TTL index once no window can reach them.
+BUCKET_DAYS = max(WINDOWS.values()) + 1
+
+
+class Leaderboard:
+    """The top ``size`` rows of a ranking, per key, cached and kept current.
+
+    A miss loads the rows with ``fetch(key, size)``, which an index on
+    ``(key, count)`` answers without a sort. After that a catch only calls
+    ``bumped`` with the row's new count. A count that grew keeps the cached
+    top exact: the row is either already in it or enters it once it beats the
+    last row (or the top isn't full, meaning every row is in it). A count that
+    shrank (a reconcile repair) may let a row from outside a full top past it,
+    so that top is dropped and the next ``top`` loads it again.
+    """
+
+    def __init__(self, name: str, id_field: str, fetch, size: int = TOP_SIZE, maxsize: int = 10000):
+        self.id_field = id_field
+        self.fetch = fetch
+        self.size = size
+        self.boards = StatsLRUCache(name, maxsize=maxsize)
+        # Loads in flight, with whether a bump arrived while they ran.
+        self.loading = {}
+
+    async def top(self, key=None) -> list:
+        board = self.boards.get(key)
+        if board is not None:
+            return board
+        if key in self.loading:
+            return await asyncio.shield(self.loading[key][0])
+
+        task = asyncio.ensure_future(self.fetch(key, self.size))
+        self.loading[key] = [task, False]
+        try:
+            board = await asyncio.shield(task)
+        finally:
+            _, dirty = self.loading.pop(key, (None, True))
+        if not dirty:
+            # A bump during the load may be missing from what was read.
+            self.boards[key] = board
+        return board
+
+    def bumped(self, key, row: dict) -> None:
+        """``row`` now has ``row['count']``; update the cached top if there is one."""
+        if key in self.loading:
+            self.loading[key][1] = True
+        try:
+            board = self.boards[key]
+        except KeyError:
+            return
+        ident = row[self.id_field]
+        for index, existing in enumerate(board):
+            if existing[self.id_field] == ident:
+                if row['count'] < existing['count'] and len(board) >= self.size:
+                    self.forget(key)
+                    return
+                board[index] = row
+                break
+        else:
+            if len(board) >= self.size and row['count'] <= board[-1]['count']:
+                return
+            board.append(row)
+        board.sort(key=lambda r: r['count'], reverse=True)
+        del board[self.size:]
+
+    def forget(self, key=None) -> None:
+        self.boards.pop(key, None)
+
+
+async def fetch_top_groups(_, size):
+    return await repository.top_groups(size)
+
+
+group_tops = Leaderboard('group_leaderboards', 'user_id', repository.group_top, maxsize=LEADERBOARD_CACHE_SIZE)
+top_groups = Leaderboard('top_groups', 'group_id', fetch_top_groups, maxsize=1)
+
+
+def bucket_days(window: str, now=None) -> list:
+    today = (now or datetime.now(timezone.utc)).date()
+    return [(today - timedelta(days=n)).isoformat() for n in range(WINDOWS[window])]
+
+
+class CatchBuckets:
+    """Per-day catch counters, one row per (scope, day, id).
+
+    Scopes are ``users`` (global /top), ``groups`` (/TopGroups) and
+    ``group:<id>`` (/ctop). Each row holds that day's count and the name to
+    show; a window is summed and ranked by one aggregate over the
+    ``(scope, day, count)`` index, so no document grows with the number of
+    catchers. Windowed tops are cached under a per-scope version that every
+    recorded catch bumps, so a result is reused until one of its rows changes.
+    """
+
+    def __init__(self):
+        self.versions = {}
+        self.tops = StatsLRUCache('windowed_leaderboards', maxsize=LEADERBOARD_CACHE_SIZE)
+
+    async def record(self, events: list) -> None:
+        """Count catch events into the rows of the day each happened, one upsert per row."""
+        rows = {}
+        for event in events:
+            day = event['at'].date()
+            expires_at = datetime.combine(day, datetime.min.time(), timezone.utc) + timedelta(days=BUCKET_DAYS)
+            user_id, group = str(event['user_id']), str(event['group_id'])
+            user_name = [event['username'], event['first_name']]
+            for scope, key, name in (('users', user_id, user_name), (f'group:{group}', user_id, user_name),
+                                     ('groups', group, event['group_name'])):
+                row = (scope, day.isoformat(), key)
+                event_ids = rows[row][0] if row in rows else []
+                event_ids.append(event['_id'])
+                rows[row] = (event_ids, name, expires_at)
+        if not rows:
+            return
+
+        await repository.record_catch_buckets(rows)
+        for scope in {scope for scope, _, _ in rows}:
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+
+    async def top(self, scope: str, window: str, now=None) -> list:
+        """Rows of (id, name, count) for the ``TOP_SIZE`` biggest counts in the window."""
+        days = bucket_days(window, now)
+        key = (scope, window, days[0], self.versions.get(scope, 0))
+        rows = self.tops.get(key)
+        if rows is not None:
+            return rows
+
+        rows = [(row['_id'], row.get('name'), row['count'])
+                for row in await repository.catch_buckets_window(scope, days, TOP_SIZE)]
+        self.tops[key] = rows
+        return rows
+
+
+catch_buckets = CatchBuckets()
@@ -0,0 +1,173 @@
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+
+# chat/user of the update being handled, filled in by bind_update so every
+# record logged while handling it carries them.
+update_context = contextvars.ContextVar('update_context', default=None)
+
+listener = None
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread and drops them when the queue is full.
+
+    Logging must never block the event loop, so a slow disk costs log lines,
+    not latency. Dropped records are counted and reported once space frees up.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        context = update_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.LogRecord('shivu.logs', logging.WARNING, __file__, 0,
+                                       'Dropped %d log records: log queue was full', (dropped,), None)
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped += dropped
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through at most ``limit`` records per message template per ``window`` seconds.
+
+    Suppressed records are counted and the count is appended to the next
+    record that gets through. Errors are never sampled.
+    """
+
+    def __init__(self, limit=20, window=60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self.limit:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        started, passed, suppressed = self._counts.get(key, (now, 0, 0))
+        if now - started >= self.window:
+            started, passed = now, 0
+        if passed >= self.limit:
+            self._counts[key] = (started, passed, suppressed + 1)
+            return False
+        if suppressed:
+            record.msg = f'{record.msg} ({suppressed} similar messages suppressed)'
+            suppressed = 0
+        self._counts[key] = (started, passed + 1, suppressed)
+        if len(self._counts) > 10000:
+            self._counts.clear()
+        return True
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates on size or age, gzip-compressing rotated files."""
+
+    def __init__(self, filename, max_bytes, backup_count, interval):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.opened_at = time.time()
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() - self.opened_at >= self.interval:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+    def rotation_filename(self, default_name):
+        return default_name + '.gz'
+
+    def rotate(self, source, dest):
+        if not os.path.exists(source):
+            return
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ('handler', 'chat_id', 'user_id', 'update_type')
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        data.setdefault('handler', f'{record.module}.{record.funcName}')
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(config) -> None:
+    """Route all logging through a bounded queue to a background writer thread."""
+    global listener
+    if listener is not None:
+        return
+
+    formatter = (JsonFormatter() if getattr(config, 'LOG_JSON', False) else
+                 logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    handlers = [logging.StreamHandler()]
+    if getattr(config, 'LOG_FILE', None):
+        handlers.append(CompressingRotatingFileHandler(
+            config.LOG_FILE, config.LOG_MAX_BYTES, config.LOG_BACKUP_COUNT, config.LOG_ROTATE_INTERVAL))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = BoundedQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLE_LIMIT, config.LOG_SAMPLE_WINDOW))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+async def bind_update(update, context) -> None:
+    """TypeHandler callback tagging log records with the update's chat and user."""
+    update_context.set({
+        'chat_id': update.effective_chat.id if update.effective_chat else None,
+        'user_id': update.effective_user.id if update.effective_user else None,
+        'update_type': next((name for name in ('message', 'edited_message', 'callback_query', 'inline_query',
+                                                'chat_member', 'my_chat_member')
+                             if getattr(update, name, None) is not None), None),
+    })
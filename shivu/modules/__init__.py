@@ -4,16 +4,7 @@ import time
 
 StartTime = time.time()
 
-# enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    handlers=[logging.FileHandler("log.txt"), logging.StreamHandler()],
-    level=logging.INFO,
-)
-
-logging.getLogger("apscheduler").setLevel(logging.ERROR)
-
-logging.getLogger("pyrate_limiter").setLevel(logging.ERROR)
+# logging itself is configured by shivu/__init__.py
 LOGGER = logging.getLogger(__name__)
 
 # if version < 3.6, stop bot.
@@ -23,44 +14,29 @@ if sys.version_info[0] < 3 or sys.version_info[1] < 6:
     )
     quit(1)
 
-LOAD = []
-NO_LOAD = []
+from shivu import LOAD, NO_LOAD
+
 
 def __list_all_modules():
-    import glob
-    from os.path import basename, dirname, isfile
+    import pkgutil
 
     # This generates a list of modules in this folder for the * in __main__ to work.
-    mod_paths = glob.glob(dirname(__file__) + "/*.py")
-    all_modules = [
-        basename(f)[:-3]
-        for f in mod_paths
-        if isfile(f) and f.endswith(".py") and not f.endswith("__init__.py")
-    ]
-
-    if LOAD or NO_LOAD:
-        to_load = LOAD
-        if to_load:
-            if not all(
-                any(mod == module_name for module_name in all_modules)
-                for mod in to_load
-            ):
-                LOGGER.error("Invalid loadorder names, Quitting...")
-                quit(1)
-
-            all_modules = sorted(set(all_modules) - set(to_load))
-            to_load = list(all_modules) + to_load
-
-        else:
-            to_load = all_modules
-
-        if NO_LOAD:
-            LOGGER.info("Not loading: {}".format(NO_LOAD))
-            return [item for item in to_load if item not in NO_LOAD]
-
-        return to_load
-
-    return all_modules
+    all_modules = sorted(name for _, name, is_pkg in pkgutil.iter_modules(__path__) if not is_pkg)
+
+    # LOAD selects which modules to import (in that order); NO_LOAD skips modules.
+    to_load = all_modules
+    if LOAD:
+        invalid = [mod for mod in LOAD if mod not in all_modules]
+        if invalid:
+            LOGGER.error("Invalid LOAD module names %s, Quitting...", invalid)
+            quit(1)
+        to_load = list(LOAD)
+
+    if NO_LOAD:
+        LOGGER.info("Not loading: {}".format(NO_LOAD))
+        return [item for item in to_load if item not in NO_LOAD]
+
+    return to_load
 
 
 ALL_MODULES = __list_all_modules()
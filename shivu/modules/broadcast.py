@@ -1,7 +1,8 @@
 from telegram import Update
 from telegram.ext import CallbackContext, CommandHandler 
 
-from shivu import application, top_global_groups_collection, pm_users, OWNER_ID 
+from shivu import application, repository, OWNER_ID, LOGGER
+from shivu.ratelimit import BULK
 
 async def broadcast(update: Update, context: CallbackContext) -> None:
     
@@ -15,8 +16,8 @@ async def broadcast(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("Please reply to a message to broadcast.")
         return
 
-    all_chats = await top_global_groups_collection.distinct("group_id")
-    all_users = await pm_users.distinct("_id")
+    all_chats = await repository.group_ids()
+    all_users = await repository.pm_user_ids()
 
     shuyaa = list(set(all_chats + all_users))
 
@@ -26,9 +27,10 @@ async def broadcast(update: Update, context: CallbackContext) -> None:
         try:
             await context.bot.forward_message(chat_id=chat_id,
                                               from_chat_id=message_to_broadcast.chat_id,
-                                              message_id=message_to_broadcast.message_id)
+                                              message_id=message_to_broadcast.message_id,
+                                              rate_limit_args=BULK)
         except Exception as e:
-            print(f"Failed to send message to {chat_id}: {e}")
+            LOGGER.warning("Failed to send message to %s: %s", chat_id, e)
             failed_sends += 1
 
     await update.message.reply_text(f"Broadcast complete. Failed to send to {failed_sends} chats/users.")
@@ -1,10 +1,13 @@
-from pymongo import  ReturnDocument
-from pyrogram.enums import ChatMemberStatus, ChatType
-from shivu import user_totals_collection, shivuu
+from shivu import repository, shivuu
+from shivu.admins import admin_cache
+from shivu.catalog import RARITY_MAP
+from shivu.chat_settings import chat_settings
+from shivu.sampling import sampler
+from shivu.scheduler import spawn_scheduler
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import Message, ChatMemberUpdated
 
-ADMINS = [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+MIN_SPAWN_INTERVAL = 5
 
 
 @shivuu.on_message(filters.command("changetime"))
@@ -12,10 +15,7 @@ async def change_time(client: Client, message: Message):
     
     user_id = message.from_user.id
     chat_id = message.chat.id
-    member = await shivuu.get_chat_member(chat_id,user_id)
-        
-
-    if member.status not in ADMINS :
+    if not await admin_cache.is_admin(chat_id, user_id):
         await message.reply_text('You are not an Admin.')
         return
 
@@ -31,13 +31,101 @@ async def change_time(client: Client, message: Message):
             return
 
     
-        chat_frequency = await user_totals_collection.find_one_and_update(
-            {'chat_id': str(chat_id)},
-            {'$set': {'message_frequency': new_frequency}},
-            upsert=True,
-            return_document=ReturnDocument.AFTER
-        )
+        await repository.set_chat_setting(str(chat_id), 'message_frequency', new_frequency)
+        chat_settings.set_message_frequency(str(chat_id), new_frequency)
 
         await message.reply_text(f'Successfully changed {new_frequency}')
     except Exception as e:
         await message.reply_text(f'Failed to change {str(e)}')
+
+
+@shivuu.on_message(filters.command("rarityweight"))
+async def rarity_weight(client: Client, message: Message):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    if not await admin_cache.is_admin(chat_id, user_id):
+        await message.reply_text('You are not an Admin.')
+        return
+
+    args = message.command
+    overrides = dict(await chat_settings.rarity_weights(str(chat_id)) or {})
+
+    if len(args) == 1:
+        weights = sampler.weights_for(overrides)
+        lines = [f'{number}. {rarity}: {weights.get(rarity, 1)}' for number, rarity in RARITY_MAP.items()]
+        await message.reply_text('Spawn weights in this chat:\n' + '\n'.join(lines) +
+                                 '\n\nUse: /rarityweight RARITY-NUMBER WEIGHT or /rarityweight reset')
+        return
+
+    try:
+        if len(args) == 2 and args[1] == 'reset':
+            overrides = None
+        elif len(args) == 3:
+            rarity = RARITY_MAP[int(args[1])]
+            weight = int(args[2])
+            if weight < 0 or weight > 1000:
+                await message.reply_text('The weight must be between 0 and 1000.')
+                return
+            overrides[rarity] = weight
+            if not any(w > 0 for w in sampler.weights_for(overrides).values()):
+                await message.reply_text('At least one rarity needs a weight above 0.')
+                return
+        else:
+            await message.reply_text('Please use: /rarityweight RARITY-NUMBER WEIGHT')
+            return
+
+        await repository.set_chat_setting(str(chat_id), 'rarity_weights', overrides or None)
+        chat_settings.set(str(chat_id), 'rarity_weights', overrides)
+
+        await message.reply_text('Spawn weights reset.' if overrides is None else f'Successfully changed {rarity} to {weight}')
+    except (KeyError, ValueError):
+        await message.reply_text('Invalid rarity number or weight. Rarity numbers: ' +
+                                 ', '.join(f'{n} ({r})' for n, r in RARITY_MAP.items()))
+    except Exception as e:
+        await message.reply_text(f'Failed to change {str(e)}')
+
+
+@shivuu.on_message(filters.command("spawntime"))
+async def spawn_time(client: Client, message: Message):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    if not await admin_cache.is_admin(chat_id, user_id):
+        await message.reply_text('You are not an Admin.')
+        return
+
+    args = message.command
+    if len(args) != 2:
+        await message.reply_text('Please use: /spawntime MINUTES or /spawntime off')
+        return
+
+    try:
+        if args[1] == 'off':
+            minutes = 0
+        else:
+            minutes = int(args[1])
+            if minutes < MIN_SPAWN_INTERVAL:
+                await message.reply_text(f'The spawn time must be at least {MIN_SPAWN_INTERVAL} minutes.')
+                return
+
+        await repository.set_chat_setting(str(chat_id), 'spawn_interval', minutes)
+        chat_settings.set(str(chat_id), 'spawn_interval', minutes)
+        if not minutes:
+            spawn_scheduler.forget(chat_id)
+
+        await message.reply_text('Time-based spawns turned off.' if not minutes else
+                                 f'A character will spawn at most every {minutes} minutes while the chat is active.')
+    except ValueError:
+        await message.reply_text('Please use: /spawntime MINUTES or /spawntime off')
+    except Exception as e:
+        await message.reply_text(f'Failed to change {str(e)}')
+
+
+@shivuu.on_chat_member_updated()
+async def chat_member_updated(client: Client, update: ChatMemberUpdated):
+    member = update.new_chat_member or update.old_chat_member
+    if member is None or member.user is None:
+        return
+    status = update.new_chat_member.status if update.new_chat_member else None
+    admin_cache.member_updated(update.chat.id, member.user.id, status)
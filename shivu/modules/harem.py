@@ -7,12 +7,15 @@ import random
 from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from shivu import collection, user_collection, application
+from shivu import application, inventory
+from shivu.catalog import catalog
 
 async def harem(update: Update, context: CallbackContext, page=0) -> None:
     user_id = update.effective_user.id
 
-    user = await user_collection.find_one({'id': user_id})
+    # Served from the inventory cache and the in-memory catalog, even while Mongo is down.
+    user = await inventory.get_user(user_id)
+    await catalog.ensure_loaded()
     if not user:
         if update.message:
             await update.message.reply_text('You Have Not Guessed any Characters Yet..')
@@ -42,7 +45,7 @@ async def harem(update: Update, context: CallbackContext, page=0) -> None:
     current_grouped_characters = {k: list(v) for k, v in groupby(current_characters, key=lambda x: x['anime'])}
 
     for anime, characters in current_grouped_characters.items():
-        harem_message += f'\n<b>{anime} {len(characters)}/{await collection.count_documents({"anime": anime})}</b>\n'
+        harem_message += f'\n<b>{anime} {len(characters)}/{catalog.anime_counts[anime]}</b>\n'
 
         for character in characters:
             
@@ -0,0 +1,57 @@
+from html import escape
+
+from telegram import Update
+from telegram.ext import CommandHandler, CallbackContext
+
+from shivu import application, repository
+from shivu.catalog import catalog
+from shivu.events import CATCH, TRADE, GIFT, DELETE
+
+HISTORY_SIZE = 20
+
+
+def character_name(character_id: str) -> str:
+    character = catalog.get(character_id)
+    return escape(character['name']) if character else f'#{escape(character_id)}'
+
+
+def describe(event: dict) -> str:
+    when = event['at'].strftime('%Y-%m-%d %H:%M')
+    who = escape(event.get('first_name') or str(event['user_id']))
+    whom = escape(event.get('to_first_name') or str(event.get('to_user_id')))
+    characters = [character_name(character_id) for character_id in event['characters']]
+    if event['type'] == CATCH:
+        return f"<code>{when}</code> 🎯 {who} caught <b>{characters[0]}</b> in {escape(event.get('group_name') or 'a group')}"
+    if event['type'] == TRADE:
+        return f"<code>{when}</code> 🔄 {who} traded <b>{characters[0]}</b> for <b>{characters[1]}</b> with {whom}"
+    if event['type'] == GIFT:
+        return f"<code>{when}</code> 🎁 {who} gifted <b>{characters[0]}</b> to {whom}"
+    if event['type'] == DELETE:
+        return f"<code>{when}</code> 🗑 <b>{characters[0]}</b> was deleted"
+    return f"<code>{when}</code> {escape(event['type'])}"
+
+
+async def history(update: Update, context: CallbackContext) -> None:
+    await catalog.ensure_loaded()
+
+    if context.args:
+        character_id = context.args[0]
+        events = await repository.character_events(character_id, HISTORY_SIZE)
+        stats = await repository.get_character_stats(character_id) or {}
+        header = (f"<b>{character_name(character_id)}</b>: caught {stats.get('caught', 0)}, "
+                  f"traded {stats.get('traded', 0)}, gifted {stats.get('gifted', 0)} times")
+    else:
+        events = await repository.user_events(update.effective_user.id, HISTORY_SIZE)
+        stats = await repository.get_user_stats(update.effective_user.id) or {}
+        header = (f"<b>{escape(update.effective_user.first_name)}'s last catches, trades and gifts</b>\n"
+                  f"Caught {stats.get('caught', 0)}, traded {stats.get('traded', 0)}, "
+                  f"gifted {stats.get('gifted', 0)}, received {stats.get('received', 0)}")
+
+    if not events:
+        await update.message.reply_text('Nothing recorded yet.')
+        return
+    lines = [header, ''] + [describe(event) for event in events]
+    await update.message.reply_text('\n'.join(lines), parse_mode='HTML')
+
+
+application.add_handler(CommandHandler("history", history, block=False))
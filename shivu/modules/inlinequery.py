@@ -1,90 +1,173 @@
-import re
-import time
+import asyncio
+from collections import Counter
 from html import escape
-from cachetools import TTLCache
-from pymongo import MongoClient, ASCENDING
 
 from telegram import Update, InlineQueryResultPhoto
-from telegram.ext import InlineQueryHandler, CallbackContext, CommandHandler 
+from telegram.ext import InlineQueryHandler, CallbackContext, CommandHandler
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from shivu import user_collection, collection, application, db
+from shivu import application, repository
+from shivu import inventory
+from shivu.caches import StatsLRUCache, StatsTTLCache
+from shivu.catalog import catalog, id_key, keyset_page
+from shivu.health import mongo_health, DatabaseUnavailable
+from shivu.images import image_scanner
+from shivu.thumbnails import thumbnails
 
+PAGE_SIZE = 50
 
-# collection
-db.characters.create_index([('id', ASCENDING)])
-db.characters.create_index([('anime', ASCENDING)])
-db.characters.create_index([('img_url', ASCENDING)])
+# Telegram-side cache lifetimes: the catalog is the same for everyone and
+# changes rarely, a collection changes on every catch.
+CATALOG_CACHE_TIME = 300
+COLLECTION_CACHE_TIME = 30
+# While Mongo is unavailable the counts are missing, so let Telegram ask again soon.
+DEGRADED_CACHE_TIME = 5
 
-# user_collection
-db.user_collection.create_index([('characters.id', ASCENDING)])
-db.user_collection.create_index([('characters.name', ASCENDING)])
-db.user_collection.create_index([('characters.img_url', ASCENDING)])
+# Rendered (results, next_offset) per page. Keys carry the catalog version or
+# the owner's inventory version, so edits and catches invalidate by key; the
+# TTL only bounds how stale the "Globally Guessed" counts get.
+results_cache = StatsTTLCache('inline_results', maxsize=5000, ttl=300)
 
-all_characters_cache = TTLCache(maxsize=10000, ttl=36000)
-user_collection_cache = TTLCache(maxsize=10000, ttl=60)
+# A user's collection deduplicated, ordered by id and counted, per inventory version.
+collection_views = StatsLRUCache('inline_collection_views', maxsize=2000)
 
-async def inlinequery(update: Update, context: CallbackContext) -> None:
-    query = update.inline_query.query
-    offset = int(update.inline_query.offset) if update.inline_query.offset else 0
+# The computation in flight for each user; a newer query from the same user cancels it.
+inflight = {}
+
+
+def normalize(text: str) -> str:
+    """Search terms as they are matched and cached: casefolded, whitespace collapsed."""
+    return ' '.join(text.casefold().split())
+
+
+def search_predicate(terms: str):
+    """``terms`` must already be ``normalize``d; the results cache is keyed by the same string."""
+    # Characters with a broken image are left out; one bad photo_url fails the whole answer.
+    broken = image_scanner.broken
+    if not terms:
+        return (lambda character: character['id'] not in broken) if broken else None
+    # A plain substring match: user text compiled as a regex could backtrack forever on the event loop.
+    return lambda character: character['id'] not in broken and (
+        terms in normalize(character['name']) or terms in normalize(character['anime']))
+
+
+async def collection_view(user_id: int):
+    key = (user_id, inventory.version(user_id))
+    view = collection_views.get(key)
+    if view is None:
+        user = await inventory.get_user(user_id)
+        if not user:
+            return None
+        unique = sorted({c['id']: c for c in user['characters']}.values(), key=lambda c: id_key(c['id']))
+        view = {
+            'user': user,
+            'characters': unique,
+            'keys': [id_key(c['id']) for c in unique],
+            'counts': Counter(c['id'] for c in user['characters']),
+            'anime_counts': Counter(c['anime'] for c in user['characters']),
+        }
+        collection_views[key] = view
+    return view
 
-    if query.startswith('collection.'):
-        user_id, *search_terms = query.split(' ')[0].split('.')[1], ' '.join(query.split(' ')[1:])
-        if user_id.isdigit():
-            if user_id in user_collection_cache:
-                user = user_collection_cache[user_id]
-            else:
-                user = await user_collection.find_one({'id': int(user_id)})
-                user_collection_cache[user_id] = user
-
-            if user:
-                all_characters = list({v['id']:v for v in user['characters']}.values())
-                if search_terms:
-                    regex = re.compile(' '.join(search_terms), re.IGNORECASE)
-                    all_characters = [character for character in all_characters if regex.search(character['name']) or regex.search(character['anime'])]
-            else:
-                all_characters = []
-        else:
-            all_characters = []
-    else:
-        if query:
-            regex = re.compile(query, re.IGNORECASE)
-            all_characters = list(await collection.find({"$or": [{"name": regex}, {"anime": regex}]}).to_list(length=None))
-        else:
-            if 'all_characters' in all_characters_cache:
-                all_characters = all_characters_cache['all_characters']
-            else:
-                all_characters = list(await collection.find({}).to_list(length=None))
-                all_characters_cache['all_characters'] = all_characters
-
-    characters = all_characters[offset:offset+50]
-    if len(characters) > 50:
-        characters = characters[:50]
-        next_offset = str(offset + 50)
-    else:
-        next_offset = str(offset + len(characters))
+
+async def collection_results(user_id: int, search_terms: str, after: str):
+    view = await collection_view(user_id)
+    if view is None:
+        return [], ''
+
+    user = view['user']
+    characters, next_offset = keyset_page(view['characters'], view['keys'], after, PAGE_SIZE, search_predicate(search_terms))
 
     results = []
     for character in characters:
-        global_count = await user_collection.count_documents({'characters.id': character['id']})
-        anime_characters = await collection.count_documents({'anime': character['anime']})
-
-        if query.startswith('collection.'):
-            user_character_count = sum(c['id'] == character['id'] for c in user['characters'])
-            user_anime_characters = sum(c['anime'] == character['anime'] for c in user['characters'])
-            caption = f"<b> Look At <a href='tg://user?id={user['id']}'>{(escape(user.get('first_name', user['id'])))}</a>'s Character</b>\n\n🌸: <b>{character['name']} (x{user_character_count})</b>\n🏖️: <b>{character['anime']} ({user_anime_characters}/{anime_characters})</b>\n<b>{character['rarity']}</b>\n\n<b>🆔️:</b> {character['id']}"
-        else:
-            caption = f"<b>Look At This Character !!</b>\n\n🌸:<b> {character['name']}</b>\n🏖️: <b>{character['anime']}</b>\n<b>{character['rarity']}</b>\n🆔️: <b>{character['id']}</b>\n\n<b>Globally Guessed {global_count} Times...</b>"
-        results.append(
-            InlineQueryResultPhoto(
-                thumbnail_url=character['img_url'],
-                id=f"{character['id']}_{time.time()}",
-                photo_url=character['img_url'],
-                caption=caption,
-                parse_mode='HTML'
-            )
-        )
-
-    await update.inline_query.answer(results, next_offset=next_offset, cache_time=5)
+        anime_characters = catalog.anime_counts[character['anime']]
+        user_character_count = view['counts'][character['id']]
+        user_anime_characters = view['anime_counts'][character['anime']]
+        caption = f"<b> Look At <a href='tg://user?id={user['id']}'>{(escape(user.get('first_name', user['id'])))}</a>'s Character</b>\n\n🌸: <b>{character['name']} (x{user_character_count})</b>\n🏖️: <b>{character['anime']} ({user_anime_characters}/{anime_characters})</b>\n<b>{character['rarity']}</b>\n\n<b>🆔️:</b> {character['id']}"
+        results.append(photo_result(character, caption))
+    return results, next_offset
+
+
+async def catalog_results(query: str, after: str):
+    await catalog.ensure_loaded()
+    characters, next_offset = catalog.page(after, PAGE_SIZE, search_predicate(query))
+
+    # One query for the whole page's "Globally Guessed" counts.
+    try:
+        owners = await repository.count_owners_many([character['id'] for character in characters]) if characters else {}
+    except DatabaseUnavailable:
+        owners = None
+
+    results = []
+    for character in characters:
+        global_count = '?' if owners is None else owners.get(character['id'], 0)
+        caption = f"<b>Look At This Character !!</b>\n\n🌸:<b> {character['name']}</b>\n🏖️: <b>{character['anime']}</b>\n<b>{character['rarity']}</b>\n🆔️: <b>{character['id']}</b>\n\n<b>Globally Guessed {global_count} Times...</b>"
+        results.append(photo_result(character, caption))
+    return results, next_offset
+
+
+def photo_result(character: dict, caption: str) -> InlineQueryResultPhoto:
+    # The character id is stable across pages and requests, so Telegram can
+    # reuse what it already has for this result.
+    return InlineQueryResultPhoto(
+        thumbnail_url=thumbnails.url(character) or character['img_url'],
+        id=character['id'],
+        photo_url=character['img_url'],
+        caption=caption,
+        parse_mode='HTML'
+    )
+
+
+async def build_answer(query: str, after: str):
+    """Return (results, next_offset, cache_time, is_personal) for an inline query.
+
+    ``after`` is the id of the last character on the previous page, which is
+    what ``next_offset`` carries, so deeper pages cost the same as the first.
+    """
+    if query.startswith('collection.'):
+        user_id, _, search_terms = query[len('collection.'):].partition(' ')
+        if not user_id.isdigit():
+            return [], '', COLLECTION_CACHE_TIME, True
+
+        search_terms = normalize(search_terms)
+        key = ('collection', int(user_id), search_terms, after, inventory.version(int(user_id)))
+        cached = results_cache.get(key)
+        if cached is None:
+            cached = await collection_results(int(user_id), search_terms, after)
+            results_cache[key] = cached
+        return (*cached, COLLECTION_CACHE_TIME, True)
+
+    query = normalize(query)
+    key = ('catalog', query, after, catalog.version)
+    cached = results_cache.get(key)
+    if cached is None:
+        cached = await catalog_results(query, after)
+        if mongo_health.degraded:
+            return (*cached, DEGRADED_CACHE_TIME, False)
+        results_cache[key] = cached
+    return (*cached, CATALOG_CACHE_TIME, False)
+
+
+async def inlinequery(update: Update, context: CallbackContext) -> None:
+    inline_query = update.inline_query
+    user_id = inline_query.from_user.id
+
+    previous = inflight.get(user_id)
+    if previous is not None:
+        previous.cancel()
+    task = asyncio.ensure_future(build_answer(inline_query.query, inline_query.offset))
+    inflight[user_id] = task
+    try:
+        results, next_offset, cache_time, is_personal = await task
+    except asyncio.CancelledError:
+        if task.cancelled():
+            # Superseded by a newer keystroke from the same user.
+            return
+        raise
+    finally:
+        if inflight.get(user_id) is task:
+            del inflight[user_id]
+
+    await inline_query.answer(results, next_offset=next_offset, cache_time=cache_time, is_personal=is_personal)
 
 application.add_handler(InlineQueryHandler(inlinequery, block=False))
@@ -5,23 +5,47 @@ import html
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 
-from shivu import (application, PHOTO_URL, OWNER_ID,
-                    user_collection, top_global_groups_collection, top_global_groups_collection, 
-                    group_user_totals_collection)
+from shivu import application, repository, PHOTO_URL, OWNER_ID
 
 from shivu import sudo_users as SUDO_USERS 
+from shivu.leaderboards import group_tops, top_groups, catch_buckets, WINDOWS
+
+WINDOW_TITLES = {'day': 'TODAY', 'week': 'THIS WEEK', 'month': 'THIS MONTH'}
+
+
+def window_of(context: CallbackContext):
+    """``day``/``week``/``month`` when the command asked for one, else None (all time)."""
+    if context.args and context.args[0].lower() in WINDOWS:
+        return context.args[0].lower()
+    return None
+
+
+async def windowed_users(scope: str, window: str) -> list:
+    rows = []
+    for user_id, name, count in await catch_buckets.top(scope, window):
+        username, first_name = name or (None, None)
+        row = {'user_id': int(user_id), 'count': count}
+        if username:
+            row['username'] = username
+        if first_name:
+            row['first_name'] = first_name
+        rows.append(row)
+    return rows
+
+
+async def windowed_groups(window: str) -> list:
+    return [{'group_id': int(group_id), 'group_name': name or 'Unknown', 'count': count}
+            for group_id, name, count in await catch_buckets.top('groups', window)]
 
     
 async def global_leaderboard(update: Update, context: CallbackContext) -> None:
-    
-    cursor = top_global_groups_collection.aggregate([
-        {"$project": {"group_name": 1, "count": 1}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
-
-    leaderboard_message = "<b>TOP 10 GROUPS WHO GUESSED MOST CHARACTERS</b>\n\n"
+    window = window_of(context)
+    if window:
+        leaderboard_data = await windowed_groups(window)
+        leaderboard_message = f"<b>TOP 10 GROUPS WHO GUESSED MOST CHARACTERS {WINDOW_TITLES[window]}</b>\n\n"
+    else:
+        leaderboard_data = await top_groups.top()
+        leaderboard_message = "<b>TOP 10 GROUPS WHO GUESSED MOST CHARACTERS</b>\n\n"
 
     for i, group in enumerate(leaderboard_data, start=1):
         group_name = html.escape(group.get('group_name', 'Unknown'))
@@ -39,15 +63,13 @@ async def global_leaderboard(update: Update, context: CallbackContext) -> None:
 async def ctop(update: Update, context: CallbackContext) -> None:
     chat_id = update.effective_chat.id
 
-    cursor = group_user_totals_collection.aggregate([
-        {"$match": {"group_id": chat_id}},
-        {"$project": {"username": 1, "first_name": 1, "character_count": "$count"}},
-        {"$sort": {"character_count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
-
-    leaderboard_message = "<b>TOP 10 USERS WHO GUESSED CHARACTERS MOST TIME IN THIS GROUP..</b>\n\n"
+    window = window_of(context)
+    if window:
+        leaderboard_data = await windowed_users(f'group:{chat_id}', window)
+        leaderboard_message = f"<b>TOP 10 USERS WHO GUESSED CHARACTERS MOST TIME IN THIS GROUP {WINDOW_TITLES[window]}..</b>\n\n"
+    else:
+        leaderboard_data = await group_tops.top(chat_id)
+        leaderboard_message = "<b>TOP 10 USERS WHO GUESSED CHARACTERS MOST TIME IN THIS GROUP..</b>\n\n"
 
     for i, user in enumerate(leaderboard_data, start=1):
         username = user.get('username', 'Unknown')
@@ -55,7 +77,7 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
         if len(first_name) > 10:
             first_name = first_name[:15] + '...'
-        character_count = user['character_count']
+        character_count = user['count']
         leaderboard_message += f'{i}. <a href="https://t.me/{username}"><b>{first_name}</b></a> ➾ <b>{character_count}</b>\n'
     
     photo_url = random.choice(PHOTO_URL)
@@ -64,15 +86,13 @@ async def ctop(update: Update, context: CallbackContext) -> None:
 
 
 async def leaderboard(update: Update, context: CallbackContext) -> None:
-    
-    cursor = user_collection.aggregate([
-        {"$project": {"username": 1, "first_name": 1, "character_count": {"$size": "$characters"}}},
-        {"$sort": {"character_count": -1}},
-        {"$limit": 10}
-    ])
-    leaderboard_data = await cursor.to_list(length=10)
-
-    leaderboard_message = "<b>TOP 10 USERS WITH MOST CHARACTERS</b>\n\n"
+    window = window_of(context)
+    if window:
+        leaderboard_data = [{**user, 'character_count': user['count']} for user in await windowed_users('users', window)]
+        leaderboard_message = f"<b>TOP 10 USERS WHO GUESSED MOST CHARACTERS {WINDOW_TITLES[window]}</b>\n\n"
+    else:
+        leaderboard_data = await repository.top_users_by_collection_size(10)
+        leaderboard_message = "<b>TOP 10 USERS WITH MOST CHARACTERS</b>\n\n"
 
     for i, user in enumerate(leaderboard_data, start=1):
         username = user.get('username', 'Unknown')
@@ -97,10 +117,10 @@ async def stats(update: Update, context: CallbackContext) -> None:
         return
 
     
-    user_count = await user_collection.count_documents({})
+    user_count = await repository.count_users()
 
 
-    group_count = await group_user_totals_collection.distinct('group_id')
+    group_count = await repository.member_group_ids()
 
 
     await update.message.reply_text(f'Total Users: {user_count}\nTotal groups: {len(group_count)}')
@@ -112,7 +132,7 @@ async def send_users_document(update: Update, context: CallbackContext) -> None:
     if str(update.effective_user.id) not in SUDO_USERS:
         update.message.reply_text('only For Sudo users...')
         return
-    cursor = user_collection.find({})
+    cursor = repository.user_first_names()
     users = []
     async for document in cursor:
         users.append(document)
@@ -129,7 +149,7 @@ async def send_groups_document(update: Update, context: CallbackContext) -> None
     if str(update.effective_user.id) not in SUDO_USERS:
         update.message.reply_text('Only For Sudo users...')
         return
-    cursor = top_global_groups_collection.find({})
+    cursor = repository.group_names()
     groups = []
     async for document in cursor:
         groups.append(document)
@@ -0,0 +1,268 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+from html import escape
+
+from telegram import Update
+from telegram.ext import CommandHandler, CallbackContext
+
+from shivu import application, repository, sudo_users, rate_limiter, bot_request, updates_request, LOGGER
+from shivu.caches import CACHES
+from shivu.catalog import catalog
+from shivu.events import event_log
+from shivu.health import mongo_health
+from shivu.images import image_scanner
+from shivu.tasktracker import task_started
+from shivu.thumbnails import thumbnails
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_PROFILE_SECONDS = 10
+TOP_FUNCTIONS = 40
+MAX_MEMSNAP_LINES = 50
+MAX_TASK_LINES = 50
+
+# Longest document a diagnostic may send, and how long its formatting may run.
+OUTPUT_LIMIT = 50000
+REPORT_TIMEOUT = 10
+
+profile_lock = asyncio.Lock()
+memsnap_baseline = None
+
+def is_sudo(update: Update) -> bool:
+    return str(update.effective_user.id) in sudo_users
+
+
+def cap(text: str) -> str:
+    if len(text) > OUTPUT_LIMIT:
+        return text[:OUTPUT_LIMIT] + f'\n... truncated, {len(text) - OUTPUT_LIMIT} more characters'
+    return text
+
+
+async def report(update: Update, build, filename: str) -> None:
+    """Run ``build`` off the loop under a timeout and send what it returns."""
+    try:
+        text = await asyncio.wait_for(asyncio.to_thread(build), REPORT_TIMEOUT)
+    except asyncio.TimeoutError:
+        await update.message.reply_text(f'Building the report took longer than {REPORT_TIMEOUT}s, gave up.')
+        return
+    if len(text) <= 3000:
+        await update.message.reply_text(f'<pre>{escape(text)}</pre>' if text else 'Nothing to report.', parse_mode='HTML')
+        return
+    await update.message.reply_document(document=io.BytesIO(cap(text).encode()), filename=filename)
+
+
+async def profile(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    try:
+        seconds = float(context.args[0]) if context.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text('Please use: /profile SECONDS')
+        return
+    seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+
+    if profile_lock.locked():
+        await update.message.reply_text('A profile is already running.')
+        return
+
+    async with profile_lock:
+        await update.message.reply_text(f'Profiling live traffic for {seconds:g}s...')
+        # cProfile hooks the whole thread, so everything the loop runs while
+        # this coroutine sleeps is captured.
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    def build():
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+    LOGGER.info("Profiled %.0fs for %s", seconds, update.effective_user.id)
+    await report(update, build, 'profile.txt')
+
+
+async def memsnap(update: Update, context: CallbackContext) -> None:
+    global memsnap_baseline
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    if context.args and context.args[0] == 'stop':
+        tracemalloc.stop()
+        memsnap_baseline = None
+        await update.message.reply_text('Memory tracing stopped.')
+        return
+
+    try:
+        limit = min(int(context.args[0]), MAX_MEMSNAP_LINES) if context.args else 20
+    except ValueError:
+        await update.message.reply_text('Please use: /memsnap [LINES] or /memsnap stop')
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        memsnap_baseline = tracemalloc.take_snapshot()
+        await update.message.reply_text('Memory tracing started. Run /memsnap again to see what grew since now, '
+                                        'and /memsnap stop when done; tracing slows the bot down.')
+        return
+
+    def build():
+        global memsnap_baseline
+        previous, snapshot = memsnap_baseline, tracemalloc.take_snapshot()
+        memsnap_baseline = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'Traced: {current / 2**20:.1f} MiB now, {peak / 2**20:.1f} MiB peak', '']
+        for stat in snapshot.compare_to(previous, 'lineno')[:limit]:
+            lines.append(str(stat))
+        return '\n'.join(lines)
+
+    await report(update, build, 'memsnap.txt')
+
+
+async def tasks(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    now = time.monotonic()
+    pending = [task for task in asyncio.all_tasks() if not task.done()]
+    rows = sorted(((now - task_started[task] if task in task_started else None,
+                    task.get_name(), getattr(task.get_coro(), '__qualname__', repr(task.get_coro())))
+                   for task in pending),
+                  key=lambda row: -1 if row[0] is None else row[0], reverse=True)
+
+    def build():
+        by_coro = Counter(row[2] for row in rows)
+        lines = [f'{len(rows)} pending tasks', '']
+        if not task_started:
+            lines += ['Ages are only known with TRACK_TASK_AGES set.', '']
+        lines += [f'{count:>6}  {name}' for name, count in by_coro.most_common(20)]
+        lines += ['', 'Oldest:']
+        for age, name, coro in rows[:MAX_TASK_LINES]:
+            lines.append(f"{'?' if age is None else f'{age:.1f}s':>10}  {name}  {coro}")
+        return '\n'.join(lines)
+
+    await report(update, build, 'tasks.txt')
+
+
+async def caches(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    lines = [f"{'cache':<28}{'size':>14}{'hits':>10}{'misses':>10}{'hit rate':>10}"]
+    for name, cache in sorted(CACHES.items()):
+        lines.append(f'{name:<28}{f"{len(cache)}/{cache.maxsize}":>14}{cache.hits:>10}{cache.misses:>10}'
+                     f'{cache.hit_rate:>10.1%}')
+    text = '\n'.join(lines)
+    await report(update, lambda: text, 'caches.txt')
+
+
+async def sendq(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    stats = rate_limiter.stats()
+    lines = [f"{'class':<14}{'queued':>8}{'sent':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name in stats['queued']:
+        lines.append(f"{name:<14}{stats['queued'][name]:>8}{stats['sent'][name]:>10}{stats['wait_p50_ms'][name]:>10}"
+                     f"{stats['wait_p99_ms'][name]:>10}{stats['wait_max_ms'][name]:>10}")
+    lines.append(f"\nflood waits {stats['flood_waits']}, retries {stats['retries']}, "
+                 f"chat buckets {stats['chat_buckets']}")
+    for name, request in (('bot api', bot_request), ('get_updates', updates_request)):
+        http = request.stats()
+        lines.append(f"{name}: HTTP/{http['http_version']}, {http['in_use']}/{http['pool_size']} connections in use "
+                     f"(peak {http['peak_in_use']}), pool wait p50 {http['pool_wait_p50_ms']} ms, "
+                     f"p99 {http['pool_wait_p99_ms']} ms, max {http['pool_wait_max_ms']} ms, "
+                     f"{http['pool_timeouts']} pool timeouts, {http['errors']} errors")
+    text = '\n'.join(lines)
+    await report(update, lambda: text, 'sendq.txt')
+
+
+async def events(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    if len(context.args) == 2 and context.args[0] == 'replay':
+        name = context.args[1]
+        if name not in event_log.consumers:
+            await update.message.reply_text(f"No consumer {name}, pick one of: {', '.join(event_log.consumers)}")
+            return
+        try:
+            read = await event_log.replay(name)
+        except ValueError as e:
+            await update.message.reply_text(str(e))
+            return
+        await update.message.reply_text(f'Replayed {read} events into {name}.')
+        return
+
+    stats = event_log.stats()
+    lines = [f"appended {stats['appended']}, written {stats['written']}, pending {stats['pending']}, "
+             f"dropped {stats['dropped']}\n",
+             f"{'consumer':<18}{'processed':>12}{'lag s':>10}  error"]
+    for name, consumer in stats['consumers'].items():
+        lines.append(f"{name:<18}{consumer['processed']:>12}{consumer['lag_s']:>10}  {consumer['error'] or '-'}")
+    text = '\n'.join(lines)
+    await report(update, lambda: text, 'events.txt')
+
+
+async def dbhealth(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    text = '\n'.join(f'{key:<22}{value}' for key, value in mongo_health.stats().items())
+    await report(update, lambda: text, 'dbhealth.txt')
+
+
+async def images(update: Update, context: CallbackContext) -> None:
+    if not is_sudo(update):
+        await update.message.reply_text("Nouu.. its Sudo user's Command..")
+        return
+
+    if context.args and context.args[0] == 'scan':
+        image_scanner.wakeup.set()
+        await update.message.reply_text('Image scan started; newly broken images will be reported here.')
+        return
+    if context.args:
+        check = await repository.get_image_check(context.args[0])
+        if not check:
+            await update.message.reply_text(f'{context.args[0]} has not been checked yet.')
+            return
+        text = '\n'.join(f'{key:<14}{value}' for key, value in check.items())
+        await report(update, lambda: text, 'image.txt')
+        return
+
+    stats = image_scanner.stats()
+    lines = [f"checked {stats['checked']}, quarantined {stats['quarantined']}, "
+             f"failing but not yet quarantined {stats['failing']}, scanned since start {stats['scanned']}, last pass {stats['last_pass']}",
+             f"thumbnails: {thumbnails.stats()}\n"]
+    for character_id, check in sorted(image_scanner.broken.items()):
+        character = catalog.get(character_id)
+        lines.append(f"{character_id:<8}{character['name'] if character else '?':<30}{check.get('problem')}")
+    text = '\n'.join(lines)
+    await report(update, lambda: text, 'images.txt')
+
+
+application.add_handler(CommandHandler("profile", profile, block=False))
+application.add_handler(CommandHandler("memsnap", memsnap, block=False))
+application.add_handler(CommandHandler("tasks", tasks, block=False))
+application.add_handler(CommandHandler("caches", caches, block=False))
+application.add_handler(CommandHandler("sendq", sendq, block=False))
+application.add_handler(CommandHandler("events", events, block=False))
+application.add_handler(CommandHandler("dbhealth", dbhealth, block=False))
+application.add_handler(CommandHandler("images", images, block=False))
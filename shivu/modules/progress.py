@@ -0,0 +1,101 @@
+from html import escape
+
+from telegram import Update
+from telegram.ext import CommandHandler, CallbackContext
+
+from shivu import application, inventory
+from shivu.caches import StatsLRUCache
+from shivu.catalog import catalog, id_key
+
+MAX_ANIME_LINES = 40
+MAX_MISSING_LINES = 40
+
+# (anime, owned, total) rows per user, keyed by inventory and catalog version.
+progress_cache = StatsLRUCache('progress', maxsize=2000)
+
+
+async def owned_ids(user_id: int):
+    user = await inventory.get_user(user_id)
+    if not user:
+        return None
+    return {c['id'] for c in user['characters']}
+
+
+async def progress_rows(user_id: int):
+    """Completion of every anime the user owns a character from, most complete first."""
+    key = (user_id, inventory.version(user_id), catalog.version)
+    rows = progress_cache.get(key)
+    if rows is not None:
+        return rows
+
+    owned = await owned_ids(user_id)
+    if owned is None:
+        return None
+    animes = {catalog.by_id[cid].anime for cid in owned if cid in catalog.by_id}
+    rows = []
+    for anime in animes:
+        ids = catalog.by_anime[anime]
+        rows.append((anime, len(ids & owned), len(ids)))
+    rows.sort(key=lambda row: (-row[1] / row[2], row[0]))
+    progress_cache[key] = rows
+    return rows
+
+
+def find_anime(query: str):
+    query = ' '.join(query.lower().split())
+    matches = []
+    for anime in catalog.by_anime:
+        name = anime.lower()
+        if name == query:
+            return anime
+        if query in name:
+            matches.append(anime)
+    return matches[0] if len(matches) == 1 else matches or None
+
+
+async def progress(update: Update, context: CallbackContext) -> None:
+    user_id = update.effective_user.id
+    await catalog.ensure_loaded()
+
+    if not context.args:
+        rows = await progress_rows(user_id)
+        if not rows:
+            await update.message.reply_text('You Have Not Guessed any Characters Yet..')
+            return
+        completed = sum(1 for _, have, total in rows if have == total)
+        message = f"<b>{escape(update.effective_user.first_name)}'s Progress</b>\n"
+        message += f"<b>{completed}/{len(rows)} anime completed</b>\n\n"
+        for anime, have, total in rows[:MAX_ANIME_LINES]:
+            mark = '✅' if have == total else f'{100 * have // total}%'
+            message += f'{escape(anime)} {have}/{total} {mark}\n'
+        if len(rows) > MAX_ANIME_LINES:
+            message += f'\n...and {len(rows) - MAX_ANIME_LINES} more. Use /progress ANIME to see one.'
+        await update.message.reply_text(message, parse_mode='HTML')
+        return
+
+    anime = find_anime(' '.join(context.args))
+    if anime is None:
+        await update.message.reply_text('No anime found with that name.')
+        return
+    if isinstance(anime, list):
+        names = '\n'.join(escape(a) for a in sorted(anime)[:20])
+        await update.message.reply_text(f'Which one?\n\n{names}', parse_mode='HTML')
+        return
+
+    owned = await owned_ids(user_id) or set()
+    ids = catalog.by_anime[anime]
+    missing = sorted(ids - owned, key=id_key)
+    message = f'<b>{escape(anime)} {len(ids) - len(missing)}/{len(ids)}</b>\n'
+    if not missing:
+        message += '\nCompleted ✅'
+    else:
+        message += '\n<b>Missing:</b>\n'
+        for cid in missing[:MAX_MISSING_LINES]:
+            character = catalog.get(cid)
+            message += f'{cid} {escape(character.name)} {character.rarity}\n'
+        if len(missing) > MAX_MISSING_LINES:
+            message += f'...and {len(missing) - MAX_MISSING_LINES} more'
+    await update.message.reply_text(message, parse_mode='HTML')
+
+
+application.add_handler(CommandHandler('progress', progress, block=False))
@@ -1,12 +1,27 @@
+from bson import ObjectId
 from pyrogram import filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from shivu import user_collection, shivuu
+from shivu import shivuu
+from shivu import inventory, repository
+from shivu.events import event_log, TRADE, GIFT
+from shivu.health import mongo_health, replies_when_degraded, DatabaseUnavailable
 
 pending_trades = {}
 
 
+async def _settle_trade(trade_id, sender_id, receiver_id, receiver_character_id, sender_character, event: dict) -> None:
+    """Finish a trade whose swap timed out: keep it if both halves landed, undo the sender's if only that did."""
+    if await repository.made_trade(receiver_id, trade_id):
+        inventory.changed(sender_id, receiver_id)
+        event_log.append(TRADE, sender_id, **event)
+    elif await repository.made_trade(sender_id, trade_id):
+        await repository.swap_character(sender_id, receiver_character_id, sender_character)
+        inventory.changed(sender_id)
+
+
 @shivuu.on_message(filters.command("trade"))
+@replies_when_degraded
 async def trade(client, message):
     sender_id = message.from_user.id
 
@@ -26,11 +41,8 @@ async def trade(client, message):
 
     sender_character_id, receiver_character_id = message.command[1], message.command[2]
 
-    sender = await user_collection.find_one({'id': sender_id})
-    receiver = await user_collection.find_one({'id': receiver_id})
-
-    sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-    receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
+    sender_character = await repository.owned_character(sender_id, sender_character_id)
+    receiver_character = await repository.owned_character(receiver_id, receiver_character_id)
 
     if not sender_character:
         await message.reply_text("You don't have the character you're trying to trade!")
@@ -66,7 +78,8 @@ async def trade(client, message):
 
 
 @shivuu.on_callback_query(filters.create(lambda _, __, query: query.data in ["confirm_trade", "cancel_trade"]))
-async def on_callback_query(client, callback_query):
+@replies_when_degraded
+async def trade_callback(client, callback_query):
     receiver_id = callback_query.from_user.id
 
     
@@ -79,31 +92,36 @@ async def on_callback_query(client, callback_query):
 
     if callback_query.data == "confirm_trade":
         
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        sender_character = next((character for character in sender['characters'] if character['id'] == sender_character_id), None)
-        receiver_character = next((character for character in receiver['characters'] if character['id'] == receiver_character_id), None)
-
-        
-        
-        sender['characters'].remove(sender_character)
-        receiver['characters'].remove(receiver_character)
+        sender_character = await repository.owned_character(sender_id, sender_character_id)
+        receiver_character = await repository.owned_character(receiver_id, receiver_character_id)
+
+        event = {'characters': [sender_character_id, receiver_character_id], 'to_user_id': receiver_id,
+                 'first_name': callback_query.message.reply_to_message.from_user.first_name,
+                 'to_first_name': callback_query.from_user.first_name}
+        # Each side swaps one copy in place instead of rewriting its whole collection. Both
+        # swaps record the trade id, so a timed-out one can be checked once Mongo is back.
+        trade_id = ObjectId()
+        try:
+            swapped = bool(sender_character and receiver_character
+                           and await repository.swap_character(sender_id, sender_character_id, receiver_character, trade_id))
+            received = swapped and await repository.swap_character(receiver_id, receiver_character_id,
+                                                                   sender_character, trade_id)
+        except DatabaseUnavailable:
+            mongo_health.defer(_settle_trade, trade_id, sender_id, receiver_id, receiver_character_id,
+                               sender_character, event)
+            del pending_trades[(sender_id, receiver_id)]
+            raise
+        if swapped and not received:
+            # The receiver lost their copy meanwhile; give the sender theirs back.
+            await repository.swap_character(sender_id, receiver_character_id, sender_character)
+            swapped = False
 
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
-
-        
-        sender['characters'].append(receiver_character)
-        receiver['characters'].append(sender_character)
-
-        
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-        await user_collection.update_one({'id': receiver_id}, {'$set': {'characters': receiver['characters']}})
-
-        
         del pending_trades[(sender_id, receiver_id)]
+        if not swapped:
+            await callback_query.message.edit_text("❌️ Trade failed, one of the characters is no longer owned.")
+            return
+        inventory.changed(sender_id, receiver_id)
+        event_log.append(TRADE, sender_id, **event)
 
         await callback_query.message.edit_text(f"You have successfully traded your character with {callback_query.message.reply_to_message.from_user.mention}!")
 
@@ -120,6 +138,7 @@ pending_gifts = {}
 
 
 @shivuu.on_message(filters.command("gift"))
+@replies_when_degraded
 async def gift(client, message):
     sender_id = message.from_user.id
 
@@ -141,9 +160,7 @@ async def gift(client, message):
 
     character_id = message.command[1]
 
-    sender = await user_collection.find_one({'id': sender_id})
-
-    character = next((character for character in sender['characters'] if character['id'] == character_id), None)
+    character = await repository.owned_character(sender_id, character_id)
 
     if not character:
         await message.reply_text("You don't have this character in your collection!")
@@ -167,7 +184,8 @@ async def gift(client, message):
     await message.reply_text(f"do You Really Wanns To Gift {message.reply_to_message.from_user.mention} ?", reply_markup=keyboard)
 
 @shivuu.on_callback_query(filters.create(lambda _, __, query: query.data in ["confirm_gift", "cancel_gift"]))
-async def on_callback_query(client, callback_query):
+@replies_when_degraded
+async def gift_callback(client, callback_query):
     sender_id = callback_query.from_user.id
 
     
@@ -180,24 +198,15 @@ async def on_callback_query(client, callback_query):
 
     if callback_query.data == "confirm_gift":
         
-        sender = await user_collection.find_one({'id': sender_id})
-        receiver = await user_collection.find_one({'id': receiver_id})
-
-        
-        sender['characters'].remove(gift['character'])
-        await user_collection.update_one({'id': sender_id}, {'$set': {'characters': sender['characters']}})
-
-        
-        if receiver:
-            await user_collection.update_one({'id': receiver_id}, {'$push': {'characters': gift['character']}})
-        else:
-            
-            await user_collection.insert_one({
-                'id': receiver_id,
-                'username': gift['receiver_username'],
-                'first_name': gift['receiver_first_name'],
-                'characters': [gift['character']],
-            })
+        if not await repository.take_character(sender_id, gift['character']['id']):
+            del pending_gifts[(sender_id, receiver_id)]
+            await callback_query.message.edit_text("❌️ Gift failed, you no longer have this character.")
+            return
+        # Deferred rather than lost if Mongo fails now that the sender's copy is gone.
+        await inventory.add_character(receiver_id, gift['character'], gift['receiver_username'], gift['receiver_first_name'])
+        inventory.changed(sender_id)
+        event_log.append(GIFT, sender_id, [gift['character']['id']], to_user_id=receiver_id,
+                         first_name=callback_query.from_user.first_name, to_first_name=gift['receiver_first_name'])
 
         
         del pending_gifts[(sender_id, receiver_id)]
@@ -1,10 +1,14 @@
-import urllib.request
-from pymongo import ReturnDocument
+import asyncio
 
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 
-from shivu import application, sudo_users, collection, db, CHARA_CHANNEL_ID, SUPPORT_CHAT
+from shivu import application, repository, sudo_users, CHARA_CHANNEL_ID, SUPPORT_CHAT
+from shivu.catalog import catalog, next_revision
+from shivu.events import event_log, DELETE
+from shivu.images import image_scanner
+from shivu.propagation import propagator
+from shivu.reconcile import Reconciler, format_report
 
 WRONG_FORMAT_TEXT = """Wrong ❌️ format...  eg. /upload Img_url muzan-kibutsuji Demon-slayer 3
 
@@ -14,19 +18,16 @@ use rarity number accordingly rarity Map
 
 rarity_map = 1 (⚪️ Common), 2 (🟣 Rare) , 3 (🟡 Legendary), 4 (🟢 Medium)"""
 
+reconcile_lock = asyncio.Lock()
+
 
 
 async def get_next_sequence_number(sequence_name):
-    sequence_collection = db.sequences
-    sequence_document = await sequence_collection.find_one_and_update(
-        {'_id': sequence_name}, 
-        {'$inc': {'sequence_value': 1}}, 
-        return_document=ReturnDocument.AFTER
-    )
-    if not sequence_document:
-        await sequence_collection.insert_one({'_id': sequence_name, 'sequence_value': 0})
+    sequence_value = await repository.next_sequence_value(sequence_name)
+    if sequence_value is None:
+        await repository.insert_sequence(sequence_name, 0)
         return 0
-    return sequence_document['sequence_value']
+    return sequence_value
 
 async def upload(update: Update, context: CallbackContext) -> None:
     if str(update.effective_user.id) not in sudo_users:
@@ -42,10 +43,9 @@ async def upload(update: Update, context: CallbackContext) -> None:
         character_name = args[1].replace('-', ' ').title()
         anime = args[2].replace('-', ' ').title()
 
-        try:
-            urllib.request.urlopen(args[0])
-        except:
-            await update.message.reply_text('Invalid URL.')
+        check = await image_scanner.check({'img_url': args[0]})
+        if not check['ok']:
+            await update.message.reply_text(f"Invalid URL: {check['problem']}.")
             return
 
         rarity_map = {1: "⚪ Common", 2: "🟣 Rare", 3: "🟡 Legendary", 4: "🟢 Medium"}
@@ -64,6 +64,7 @@ async def upload(update: Update, context: CallbackContext) -> None:
             'rarity': rarity,
             'id': id
         }
+        character['revision'] = await next_revision()
 
         try:
             message = await context.bot.send_photo(
@@ -73,10 +74,12 @@ async def upload(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML'
             )
             character['message_id'] = message.message_id
-            await collection.insert_one(character)
+            await repository.insert_character(character)
+            catalog.add(character)
             await update.message.reply_text('CHARACTER ADDED....')
         except:
-            await collection.insert_one(character)
+            await repository.insert_character(character)
+            catalog.add(character)
             update.effective_message.reply_text("Character Added but no Database Channel Found, Consider adding one.")
         
     except Exception as e:
@@ -94,14 +97,19 @@ async def delete(update: Update, context: CallbackContext) -> None:
             return
 
         
-        character = await collection.find_one_and_delete({'id': args[0]})
-
-        if character:
-            
-            await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
-            await update.message.reply_text('DONE')
-        else:
+        character = await repository.delete_character(args[0])
+        if not character:
+            # Nothing was deleted, so there is nothing to propagate to owners either.
             await update.message.reply_text('Deleted Successfully from db, but character not found In Channel')
+            return
+
+        await next_revision()
+        catalog.remove(args[0])
+        await propagator.enqueue(args[0], chat_id=update.effective_chat.id)
+        event_log.append(DELETE, update.effective_user.id, [args[0]], first_name=update.effective_user.first_name)
+
+        await context.bot.delete_message(chat_id=CHARA_CHANNEL_ID, message_id=character['message_id'])
+        await update.message.reply_text('DONE')
     except Exception as e:
         await update.message.reply_text(f'{str(e)}')
 
@@ -117,7 +125,7 @@ async def update(update: Update, context: CallbackContext) -> None:
             return
 
         # Get character by ID
-        character = await collection.find_one({'id': args[0]})
+        character = await repository.get_character(args[0])
         if not character:
             await update.message.reply_text('Character not found.')
             return
@@ -141,7 +149,15 @@ async def update(update: Update, context: CallbackContext) -> None:
         else:
             new_value = args[2]
 
-        await collection.find_one_and_update({'id': args[0]}, {'$set': {args[1]: new_value}})
+        if args[1] == 'img_url':
+            check = await image_scanner.check({'img_url': new_value})
+            if not check['ok']:
+                await update.message.reply_text(f"Invalid URL: {check['problem']}.")
+                return
+
+        await repository.set_character_fields(args[0], {args[1]: new_value, 'revision': await next_revision()})
+        catalog.update(args[0], {args[1]: new_value})
+        await propagator.enqueue(args[0], {args[1]: new_value}, chat_id=update.effective_chat.id)
 
         
         if args[1] == 'img_url':
@@ -153,7 +169,10 @@ async def update(update: Update, context: CallbackContext) -> None:
                 parse_mode='HTML'
             )
             character['message_id'] = message.message_id
-            await collection.find_one_and_update({'id': args[0]}, {'$set': {'message_id': message.message_id}})
+            await repository.set_character_fields(args[0], {'message_id': message.message_id, 'revision': await next_revision()})
+            catalog.update(args[0], {'message_id': message.message_id})
+            # Records the new image and lifts a quarantine the old one caused.
+            await image_scanner.check_now(catalog.get(args[0]))
         else:
             
             await context.bot.edit_message_caption(
@@ -167,9 +186,29 @@ async def update(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         await update.message.reply_text(f'I guess did not added bot in channel.. or character uploaded Long time ago.. Or character not exits.. orr Wrong id')
 
+async def reconcile(update: Update, context: CallbackContext) -> None:
+    if str(update.effective_user.id) not in sudo_users:
+        await update.message.reply_text('Ask my Owner to use this Command...')
+        return
+    if reconcile_lock.locked():
+        await update.message.reply_text('A reconciliation is already running...')
+        return
+
+    fix = bool(context.args) and context.args[0] == 'fix'
+    async with reconcile_lock:
+        await update.message.reply_text(f"Reconciling{' and repairing' if fix else ' (dry run, add fix to repair)'}...")
+        try:
+            report = await Reconciler(fix=fix).run()
+        except Exception as e:
+            await update.message.reply_text(f'Reconciliation failed: {e}')
+            return
+    await update.message.reply_text(format_report(report))
+
 UPLOAD_HANDLER = CommandHandler('upload', upload, block=False)
 application.add_handler(UPLOAD_HANDLER)
 DELETE_HANDLER = CommandHandler('delete', delete, block=False)
 application.add_handler(DELETE_HANDLER)
 UPDATE_HANDLER = CommandHandler('update', update, block=False)
 application.add_handler(UPDATE_HANDLER)
+RECONCILE_HANDLER = CommandHandler('reconcile', reconcile, block=False)
+application.add_handler(RECONCILE_HANDLER)
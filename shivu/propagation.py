@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from shivu import application, repository, inventory, PROPAGATION_BATCH_SIZE, PROPAGATION_DUTY_CYCLE, LOGGER
+from shivu.ratelimit import BULK
+
+# Seconds between progress edits of the message the sudo user was sent.
+REPORT_INTERVAL = 10
+# Seconds before a job that failed is tried again.
+RETRY_DELAY = 30
+
+
+def describe(job: dict) -> str:
+    action = 'Deleting' if job['fields'] is None else f"Updating {', '.join(job['fields'])} of"
+    state = 'done ✅' if job['done'] else 'in progress'
+    return (f"{action} character {job['character_id']} in users' collections: "
+            f"{job['processed']}/{job['total']} owners, {state}")
+
+
+class Propagator:
+    """Copies ``/update`` and ``/delete`` into the characters users already own.
+
+    Each edit queues a job in ``propagation_jobs``. One worker runs the jobs
+    in order: it pages through the owners by ``_id`` on the
+    ``(characters.id, _id)`` index, applies each page as one ``bulk_write``
+    and checkpoints the last ``_id`` in the job, so a restart resumes where
+    it stopped. After each batch it sleeps so that writing takes at most
+    ``duty`` of its time; batches slow down when Mongo is busy with catches,
+    and the pauses grow with them.
+    """
+
+    def __init__(self, batch_size, duty):
+        self.batch_size = batch_size
+        self.duty = duty
+        self.wakeup = asyncio.Event()
+        self.current = None
+        self._task = None
+
+    async def enqueue(self, character_id: str, fields=None, chat_id=None) -> dict:
+        """Queue copying ``fields`` to every owned copy, or removing the copies if None.
+
+        Progress is reported to ``chat_id`` when given.
+        """
+        job = {'character_id': character_id, 'fields': fields, 'after': None, 'processed': 0,
+               'total': await repository.count_owners(character_id), 'done': False,
+               'chat_id': chat_id, 'message_id': None, 'created_at': time.time()}
+        if chat_id is not None:
+            try:
+                message = await application.bot.send_message(chat_id, describe(job), rate_limit_args=BULK)
+                job['message_id'] = message.message_id
+            except Exception as e:
+                LOGGER.warning("Could not report propagation of %s: %s", character_id, e)
+        job['_id'] = await repository.insert_propagation_job(job)
+        self.wakeup.set()
+        return job
+
+    async def report(self, job: dict) -> None:
+        if job.get('message_id') is None:
+            return
+        try:
+            await application.bot.edit_message_text(describe(job), job['chat_id'], job['message_id'],
+                                                   rate_limit_args=BULK)
+        except Exception as e:
+            LOGGER.warning("Could not report propagation of %s: %s", job['character_id'], e)
+
+    async def run_job(self, job: dict) -> None:
+        character_id, fields = job['character_id'], job['fields']
+        reported = time.monotonic()
+        while True:
+            start = time.perf_counter()
+            owners = await repository.owners_after(character_id, job['after'], self.batch_size)
+            if not owners:
+                break
+            oids = [owner['_id'] for owner in owners]
+            if fields is None:
+                await repository.remove_owned_copies(oids, character_id)
+            else:
+                await repository.update_owned_copies(oids, character_id, fields)
+            inventory.changed(*(owner['id'] for owner in owners if 'id' in owner))
+            job['after'] = oids[-1]
+            job['processed'] += len(oids)
+            await repository.checkpoint_propagation_job(job['_id'], {'after': job['after'],
+                                                                     'processed': job['processed']})
+            if time.monotonic() - reported >= REPORT_INTERVAL:
+                await self.report(job)
+                reported = time.monotonic()
+            await asyncio.sleep((time.perf_counter() - start) * (1 - self.duty) / self.duty)
+
+        job['done'] = True
+        job['total'] = max(job['total'], job['processed'])
+        await repository.checkpoint_propagation_job(job['_id'], {'done': True, 'finished_at': time.time()})
+        await self.report(job)
+        LOGGER.info("Propagated %s of character %s to %d owners",
+                    'delete' if fields is None else ', '.join(fields), character_id, job['processed'])
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            try:
+                jobs = await repository.pending_propagation_jobs()
+                for job in jobs:
+                    self.current = job
+                    await self.run_job(job)
+            except Exception as e:
+                LOGGER.warning("Propagation failed, retrying in %ds: %s", RETRY_DELAY, e)
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            finally:
+                self.current = None
+            if not jobs:
+                await self.wakeup.wait()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+propagator = Propagator(PROPAGATION_BATCH_SIZE, PROPAGATION_DUTY_CYCLE)
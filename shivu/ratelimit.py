@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+LOGGER = logging.getLogger(__name__)
+
+# Priority classes, passed as ``rate_limit_args`` to bot methods. Replies to
+# users are the default; spawns come next and broadcasts or reports last.
+INTERACTIVE, SPAWN, BULK = range(3)
+PRIORITY_NAMES = ('interactive', 'spawn', 'bulk')
+
+# Share of the global bucket bulk requests leave untouched, so a reply that
+# arrives during a broadcast still finds a token.
+BULK_HEADROOM = 0.2
+# Waiting requests looked at per priority on each pass; the rest wait their turn.
+SCAN_LIMIT = 1000
+# Idle chat buckets are dropped once there are this many.
+MAX_BUCKETS = 20000
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float, keep: float = 0.0) -> float:
+        """Seconds until a token can be taken while leaving ``keep`` behind."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        missing = 1 + keep - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        return self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+class PriorityMetrics:
+    __slots__ = ('sent', 'waited', 'max_wait', 'recent')
+
+    def __init__(self):
+        self.sent = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self.recent = deque(maxlen=1000)
+
+    def record(self, wait: float) -> None:
+        self.sent += 1
+        self.waited += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent.append(wait)
+
+    def percentile(self, pct: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Schedules every Bot API call that targets a chat.
+
+    Calls wait in one queue per priority class and are released by a single
+    dispatcher task when both the global bucket (``overall_per_second``) and
+    the chat's bucket (``group_per_minute`` for groups, ``private_per_second``
+    for users) have a token. Higher classes are served first, but a call held
+    back by its own chat's bucket doesn't block calls to other chats. A
+    ``RetryAfter`` empties the chat's bucket (or the global one for calls
+    without a chat) for the time Telegram asked, and the call is queued again
+    up to ``max_retries`` times.
+    """
+
+    def __init__(self, overall_per_second=30, group_per_minute=20, private_per_second=1, max_retries=3):
+        self.overall_rate = overall_per_second
+        # A bucket lets through its capacity plus a minute of refill in any
+        # minute, so split the group limit between the two.
+        self.group_capacity = max(1, group_per_minute // 4)
+        self.group_rate = (group_per_minute - self.group_capacity) / 60
+        self.private_rate = private_per_second
+        self.max_retries = max_retries
+        self.overall = TokenBucket(overall_per_second, overall_per_second, time.monotonic())
+        self.buckets = {}
+        self.queues = tuple(deque() for _ in PRIORITY_NAMES)
+        self.metrics = tuple(PriorityMetrics() for _ in PRIORITY_NAMES)
+        self.flood_waits = 0
+        self.retries = 0
+        self.wakeup = asyncio.Event()
+        self._task = None
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in self.queues:
+            while queue:
+                queue.popleft()[1].cancel()
+
+    def _bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self.buckets = {k: b for k, b in self.buckets.items() if not b.idle(now)}
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_capacity, now)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_rate, now)
+            self.buckets[chat_id] = bucket
+        return bucket
+
+    def _grant(self, now: float):
+        """Release every call that may go now; return seconds until the next one may, or None."""
+        soonest = None
+        for priority, queue in enumerate(self.queues):
+            keep = self.overall_rate * BULK_HEADROOM if priority == BULK else 0.0
+            index = 0
+            while index < len(queue) and index < SCAN_LIMIT:
+                chat_id, future, queued_at = queue[index]
+                if future.done():
+                    del queue[index]
+                    continue
+                wait = self.overall.wait_time(now, keep)
+                if wait > 0:
+                    # Lower classes can't get a global token either.
+                    return wait if soonest is None else min(soonest, wait)
+                bucket = self._bucket(chat_id, now)
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    index += 1
+                    continue
+                bucket.take()
+                self.overall.take()
+                del queue[index]
+                self.metrics[priority].record(now - queued_at)
+                future.set_result(None)
+        return soonest
+
+    async def _dispatch(self) -> None:
+        while True:
+            self.wakeup.clear()
+            delay = self._grant(time.monotonic())
+            if delay is None:
+                await self.wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _acquire(self, priority: int, chat_id) -> None:
+        if self._task is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].append((chat_id, future, time.monotonic()))
+        self.wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args in (INTERACTIVE, SPAWN, BULK) else INTERACTIVE
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str):
+            try:
+                chat_id = int(chat_id)
+            except ValueError:
+                pass
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(priority, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.flood_waits += 1
+                until = time.monotonic() + e.retry_after
+                if chat_id is not None:
+                    self._bucket(chat_id, time.monotonic()).block(until)
+                else:
+                    self.overall.block(until)
+                if attempt == self.max_retries:
+                    LOGGER.warning("%s to %s still flood limited after %d retries", endpoint, chat_id, attempt)
+                    raise
+                self.retries += 1
+                LOGGER.info("%s to %s flood limited, retrying in %ss", endpoint, chat_id, e.retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+
+    def stats(self) -> dict:
+        return {
+            'queued': {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self.queues)},
+            'sent': {name: m.sent for name, m in zip(PRIORITY_NAMES, self.metrics)},
+            'wait_p50_ms': {name: round(m.percentile(50) * 1000, 1) for name, m in zip(PRIORITY_NAMES, self.metrics)},
+            'wait_p99_ms': {name: round(m.percentile(99) * 1000, 1) for name, m in zip(PRIORITY_NAMES, self.metrics)},
+            'wait_max_ms': {name: round(m.max_wait * 1000, 1) for name, m in zip(PRIORITY_NAMES, self.metrics)},
+            'flood_waits': self.flood_waits,
+            'retries': self.retries,
+            'chat_buckets': len(self.buckets),
+        }
@@ -0,0 +1,167 @@
+"""Find and repair aggregates that drifted from the data they summarize.
+
+    python -m shivu.reconcile            # dry run: report what would change
+    python -m shivu.reconcile --fix      # apply the repairs
+
+Two passes, each streaming in pages of ``--batch-size`` so memory stays
+bounded on any number of users:
+
+* users: every user document, projected to character ids and favorites, in
+  ``_id`` order. Copies of characters no longer in the catalog (a /delete
+  whose propagation never finished) and favorites the user no longer owns
+  (left behind by trades and gifts) are pulled. Ids missing from the
+  in-memory catalog are looked up in the characters collection first, one
+  query per page, and only pulled if it doesn't have them either.
+* groups: every ``group_user_totals`` row in ``(group_id, user_id)`` index
+  order, summed per group and compared with ``top_global_groups``, which a
+  crash between the two writes of a catch leaves off by one.
+
+How many catches a user made in a group is only known from those rows (and
+from the event log since it exists), so member rows themselves are never
+changed. Repairs to group counts are increments by the difference found,
+so catches landing meanwhile are not overwritten. The groups pass holds the
+event consumer that writes both collections, so leaderboards pause and then
+catch up from the log. Outside the bot process nothing holds it: run
+``--fix`` from the command line while the bot is stopped, or use
+``/reconcile fix``.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from shivu import repository, inventory, LOGGER
+from shivu.catalog import catalog
+from shivu.events import event_log
+from shivu.leaderboards import top_groups
+
+BATCH_SIZE = 1000
+# Differences kept in the report as examples; the counts cover all of them.
+SAMPLES = 10
+
+
+class Reconciler:
+
+    def __init__(self, batch_size: int = BATCH_SIZE, fix: bool = False):
+        self.batch_size = batch_size
+        self.fix = fix
+        self.report = {'fix': fix, 'users': 0, 'orphaned_copies': 0, 'stale_favorites': 0, 'users_repaired': 0,
+                       'group_rows': 0, 'groups': 0, 'groups_off': 0, 'group_count_delta': 0, 'samples': []}
+
+    def sample(self, text: str) -> None:
+        if len(self.report['samples']) < SAMPLES:
+            self.report['samples'].append(text)
+
+    async def users(self) -> None:
+        await catalog.ensure_loaded()
+        if not len(catalog):
+            raise RuntimeError("the catalog is empty, refusing to treat every owned character as deleted")
+        known = catalog.by_id
+
+        page = await repository.users_after(None, self.batch_size)
+        while page:
+            # Read the next page while this one is checked and repaired.
+            following = asyncio.ensure_future(repository.users_after(page[-1]['_id'], self.batch_size))
+            repairs, changed = {}, []
+            owned_by = [{c['id'] for c in user.get('characters', ()) if c and 'id' in c} for user in page]
+            # The in-memory catalog may be behind the collection (an old snapshot, a sync that
+            # failed); only ids the collection doesn't have either are treated as deleted.
+            unknown = {cid for owned in owned_by for cid in owned if cid not in known}
+            deleted = unknown - await repository.existing_character_ids(list(unknown)) if unknown else set()
+            for user, owned in zip(page, owned_by):
+                orphaned = owned & deleted
+                stale = {cid for cid in user.get('favorites') or () if cid not in owned or cid in orphaned}
+                if orphaned or stale:
+                    repairs[user['_id']] = (orphaned, stale)
+                    changed.append(user.get('id'))
+                    self.report['orphaned_copies'] += len(orphaned)
+                    self.report['stale_favorites'] += len(stale)
+                    self.sample(f"user {user.get('id')}: deleted {sorted(orphaned)}, stale favorites {sorted(stale)}")
+            self.report['users'] += len(page)
+            if repairs and self.fix:
+                await repository.repair_users(repairs)
+                inventory.changed(*(user_id for user_id in changed if user_id is not None))
+                self.report['users_repaired'] += len(repairs)
+            page = await following
+
+    async def groups(self) -> None:
+        # Hold the consumer that writes both sides so no batch lands half way through.
+        async with event_log.consumers['group_totals'].lock:
+            await self.sum_groups()
+
+    async def sum_groups(self) -> None:
+        sums = {}
+        async for row in repository.group_member_counts():
+            self.report['group_rows'] += 1
+            group_id = row['group_id']
+            if group_id not in sums and len(sums) >= self.batch_size:
+                await self.compare_groups(sums)
+                sums = {}
+            sums[group_id] = sums.get(group_id, 0) + row.get('count', 0)
+        if sums:
+            await self.compare_groups(sums)
+
+    async def compare_groups(self, sums: dict) -> None:
+        stored = await repository.group_counts(list(sums))
+        deltas = {}
+        for group_id, total in sums.items():
+            delta = total - stored.get(group_id, 0)
+            if delta:
+                deltas[group_id] = delta
+                self.sample(f"group {group_id}: members caught {total}, group count {stored.get(group_id)}")
+        self.report['groups'] += len(sums)
+        self.report['groups_off'] += len(deltas)
+        self.report['group_count_delta'] += sum(abs(delta) for delta in deltas.values())
+        if deltas and self.fix:
+            # Through bumped, which drops the cached top when a count in it shrank.
+            for row in await repository.adjust_group_counts(deltas):
+                top_groups.bumped(None, row)
+
+    async def run(self) -> dict:
+        start = time.perf_counter()
+        await self.users()
+        users_done = time.perf_counter()
+        await self.groups()
+        end = time.perf_counter()
+        self.report.update({
+            'users_s': round(users_done - start, 2),
+            'users_per_sec': round(self.report['users'] / (users_done - start), 1) if users_done > start else 0,
+            'groups_s': round(end - users_done, 2),
+            'group_rows_per_sec': round(self.report['group_rows'] / (end - users_done), 1) if end > users_done else 0,
+        })
+        LOGGER.info("Reconciliation %s: %s", 'fixed' if self.fix else 'dry run',
+                    {k: v for k, v in self.report.items() if k != 'samples'})
+        return self.report
+
+
+def format_report(report: dict) -> str:
+    verb = 'Repaired' if report['fix'] else 'Would repair'
+    lines = [
+        f"{verb} {report['orphaned_copies']} copies of deleted characters and {report['stale_favorites']} "
+        f"stale favorites in {report['users']} users ({report['users_s']}s, {report['users_per_sec']}/s)",
+        f"{verb} {report['groups_off']} of {report['groups']} group counts, off by {report['group_count_delta']} in total "
+        f"({report['group_rows']} member rows, {report['groups_s']}s, {report['group_rows_per_sec']}/s)",
+    ]
+    if report['samples']:
+        lines += [''] + report['samples']
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m shivu.reconcile', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fix', action='store_true', help='apply the repairs instead of only reporting them')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    from shivu import shivuu
+    report = shivuu.loop.run_until_complete(Reconciler(args.batch_size, args.fix).run())
+    print(json.dumps(report) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import json
+import queue
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from shivu import LOGGER
+
+# Updates waiting for the writer thread; past this they are dropped and counted.
+QUEUE_SIZE = 10000
+
+# The recorder main() installs when RECORD_UPDATES is set, closed in post_shutdown.
+active = None
+
+
+class UpdateRecorder:
+    """Appends every incoming update to a JSONL file for offline replay.
+
+    Each line is ``{"ts": <unix time>, "update": <Bot API update dict>}``, the
+    format ``python -m benchmarks.replay`` reads back. Like the log handlers,
+    the handler only queues the update; a writer thread serializes and writes
+    it, so the event loop never waits on the disk. ``close`` writes whatever is
+    still queued.
+    """
+
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self.recorded = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._file = open(path, 'a', encoding='utf-8', buffering=1 << 16)
+        self._thread = threading.Thread(target=self.write, name='update-recorder', daemon=True)
+        self._thread.start()
+        LOGGER.info("Recording updates to %s", path)
+
+    async def __call__(self, update: Update, context: CallbackContext) -> None:
+        try:
+            self.queue.put_nowait((time.time(), update.to_dict()))
+        except queue.Full:
+            self.dropped += 1
+
+    def write(self) -> None:
+        unflushed = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            ts, update = item
+            self._file.write(json.dumps({'ts': ts, 'update': update}, ensure_ascii=False))
+            self._file.write('\n')
+            self.recorded += 1
+            unflushed += 1
+            # Flush every flush_every updates, and whenever the queue runs dry.
+            if unflushed >= self.flush_every or self.queue.empty():
+                self._file.flush()
+                unflushed = 0
+        self._file.flush()
+
+    def close(self) -> None:
+        """Write the queued updates and close the file; blocks until done."""
+        if self._file.closed:
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self.dropped:
+            LOGGER.warning("Update recorder dropped %d updates while the disk was behind", self.dropped)
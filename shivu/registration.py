@@ -0,0 +1,97 @@
+import asyncio
+from html import escape
+
+from shivu import application, repository, GROUP_ID, PM_SEEN_CACHE_SIZE, NEW_USER_DIGEST_INTERVAL, LOGGER
+from shivu.caches import StatsLRUCache
+from shivu.ratelimit import BULK
+
+# Users named in one digest message; the rest are only counted.
+DIGEST_NAMES = 50
+# New users held for the digest while GROUP_ID can't be reached; older ones are only counted.
+MAX_PENDING = 10000
+
+
+class Registrations:
+    """Records who started the bot in ``pm_users`` and tells ``GROUP_ID`` about newcomers.
+
+    A start is one upsert that also reports whether the user is new. Users
+    seen recently with the same names are remembered in an LRU of
+    ``cache_size`` entries and don't reach Mongo at all. New users are
+    collected and announced in one digest message every ``interval``
+    seconds instead of one message each.
+    """
+
+    def __init__(self, cache_size, interval):
+        self.seen = StatsLRUCache('pm_users_seen', maxsize=cache_size)
+        self.interval = interval
+        self.pending = []
+        self.overflow = 0
+        self.registered = 0
+        self.new_users = 0
+        self.digests = 0
+        self._task = None
+
+    async def register(self, user) -> bool:
+        """Record ``user`` (a Telegram user); return whether they started the bot for the first time."""
+        names = (user.first_name, user.username)
+        if self.seen.get(user.id) == names:
+            return False
+        new = await repository.register_pm_user(user.id, user.first_name, user.username)
+        self.seen[user.id] = names
+        self.registered += 1
+        if new:
+            self.new_users += 1
+            if len(self.pending) < MAX_PENDING:
+                self.pending.append((user.id, user.first_name))
+            else:
+                self.overflow += 1
+        return new
+
+    def digest(self, users: list, overflow: int) -> str:
+        total = len(users) + overflow
+        lines = [f"{total} new user{'s' if total != 1 else ''} started the bot.."]
+        lines += [f"<a href='tg://user?id={user_id}'>{escape(first_name or str(user_id))}</a>"
+                  for user_id, first_name in users[:DIGEST_NAMES]]
+        if total > DIGEST_NAMES:
+            lines.append(f'... and {total - DIGEST_NAMES} more')
+        return '\n'.join(lines)
+
+    async def flush(self) -> None:
+        if not self.pending and not self.overflow:
+            return
+        users, overflow = self.pending, self.overflow
+        self.pending, self.overflow = [], 0
+        try:
+            await application.bot.send_message(GROUP_ID, self.digest(users, overflow), parse_mode='HTML',
+                                               rate_limit_args=BULK)
+            self.digests += 1
+        except Exception as e:
+            LOGGER.warning("Could not send the new users digest, keeping %d for the next: %s", len(users), e)
+            self.pending = users[:MAX_PENDING] + self.pending
+            self.overflow += overflow + max(0, len(users) - MAX_PENDING)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {'registered': self.registered, 'new_users': self.new_users, 'pending': len(self.pending),
+                'digests': self.digests, 'seen_hit_rate': round(self.seen.hit_rate, 3)}
+
+
+registrations = Registrations(PM_SEEN_CACHE_SIZE, NEW_USER_DIGEST_INTERVAL)
@@ -0,0 +1,540 @@
+"""Every query the bot makes, one named function each.
+
+Handlers ask for what they need (a name, one owned character, a count)
+instead of whole documents, and ownership checks match inside the array on
+the server. ``QUERIES`` maps each name to its function and the fields its
+filter leads with, so ``benchmarks.queries`` can time every query and check
+that an index covers it. Every query also runs under ``mongo_health``: a
+per-call timeout and the circuit breaker that turns an unreachable Mongo
+into ``DatabaseUnavailable``.
+"""
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+from shivu import (collection, user_collection, user_totals_collection, group_user_totals_collection,
+                   top_global_groups_collection, pm_users, catch_buckets_collection, propagation_jobs_collection,
+                   events_collection, event_checkpoints_collection, character_stats_collection,
+                   user_stats_collection, image_checks_collection, db, MONGO_SCAN_TIMEOUT)
+from shivu.health import mongo_health
+
+QUERIES = {}
+
+
+def query(name, target, keys=(), timeout=None):
+    def register(fn):
+        guarded = mongo_health.guard(name, fn, timeout)
+        guarded.query_name = name
+        QUERIES[name] = (guarded, target, tuple(keys))
+        return guarded
+    return register
+
+
+def _count_once(counts: dict, fields: dict = None) -> list:
+    """A pipeline update adding to each counter only the events the row hasn't counted yet.
+
+    ``counts`` maps counter fields to the ids of the events counted into
+    them, one id per increment. Rows remember the newest event applied as
+    ``last_event``, and consumers apply events in ``_id`` order, so a batch
+    retried after its checkpoint was lost adds nothing twice. ``fields`` are
+    set as they are.
+    """
+    newest = max(event_id for event_ids in counts.values() for event_id in event_ids)
+    increments = {field: {'$add': [{'$ifNull': [f'${field}', 0]}, {'$size': {'$filter': {
+        'input': event_ids, 'as': 'event', 'cond': {'$gt': ['$$event', '$last_event']}}}}]}
+        for field, event_ids in counts.items()}
+    return [{'$set': {**(fields or {}), **increments}},
+            {'$set': {'last_event': {'$max': ['$last_event', newest]}}}]
+
+
+# -- characters (anime_characters_lol) ---------------------------------------
+
+@query('characters.all', collection, timeout=MONGO_SCAN_TIMEOUT)
+async def all_characters():
+    return await collection.find({}, {'_id': 0}).to_list(length=None)
+
+
+@query('characters.changed_since', collection, ['revision'], timeout=MONGO_SCAN_TIMEOUT)
+async def characters_changed_since(revision: int):
+    return await collection.find({'revision': {'$gt': revision}}, {'_id': 0}).to_list(length=None)
+
+
+@query('characters.count', collection)
+async def count_characters(estimated: bool = False) -> int:
+    if estimated:
+        return await collection.estimated_document_count()
+    return await collection.count_documents({})
+
+
+@query('characters.get', collection, ['id'])
+async def get_character(character_id: str):
+    return await collection.find_one({'id': character_id}, {'_id': 0})
+
+
+@query('characters.existing', collection, ['id'])
+async def existing_character_ids(character_ids: list) -> set:
+    """Which of ``character_ids`` are in the catalog collection."""
+    return set(await collection.distinct('id', {'id': {'$in': character_ids}}))
+
+
+@query('characters.insert', collection)
+async def insert_character(character: dict) -> None:
+    await collection.insert_one(character)
+
+
+@query('characters.delete', collection, ['id'])
+async def delete_character(character_id: str):
+    return await collection.find_one_and_delete({'id': character_id}, {'_id': 0})
+
+
+@query('characters.set_fields', collection, ['id'])
+async def set_character_fields(character_id: str, fields: dict) -> None:
+    await collection.update_one({'id': character_id}, {'$set': fields})
+
+
+# -- sequences ---------------------------------------------------------------
+
+@query('sequences.get', db.sequences, ['_id'])
+async def sequence_value(name: str) -> int:
+    doc = await db.sequences.find_one({'_id': name}, {'sequence_value': 1})
+    return doc['sequence_value'] if doc else 0
+
+
+@query('sequences.next', db.sequences, ['_id'])
+async def next_sequence_value(name: str, upsert: bool = False):
+    """Increment and return sequence ``name``; None if it doesn't exist and ``upsert`` is off."""
+    doc = await db.sequences.find_one_and_update(
+        {'_id': name}, {'$inc': {'sequence_value': 1}},
+        projection={'sequence_value': 1}, upsert=upsert, return_document=ReturnDocument.AFTER)
+    return doc['sequence_value'] if doc else None
+
+
+@query('sequences.insert', db.sequences)
+async def insert_sequence(name: str, value: int) -> None:
+    await db.sequences.insert_one({'_id': name, 'sequence_value': value})
+
+
+# -- users (user_collection_lmaoooo) -----------------------------------------
+
+@query('users.get', user_collection, ['id'])
+async def get_user(user_id: int):
+    return await user_collection.find_one({'id': user_id})
+
+
+@query('users.owned_character', user_collection, ['id'])
+async def owned_character(user_id: int, character_id: str):
+    """The user's copy of ``character_id``, or None if they don't own it."""
+    doc = await user_collection.find_one(
+        {'id': user_id, 'characters.id': character_id},
+        {'_id': 0, 'characters': {'$elemMatch': {'id': character_id}}})
+    return doc['characters'][0] if doc and doc.get('characters') else None
+
+
+@query('users.add_character', user_collection, ['id'])
+async def add_character(user_id: int, character: dict, username, first_name) -> None:
+    """Give ``character`` to the user, creating them if needed and refreshing their names."""
+    await user_collection.update_one(
+        {'id': user_id},
+        {'$set': {'username': username, 'first_name': first_name}, '$push': {'characters': character}},
+        upsert=True)
+
+
+@query('users.swap_character', user_collection, ['id', 'characters.id'])
+async def swap_character(user_id: int, character_id: str, replacement: dict, trade=None) -> bool:
+    """Replace one copy of ``character_id`` with ``replacement``; False if it isn't owned.
+
+    A ``trade`` id is stored as the user's ``last_trade`` in the same write,
+    so ``made_trade`` can tell afterwards whether a timed-out swap happened.
+    """
+    fields = {'characters.$': replacement}
+    if trade is not None:
+        fields['last_trade'] = trade
+    result = await user_collection.update_one({'id': user_id, 'characters.id': character_id}, {'$set': fields})
+    return result.matched_count > 0
+
+
+@query('users.made_trade', user_collection, ['id'])
+async def made_trade(user_id: int, trade) -> bool:
+    return await user_collection.find_one({'id': user_id, 'last_trade': trade}, {'_id': 1}) is not None
+
+
+@query('users.take_character', user_collection, ['id', 'characters.id'])
+async def take_character(user_id: int, character_id: str) -> bool:
+    """Remove one copy of ``character_id``; False if it isn't owned."""
+    # One pipeline update cutting the first copy out of the array, so no reader ever sees a gap.
+    # $map keeps positions even for entries without an id, which '$characters.id' would skip.
+    index = {'$indexOfArray': [{'$map': {'input': '$characters', 'in': '$$this.id'}}, character_id]}
+    result = await user_collection.update_one(
+        {'id': user_id, 'characters.id': character_id},
+        [{'$set': {'characters': {'$concatArrays': [
+            {'$slice': ['$characters', index]},
+            {'$slice': ['$characters', {'$add': [index, 1]}, {'$size': '$characters'}]},
+        ]}}}])
+    return result.matched_count > 0
+
+
+@query('users.owners_after', user_collection, ['characters.id', '_id'])
+async def owners_after(character_id: str, after, size: int) -> list:
+    """Up to ``size`` owners of ``character_id`` (``_id`` and ``id``) past ``_id`` ``after``, in order."""
+    filter = {'characters.id': character_id}
+    if after is not None:
+        filter['_id'] = {'$gt': after}
+    cursor = user_collection.find(filter, {'_id': 1, 'id': 1}).sort('_id', ASCENDING).limit(size)
+    return await cursor.to_list(length=size)
+
+
+@query('users.update_owned_copies', user_collection, ['_id'])
+async def update_owned_copies(user_oids: list, character_id: str, fields: dict) -> None:
+    """Set ``fields`` on every copy of ``character_id`` the given users own."""
+    update = {'$set': {f'characters.$[c].{field}': value for field, value in fields.items()}}
+    await user_collection.bulk_write(
+        [UpdateOne({'_id': oid}, update, array_filters=[{'c.id': character_id}]) for oid in user_oids],
+        ordered=False)
+
+
+@query('users.remove_owned_copies', user_collection, ['_id'])
+async def remove_owned_copies(user_oids: list, character_id: str) -> None:
+    update = {'$pull': {'characters': {'id': character_id}, 'favorites': character_id}}
+    await user_collection.bulk_write([UpdateOne({'_id': oid}, update) for oid in user_oids], ordered=False)
+
+
+@query('users.page', user_collection, ['_id'])
+async def users_after(after, size: int) -> list:
+    """The next ``size`` users past ``_id`` ``after``: their ids, owned character ids and favorites."""
+    cursor = user_collection.find({'_id': {'$gt': after}} if after is not None else {},
+                                  {'_id': 1, 'id': 1, 'characters.id': 1, 'favorites': 1})
+    return await cursor.sort('_id', ASCENDING).limit(size).to_list(length=size)
+
+
+@query('users.repair', user_collection, ['_id'])
+async def repair_users(repairs: dict) -> None:
+    """``repairs`` maps user ``_id`` to the character ids to drop and the favorites to drop."""
+    requests = []
+    for oid, (character_ids, favorites) in repairs.items():
+        pull = {'favorites': {'$in': list(character_ids | favorites)}}
+        if character_ids:
+            pull['characters'] = {'id': {'$in': list(character_ids)}}
+        requests.append(UpdateOne({'_id': oid}, {'$pull': pull}))
+    await user_collection.bulk_write(requests, ordered=False)
+
+
+@query('users.set_favorites', user_collection, ['id'])
+async def set_favorites(user_id: int, character_ids: list) -> None:
+    await user_collection.update_one({'id': user_id}, {'$set': {'favorites': character_ids}})
+
+
+@query('users.count', user_collection, timeout=MONGO_SCAN_TIMEOUT)
+async def count_users() -> int:
+    return await user_collection.count_documents({})
+
+
+@query('users.count_owners', user_collection, ['characters.id'])
+async def count_owners(character_id: str) -> int:
+    return await user_collection.count_documents({'characters.id': character_id})
+
+
+@query('users.count_owners_many', user_collection, ['characters.id'])
+async def count_owners_many(character_ids: list) -> dict:
+    """``count_owners`` for each of ``character_ids`` in one query; ids nobody owns are left out."""
+    cursor = user_collection.aggregate([
+        {'$match': {'characters.id': {'$in': character_ids}}},
+        {'$project': {'_id': 0, 'owned': {'$setIntersection': ['$characters.id', character_ids]}}},
+        {'$unwind': '$owned'},
+        {'$group': {'_id': '$owned', 'count': {'$sum': 1}}},
+    ])
+    return {row['_id']: row['count'] async for row in cursor}
+
+
+@query('users.first_names', user_collection)
+def user_first_names():
+    return user_collection.find({}, {'_id': 0, 'first_name': 1})
+
+
+@query('users.top_by_collection_size', user_collection, timeout=MONGO_SCAN_TIMEOUT)
+async def top_users_by_collection_size(size: int = 10) -> list:
+    cursor = user_collection.aggregate([
+        {"$project": {"username": 1, "first_name": 1, "character_count": {"$size": "$characters"}}},
+        {"$sort": {"character_count": -1}},
+        {"$limit": size}
+    ])
+    return await cursor.to_list(length=size)
+
+
+# -- chat settings (user_totals_lmaoooo) -------------------------------------
+
+@query('chat_settings.all', user_totals_collection)
+def all_chat_settings(fields: dict):
+    return user_totals_collection.find({}, fields)
+
+
+@query('chat_settings.get', user_totals_collection, ['chat_id'])
+async def get_chat_settings(chat_id: str, fields: dict):
+    return await user_totals_collection.find_one({'chat_id': chat_id}, fields)
+
+
+@query('chat_settings.set', user_totals_collection, ['chat_id'])
+async def set_chat_setting(chat_id: str, field: str, value) -> None:
+    """Store one setting for the chat; None removes it."""
+    update = {'$set': {field: value}} if value is not None else {'$unset': {field: ''}}
+    await user_totals_collection.update_one({'chat_id': chat_id}, update, upsert=True)
+
+
+# -- group members (group_user_totalsssssss) ---------------------------------
+
+@query('group_members.caught', group_user_totals_collection, ['group_id', 'user_id'])
+async def group_members_caught(members: dict) -> list:
+    """Count catches into member rows and return the rows.
+
+    ``members`` maps ``(group_id, user_id)`` to ``(event_ids, username, first_name)``.
+    One bulk write for all of them, then one read for the counts they ended at.
+    """
+    await group_user_totals_collection.bulk_write(
+        [UpdateOne({'user_id': user_id, 'group_id': group_id},
+                   _count_once({'count': event_ids}, {'username': username, 'first_name': first_name}), upsert=True)
+         for (group_id, user_id), (event_ids, username, first_name) in members.items()], ordered=False)
+    cursor = group_user_totals_collection.find(
+        {'group_id': {'$in': list({group_id for group_id, _ in members})},
+         'user_id': {'$in': list({user_id for _, user_id in members})}},
+        {'_id': 0, 'group_id': 1, 'user_id': 1, 'username': 1, 'first_name': 1, 'count': 1})
+    return [row async for row in cursor if (row['group_id'], row['user_id']) in members]
+
+
+@query('group_members.top', group_user_totals_collection, ['group_id', 'count'])
+async def group_top(group_id: int, size: int) -> list:
+    cursor = group_user_totals_collection.find(
+        {'group_id': group_id}, {'_id': 0, 'user_id': 1, 'username': 1, 'first_name': 1, 'count': 1}
+    ).sort('count', DESCENDING).limit(size)
+    return await cursor.to_list(length=size)
+
+
+@query('group_members.counts', group_user_totals_collection, ['group_id', 'user_id'])
+def group_member_counts():
+    """Every member row's group and count, grouped by group."""
+    return group_user_totals_collection.find({}, {'_id': 0, 'group_id': 1, 'count': 1}).sort(
+        [('group_id', ASCENDING), ('user_id', ASCENDING)])
+
+
+@query('group_members.group_ids', group_user_totals_collection, ['group_id'], timeout=MONGO_SCAN_TIMEOUT)
+async def member_group_ids() -> list:
+    return await group_user_totals_collection.distinct('group_id')
+
+
+# -- groups (top_global_groups) ----------------------------------------------
+
+@query('groups.caught', top_global_groups_collection, ['group_id'])
+async def groups_caught(groups: dict) -> list:
+    """Count catches into group rows and return the rows; ``groups`` maps group ids to ``(event_ids, group_name)``."""
+    await top_global_groups_collection.bulk_write(
+        [UpdateOne({'group_id': group_id}, _count_once({'count': event_ids}, {'group_name': group_name}), upsert=True)
+         for group_id, (event_ids, group_name) in groups.items()], ordered=False)
+    cursor = top_global_groups_collection.find({'group_id': {'$in': list(groups)}},
+                                               {'_id': 0, 'group_id': 1, 'group_name': 1, 'count': 1})
+    return await cursor.to_list(length=None)
+
+
+@query('groups.top', top_global_groups_collection, ['count'])
+async def top_groups(size: int) -> list:
+    cursor = top_global_groups_collection.find(
+        {}, {'_id': 0, 'group_id': 1, 'group_name': 1, 'count': 1}
+    ).sort('count', DESCENDING).limit(size)
+    return await cursor.to_list(length=size)
+
+
+@query('groups.counts', top_global_groups_collection, ['group_id'])
+async def group_counts(group_ids: list) -> dict:
+    cursor = top_global_groups_collection.find({'group_id': {'$in': group_ids}}, {'_id': 0, 'group_id': 1, 'count': 1})
+    return {group['group_id']: group.get('count', 0) async for group in cursor}
+
+
+@query('groups.adjust_counts', top_global_groups_collection, ['group_id'])
+async def adjust_group_counts(deltas: dict) -> list:
+    """Add each delta to its group's count, creating missing groups, and return the rows."""
+    await top_global_groups_collection.bulk_write(
+        [UpdateOne({'group_id': group_id}, {'$inc': {'count': delta}}, upsert=True)
+         for group_id, delta in deltas.items()], ordered=False)
+    cursor = top_global_groups_collection.find({'group_id': {'$in': list(deltas)}},
+                                               {'_id': 0, 'group_id': 1, 'group_name': 1, 'count': 1})
+    return await cursor.to_list(length=None)
+
+
+@query('groups.names', top_global_groups_collection)
+def group_names():
+    return top_global_groups_collection.find({}, {'_id': 0, 'group_name': 1})
+
+
+@query('groups.ids', top_global_groups_collection, ['group_id'], timeout=MONGO_SCAN_TIMEOUT)
+async def group_ids() -> list:
+    return await top_global_groups_collection.distinct('group_id')
+
+
+# -- bot users (total_pm_users) ----------------------------------------------
+
+@query('pm_users.register', pm_users, ['_id'])
+async def register_pm_user(user_id: int, first_name, username) -> bool:
+    """Insert or rename the user in one round trip; True if they weren't there before."""
+    result = await pm_users.update_one({'_id': user_id}, {'$set': {'first_name': first_name, 'username': username}},
+                                       upsert=True)
+    return result.upserted_id is not None
+
+
+@query('pm_users.ids', pm_users, ['_id'], timeout=MONGO_SCAN_TIMEOUT)
+async def pm_user_ids() -> list:
+    return await pm_users.distinct('_id')
+
+
+# -- catch buckets -----------------------------------------------------------
+
+@query('catch_buckets.record', catch_buckets_collection, ['scope', 'day', 'id'])
+async def record_catch_buckets(rows: dict) -> None:
+    """``rows`` maps ``(scope, day, id)`` to ``(event_ids, name, expires_at)``."""
+    await catch_buckets_collection.bulk_write(
+        [UpdateOne({'scope': scope, 'day': day, 'id': ident},
+                   _count_once({'count': event_ids}, {'name': name, 'expires_at': expires_at}), upsert=True)
+         for (scope, day, ident), (event_ids, name, expires_at) in rows.items()], ordered=False)
+
+
+@query('catch_buckets.window', catch_buckets_collection, ['scope', 'day', 'count'])
+async def catch_buckets_window(scope: str, days: list, size: int) -> list:
+    """The ``size`` ids with the most catches over ``days``, with the newest name seen for each."""
+    cursor = catch_buckets_collection.aggregate([
+        {'$match': {'scope': scope, 'day': {'$in': days}}},
+        {'$sort': {'day': ASCENDING}},
+        {'$group': {'_id': '$id', 'name': {'$last': '$name'}, 'count': {'$sum': '$count'}}},
+        {'$sort': {'count': DESCENDING}},
+        {'$limit': size},
+    ])
+    return await cursor.to_list(length=size)
+
+
+# -- propagation jobs --------------------------------------------------------
+
+@query('propagation_jobs.insert', propagation_jobs_collection)
+async def insert_propagation_job(job: dict):
+    return (await propagation_jobs_collection.insert_one(job)).inserted_id
+
+
+@query('propagation_jobs.pending', propagation_jobs_collection, ['done', '_id'])
+async def pending_propagation_jobs() -> list:
+    return await propagation_jobs_collection.find({'done': False}).sort('_id', ASCENDING).to_list(length=None)
+
+
+@query('propagation_jobs.checkpoint', propagation_jobs_collection, ['_id'])
+async def checkpoint_propagation_job(job_id, fields: dict) -> None:
+    await propagation_jobs_collection.update_one({'_id': job_id}, {'$set': fields})
+
+
+# -- events ------------------------------------------------------------------
+
+@query('events.insert', events_collection)
+async def insert_events(events: list) -> None:
+    # Ordered, so a reader following ``_id`` never sees a later event before an earlier one.
+    await events_collection.insert_many(events, ordered=True)
+
+
+@query('events.after', events_collection, ['_id'])
+async def events_after(after, size: int) -> list:
+    """The next ``size`` events after the ``_id`` ``after`` (None for the start of the log)."""
+    cursor = events_collection.find({'_id': {'$gt': after}} if after is not None else {})
+    return await cursor.sort('_id', ASCENDING).limit(size).to_list(length=size)
+
+
+@query('events.of_user', events_collection, ['users', '_id'])
+async def user_events(user_id: int, size: int) -> list:
+    cursor = events_collection.find({'users': user_id}).sort('_id', DESCENDING).limit(size)
+    return await cursor.to_list(length=size)
+
+
+@query('events.of_character', events_collection, ['characters', '_id'])
+async def character_events(character_id: str, size: int) -> list:
+    cursor = events_collection.find({'characters': character_id}).sort('_id', DESCENDING).limit(size)
+    return await cursor.to_list(length=size)
+
+
+@query('event_checkpoints.get', event_checkpoints_collection, ['_id'])
+async def get_event_checkpoint(name: str):
+    return await event_checkpoints_collection.find_one({'_id': name})
+
+
+@query('event_checkpoints.set', event_checkpoints_collection, ['_id'])
+async def set_event_checkpoint(name: str, fields: dict) -> None:
+    await event_checkpoints_collection.update_one({'_id': name}, {'$set': fields}, upsert=True)
+
+
+# -- character stats ---------------------------------------------------------
+
+@query('character_stats.add', character_stats_collection, ['_id'])
+async def add_character_stats(counts: dict) -> None:
+    """``counts`` maps character ids to counters and the events counted into them, e.g. ``{'caught': [id, id]}``."""
+    await character_stats_collection.bulk_write(
+        [UpdateOne({'_id': character_id}, _count_once(fields), upsert=True) for character_id, fields in counts.items()],
+        ordered=False)
+
+
+@query('character_stats.get', character_stats_collection, ['_id'])
+async def get_character_stats(character_id: str):
+    return await character_stats_collection.find_one({'_id': character_id})
+
+
+@query('character_stats.delete', character_stats_collection, ['_id'])
+async def delete_character_stats(character_id: str) -> None:
+    await character_stats_collection.delete_one({'_id': character_id})
+
+
+@query('character_stats.clear', character_stats_collection, timeout=MONGO_SCAN_TIMEOUT)
+async def clear_character_stats() -> None:
+    await character_stats_collection.delete_many({})
+
+
+# -- user stats --------------------------------------------------------------
+
+@query('user_stats.add', user_stats_collection, ['_id'])
+async def add_user_stats(counts: dict) -> None:
+    """``counts`` maps user ids to counters and the events counted into them, like ``add_character_stats``."""
+    await user_stats_collection.bulk_write(
+        [UpdateOne({'_id': user_id}, _count_once(fields), upsert=True) for user_id, fields in counts.items()],
+        ordered=False)
+
+
+@query('user_stats.get', user_stats_collection, ['_id'])
+async def get_user_stats(user_id: int):
+    return await user_stats_collection.find_one({'_id': user_id})
+
+
+@query('user_stats.clear', user_stats_collection, timeout=MONGO_SCAN_TIMEOUT)
+async def clear_user_stats() -> None:
+    await user_stats_collection.delete_many({})
+
+
+# -- image checks ------------------------------------------------------------
+
+@query('image_checks.record', image_checks_collection, ['_id'])
+async def record_image_checks(results: dict) -> None:
+    """``results`` maps character ids to the outcome of checking their image."""
+    await image_checks_collection.bulk_write(
+        [UpdateOne({'_id': character_id}, {'$set': result}, upsert=True) for character_id, result in results.items()],
+        ordered=False)
+
+
+@query('image_checks.due', image_checks_collection, ['next_check_at'])
+async def images_due(now: float, size: int) -> list:
+    cursor = image_checks_collection.find({'next_check_at': {'$lte': now}}, {'_id': 1, 'url': 1})
+    return await cursor.sort('next_check_at', ASCENDING).limit(size).to_list(length=size)
+
+
+@query('image_checks.broken', image_checks_collection, ['quarantined'])
+async def broken_images() -> list:
+    return await image_checks_collection.find({'quarantined': True}).to_list(length=None)
+
+
+@query('image_checks.ids', image_checks_collection, timeout=MONGO_SCAN_TIMEOUT)
+async def image_check_ids() -> list:
+    return await image_checks_collection.distinct('_id')
+
+
+@query('image_checks.get', image_checks_collection, ['_id'])
+async def get_image_check(character_id: str):
+    return await image_checks_collection.find_one({'_id': character_id})
+
+
+@query('image_checks.delete', image_checks_collection, ['_id'])
+async def delete_image_checks(character_ids: list) -> None:
+    await image_checks_collection.delete_many({'_id': {'$in': character_ids}})
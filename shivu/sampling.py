@@ -0,0 +1,127 @@
+import random
+
+from shivu import RARITY_WEIGHTS
+from shivu.caches import StatsLRUCache
+from shivu.catalog import catalog
+
+
+class AliasTable:
+    """Walker's alias method: O(n) to build, O(1) per weighted draw."""
+
+    def __init__(self, items, weights):
+        n = len(items)
+        total = float(sum(weights))
+        if not n or total <= 0:
+            raise ValueError("AliasTable needs at least one positive weight")
+        self.items = list(items)
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random):
+        i = int(rng.random() * len(self.items))
+        return self.items[i] if rng.random() < self.prob[i] else self.items[self.alias[i]]
+
+
+class RaritySampler:
+    """Picks spawn characters with per-rarity weights and a per-chat no-repeat cycle.
+
+    A draw is two O(1) steps: an alias table picks the rarity, with tier
+    weight = rarity weight x spawnable characters of that rarity (so each
+    character's chance is proportional to its rarity's weight), then a
+    character is swap-removed from the chat's remaining pool for that rarity.
+    A pool is refilled once the chat has seen every character of that rarity,
+    so common characters cycle quickly and legendary ones slowly.
+
+    Quarantined characters are left out of both the tier weights and the
+    pools, and a tier with nothing spawnable is left out of the table, so a
+    drawn tier always has a character to give. Alias tables are cached per
+    weight set, catalog version and quarantine version, so catalog edits and
+    quarantines only cost a rebuild on the next draw.
+    """
+
+    def __init__(self, catalog, default_weights, rng=None):
+        self.catalog = catalog
+        self.default_weights = dict(default_weights)
+        self.random = rng or random.Random()
+        self.tables = StatsLRUCache('spawn_alias_tables', maxsize=256)
+        # chat_id -> {rarity: ids not yet spawned in this cycle}; an evicted
+        # chat simply starts a fresh cycle.
+        self.cycles = StatsLRUCache('spawn_cycles', maxsize=20000)
+        # Ids never spawned, such as characters whose image is broken; change
+        # it through quarantine/release so cached tables are rebuilt.
+        self.quarantined = set()
+        self.quarantine_version = 0
+
+    def quarantine(self, character_id: str) -> None:
+        if character_id not in self.quarantined:
+            self.quarantined.add(character_id)
+            self.quarantine_version += 1
+
+    def release(self, character_id: str) -> None:
+        if character_id in self.quarantined:
+            self.quarantined.discard(character_id)
+            self.quarantine_version += 1
+
+    def spawnable(self, rarity) -> list:
+        return [character_id for character_id in self.catalog.by_rarity.get(rarity, ())
+                if character_id not in self.quarantined]
+
+    def weights_for(self, overrides=None) -> dict:
+        if not overrides:
+            return self.default_weights
+        return {**self.default_weights, **overrides}
+
+    def table(self, weights: dict):
+        key = (tuple(sorted(weights.items())), self.catalog.version, self.quarantine_version)
+        table = self.tables.get(key)
+        if table is None:
+            tiers = [(rarity, weights.get(rarity, 1) * len(self.spawnable(rarity)))
+                     for rarity in self.catalog.by_rarity if weights.get(rarity, 1) > 0]
+            tiers = [(rarity, weight) for rarity, weight in tiers if weight > 0]
+            if not tiers:
+                return None
+            table = AliasTable([r for r, _ in tiers], [w for _, w in tiers])
+            self.tables[key] = table
+        return table
+
+    def pick(self, chat_id, overrides=None):
+        table = self.table(self.weights_for(overrides))
+        if table is None:
+            return None
+        cycle = self.cycles.get(chat_id)
+        if cycle is None:
+            cycle = self.cycles[chat_id] = {}
+
+        rarity = table.sample(self.random)
+        remaining = cycle.get(rarity)
+        # Pooled ids deleted, re-rated or quarantined since the pool was filled
+        # are skipped; a refill has only spawnable ids, and the table only has
+        # tiers with some, so this ends within the pool plus one refill.
+        refilled = False
+        while True:
+            if not remaining:
+                if refilled:
+                    return None
+                remaining = cycle[rarity] = self.spawnable(rarity)
+                refilled = True
+                continue
+            index = self.random.randrange(len(remaining))
+            remaining[index], remaining[-1] = remaining[-1], remaining[index]
+            character_id = remaining.pop()
+            character = self.catalog.get(character_id)
+            if character is not None and character['rarity'] == rarity and character_id not in self.quarantined:
+                return character
+
+sampler = RaritySampler(catalog, RARITY_WEIGHTS)
@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import time
+
+from shivu import LOGGER, SPAWN_RATE
+from shivu.caches import StatsLRUCache
+
+
+class SpawnScheduler:
+    """Time-based spawns for every chat from one task and one heap.
+
+    A chat only gets a timer while it has had activity since its last spawn,
+    so idle groups cost nothing and each tick is a heap pop regardless of how
+    many groups exist. Rescheduling pushes a new entry and leaves the old one
+    to be skipped when popped. Due spawns are paced to ``rate`` per second so
+    a burst of timers firing together stays under Telegram's limits.
+    """
+
+    def __init__(self, rate: float = 20.0):
+        self.rate = rate
+        self.spawn = None
+        self.bot = None
+        self.heap = []
+        self.due = {}
+        self.intervals = {}
+        self.active = set()
+        self.last_spawn = StatsLRUCache('spawn_last_spawn', maxsize=100000)
+        self.fired = 0
+        self._next_slot = 0.0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self.due)
+
+    def _push(self, chat_id, due: float) -> None:
+        self.due[chat_id] = due
+        heapq.heappush(self.heap, (due, chat_id))
+        if self.heap[0] == (due, chat_id):
+            self._wake.set()
+
+    def touch(self, chat_id, interval: float) -> None:
+        """Record activity in ``chat_id``; ``interval`` is in seconds."""
+        self.active.add(chat_id)
+        self.intervals[chat_id] = interval
+        if chat_id in self.due:
+            return
+        now = time.monotonic()
+        self._push(chat_id, max(now, self.last_spawn.get(chat_id, now) + interval))
+
+    def spawned(self, chat_id) -> None:
+        """A spawn happened some other way; restart the chat's timer from now."""
+        now = time.monotonic()
+        self.last_spawn[chat_id] = now
+        self.active.discard(chat_id)
+        if chat_id in self.due:
+            self._push(chat_id, now + self.intervals.get(chat_id, 0))
+
+    def forget(self, chat_id) -> None:
+        self.due.pop(chat_id, None)
+        self.intervals.pop(chat_id, None)
+        self.active.discard(chat_id)
+
+    async def _pace(self) -> None:
+        now = time.monotonic()
+        self._next_slot = max(self._next_slot, now)
+        if self._next_slot > now:
+            await asyncio.sleep(self._next_slot - now)
+        self._next_slot += 1 / self.rate
+
+    async def _fire(self, chat_id) -> None:
+        try:
+            await self.spawn(self.bot, chat_id)
+        except Exception as e:
+            LOGGER.warning("Timed spawn in %s failed: %s", chat_id, e)
+
+    async def run(self) -> None:
+        while True:
+            if not self.heap:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+            due, chat_id = self.heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+
+            heapq.heappop(self.heap)
+            if self.due.get(chat_id) != due:
+                continue
+            del self.due[chat_id]
+            if chat_id not in self.active:
+                continue
+
+            await self._pace()
+            self.active.discard(chat_id)
+            self.last_spawn[chat_id] = time.monotonic()
+            self.fired += 1
+            asyncio.create_task(self._fire(chat_id))
+
+    def start(self, bot) -> None:
+        """Start firing timers through ``self.spawn(bot, chat_id)``."""
+        self.bot = bot
+        if self._task is None and self.spawn is not None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+spawn_scheduler = SpawnScheduler(SPAWN_RATE)
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+
+import msgpack
+
+from shivu import repository, CATALOG_SNAPSHOT, CATALOG_SYNC_INTERVAL, LOGGER
+from shivu.catalog import Character, catalog, current_revision
+
+FORMAT = 1
+
+
+def write_snapshot(path: str, characters: list, revision: int) -> None:
+    rows = [[c.id, c.name, c.anime, c.rarity, c.img_url, c.message_id, c.extra] for c in characters]
+    data = msgpack.packb({'format': FORMAT, 'revision': revision, 'count': len(rows),
+                          'saved_at': time.time(), 'rows': rows}, use_bin_type=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path: str):
+    """Return (characters, revision) from ``path``, or None if it's missing or unusable."""
+    try:
+        with open(path, 'rb') as f:
+            data = msgpack.unpackb(f.read(), raw=False)
+        if data.get('format') != FORMAT or data['count'] != len(data['rows']):
+            return None
+        return [Character(*row) for row in data['rows']], data['revision']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.warning("Ignoring unreadable catalog snapshot %s: %s", path, e)
+        return None
+
+
+class CatalogSync:
+    """Keeps the catalog in a local msgpack snapshot and in step with Mongo.
+
+    On boot the snapshot fills the catalog without touching Mongo. ``sync``
+    then fetches only the characters stamped with a newer revision, and
+    reloads everything when the collection's count still disagrees (deletes,
+    or edits made by something that doesn't stamp revisions). After each
+    change the snapshot is rewritten, off the event loop.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.synced_at = None
+        self._task = None
+
+    async def warm_start(self) -> None:
+        snapshot = await asyncio.to_thread(read_snapshot, self.path) if self.path else None
+        if snapshot is None:
+            await catalog.load()
+            await self.save()
+            self.synced_at = time.time()
+            return
+        characters, revision = snapshot
+        catalog.replace(characters, revision)
+        LOGGER.info("Catalog loaded from snapshot: %d characters at revision %d", len(characters), revision)
+
+    async def save(self) -> None:
+        if self.path:
+            await asyncio.to_thread(write_snapshot, self.path, list(catalog.characters), catalog.revision)
+
+    async def sync(self) -> bool:
+        """Bring the catalog up to date; return whether anything changed."""
+        revision = await current_revision()
+        count = await repository.count_characters(estimated=True)
+        if revision == catalog.revision and count == len(catalog):
+            self.synced_at = time.time()
+            return False
+
+        if revision != catalog.revision:
+            changed = await repository.characters_changed_since(catalog.revision)
+            for doc in changed:
+                catalog.add(doc)
+            catalog.revision = revision
+            LOGGER.info("Catalog synced %d changed characters up to revision %d", len(changed), revision)
+
+        count = await repository.count_characters()
+        if count != len(catalog):
+            LOGGER.warning("Catalog diverged from the collection (%d vs %d), reloading", len(catalog), count)
+            await catalog.load()
+
+        await self.save()
+        self.synced_at = time.time()
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                LOGGER.warning("Catalog sync failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None and self.interval:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+catalog_sync = CatalogSync(CATALOG_SNAPSHOT, CATALOG_SYNC_INTERVAL)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from pymongo import ASCENDING, DESCENDING
+
+from shivu import (collection, user_collection, user_totals_collection, group_user_totals_collection,
+                   top_global_groups_collection, catch_buckets_collection, propagation_jobs_collection,
+                   events_collection, image_checks_collection, shivuu, TRACK_TASK_AGES, LOGGER)
+from shivu import recorder
+from shivu.chat_settings import chat_settings
+from shivu.events import event_log
+from shivu.health import mongo_health
+from shivu.images import image_scanner
+from shivu.propagation import propagator
+from shivu.registration import registrations
+from shivu.scheduler import spawn_scheduler
+from shivu.snapshot import catalog_sync
+from shivu.tasktracker import track_task_ages
+from shivu.thumbnails import thumbnails
+
+# Set once indexes exist and the catalog and chat settings are in memory.
+ready = asyncio.Event()
+timings = {}
+
+
+async def setup_indexes() -> None:
+    await asyncio.gather(
+        collection.create_index([('id', ASCENDING)]),
+        collection.create_index([('anime', ASCENDING)]),
+        collection.create_index([('revision', ASCENDING)]),
+        user_collection.create_index([('id', ASCENDING)]),
+        user_collection.create_index([('characters.id', ASCENDING), ('_id', ASCENDING)]),
+        user_totals_collection.create_index([('chat_id', ASCENDING)]),
+        group_user_totals_collection.create_index([('group_id', ASCENDING), ('user_id', ASCENDING)]),
+        group_user_totals_collection.create_index([('group_id', ASCENDING), ('count', DESCENDING)]),
+        top_global_groups_collection.create_index([('group_id', ASCENDING)]),
+        top_global_groups_collection.create_index([('count', DESCENDING)]),
+        catch_buckets_collection.create_index([('scope', ASCENDING), ('day', ASCENDING), ('id', ASCENDING)], unique=True),
+        catch_buckets_collection.create_index([('scope', ASCENDING), ('day', ASCENDING), ('count', DESCENDING)]),
+        catch_buckets_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0),
+        propagation_jobs_collection.create_index([('done', ASCENDING), ('_id', ASCENDING)]),
+        events_collection.create_index([('users', ASCENDING), ('_id', DESCENDING)]),
+        events_collection.create_index([('characters', ASCENDING), ('_id', DESCENDING)]),
+        image_checks_collection.create_index([('next_check_at', ASCENDING)]),
+        image_checks_collection.create_index([('quarantined', ASCENDING)]),
+    )
+
+
+async def _timed(name, coro):
+    start = time.perf_counter()
+    try:
+        await coro
+    except Exception as e:
+        LOGGER.exception("Startup step %s failed: %s", name, e)
+        timings[name] = None
+        return
+    timings[name] = time.perf_counter() - start
+    LOGGER.info("Startup step %s took %.3fs", name, timings[name])
+
+
+async def warm_up() -> float:
+    """Create indexes and fill the in-memory caches concurrently.
+
+    A failed step is logged and skipped; the caches it would have filled fall
+    back to loading on first use.
+    """
+    start = time.perf_counter()
+    await asyncio.gather(
+        _timed('indexes', setup_indexes()),
+        _timed('catalog', catalog_sync.warm_start()),
+        _timed('chat_settings', chat_settings.load()),
+    )
+    timings['warm_up'] = time.perf_counter() - start
+    ready.set()
+    return timings['warm_up']
+
+
+async def post_init(application) -> None:
+    # PTB runs post_init before polling starts, so no update is consumed
+    # until the caches are hot.
+    start = time.perf_counter()
+    if TRACK_TASK_AGES:
+        track_task_ages()
+    await asyncio.gather(_timed('pyrogram', shivuu.start()), warm_up())
+    # Pings Mongo and lets the circuit breaker close again after an outage.
+    mongo_health.start()
+    spawn_scheduler.start(application.bot)
+    # Catches up a snapshot-loaded catalog right away, then every CATALOG_SYNC_INTERVAL.
+    catalog_sync.start()
+    # Resumes edits still being copied to owners when the bot last stopped.
+    propagator.start()
+    # Writes buffered events and catches the consumers up with anything logged before a restart.
+    event_log.start()
+    # Checks catalog images in the background and keeps broken ones from spawning.
+    image_scanner.start()
+    # Serves inline thumbnails and makes the missing ones, when THUMBNAIL_BASE_URL is set.
+    await thumbnails.start()
+    # Announces new users in GROUP_ID every NEW_USER_DIGEST_INTERVAL.
+    registrations.start()
+    LOGGER.info("Ready in %.3fs", time.perf_counter() - start)
+
+
+async def post_shutdown(application) -> None:
+    await spawn_scheduler.stop()
+    await catalog_sync.stop()
+    await propagator.stop()
+    await event_log.stop()
+    await registrations.stop()
+    await thumbnails.stop()
+    await image_scanner.stop()
+    await mongo_health.stop()
+    if recorder.active is not None:
+        await asyncio.to_thread(recorder.active.close)
+    if shivuu.is_connected:
+        await shivuu.stop()
@@ -0,0 +1,19 @@
+import asyncio
+import time
+import weakref
+
+# When each task was created, filled in by the task factory once installed.
+task_started = weakref.WeakKeyDictionary()
+
+
+def task_factory(loop, coro, context=None):
+    task = asyncio.Task(coro, loop=loop, context=context)
+    task_started[task] = time.monotonic()
+    return task
+
+
+def track_task_ages(loop=None) -> None:
+    """Record the creation time of every task ``loop`` (the running one by default) creates, for /tasks."""
+    loop = loop or asyncio.get_running_loop()
+    if loop.get_task_factory() is None:
+        loop.set_task_factory(task_factory)
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import msgpack
+from aiohttp import web
+
+from shivu import (THUMBNAIL_DIR, THUMBNAIL_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY, THUMBNAIL_WORKERS,
+                   THUMBNAIL_BASE_URL, THUMBNAIL_PORT, LOGGER)
+from shivu.catalog import catalog
+from shivu.images import image_scanner, MAX_PHOTO_BYTES
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+NAME = re.compile(r'^[0-9a-f]{20}\.(jpg|webp)$')
+MANIFEST = 'manifest.msgpack'
+# Seconds between manifest writes while thumbnails are being made.
+SAVE_INTERVAL = 10
+# A content-hash name never changes meaning, so clients may keep it for a year.
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def render(data: bytes, size: int, fmt: str, quality: int) -> bytes:
+    """Scale the image in ``data`` to fit ``size`` x ``size``; runs in a worker process."""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG decoders can downscale while decoding, far cheaper than a full decode.
+        image.draft('RGB', (size, size))
+        if image.mode in ('RGBA', 'LA', 'P') and fmt == 'JPEG':
+            # JPEG has no alpha; put transparent parts on white rather than black.
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, fmt, quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def write_manifest(path: str, entries: dict) -> None:
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(msgpack.packb(entries, use_bin_type=True))
+    os.replace(tmp, path)
+
+
+def read_manifest(path: str) -> dict:
+    try:
+        with open(path, 'rb') as f:
+            return msgpack.unpackb(f.read(), raw=False)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        LOGGER.warning("Ignoring unreadable thumbnail manifest %s: %s", path, e)
+        return {}
+
+
+def write_file(path: str, data: bytes) -> None:
+    if not os.path.exists(path):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class Thumbnails:
+    """Small copies of catalog images for the inline results grid, served by the bot.
+
+    Each character's image is downloaded once, scaled to fit ``size`` pixels
+    in a process pool (so Pillow never blocks the event loop) and written to
+    ``directory`` under the hash of its content. The manifest there maps
+    character ids to ``(img_url, file)``, so a changed ``img_url`` gets a new
+    thumbnail. An aiohttp endpoint on ``port`` serves the files with
+    year-long immutable caching, and ``url`` returns ``base_url/<file>`` for
+    inline results, or None while a thumbnail isn't made yet, in which case
+    the character is queued and the full image is used meanwhile.
+    """
+
+    def __init__(self, directory, size, fmt, quality, workers, base_url, port):
+        self.directory = directory
+        self.size = size
+        self.format = fmt.upper()
+        self.extension = EXTENSIONS[self.format]
+        self.quality = quality
+        self.workers = workers
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.port = port
+        self.entries = {}
+        self.queued = set()
+        # character id -> the img_url no thumbnail could be made from
+        self.unusable = {}
+        self.queue = asyncio.Queue()
+        self.made = 0
+        self.failed = 0
+        self.source_bytes = 0
+        self.thumbnail_bytes = 0
+        self.served = 0
+        self.not_modified = 0
+        self.dirty = False
+        self.pool = None
+        self._runner = None
+        self._tasks = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory and self.base_url)
+
+    def file(self, character):
+        """The thumbnail file made from the character's current ``img_url``, or None."""
+        entry = self.entries.get(character['id'])
+        return entry[1] if entry is not None and entry[0] == character['img_url'] else None
+
+    def url(self, character):
+        if not self.enabled:
+            return None
+        name = self.file(character)
+        if name is None:
+            self.enqueue(character)
+            return None
+        return f'{self.base_url}/{name}'
+
+    def enqueue(self, character) -> None:
+        if (character['id'] not in self.queued and character['id'] not in image_scanner.broken
+                and self.unusable.get(character['id']) != character['img_url']):
+            self.queued.add(character['id'])
+            self.queue.put_nowait(character)
+
+    async def download(self, url: str) -> bytes:
+        async with image_scanner.session().get(url) as response:
+            response.raise_for_status()
+            chunks, size = [], 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise ValueError(f'over {MAX_PHOTO_BYTES} bytes')
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    async def make(self, character) -> str:
+        """Create the thumbnail for ``character`` and return its file name."""
+        data = await self.download(character['img_url'])
+        thumbnail = await asyncio.get_running_loop().run_in_executor(
+            self.pool, render, data, self.size, self.format, self.quality)
+        name = f'{hashlib.sha256(thumbnail).hexdigest()[:20]}.{self.extension}'
+        await asyncio.to_thread(write_file, os.path.join(self.directory, name), thumbnail)
+        previous = self.entries.get(character['id'])
+        self.entries[character['id']] = (character['img_url'], name)
+        self.dirty = True
+        if previous and previous[1] != name and all(entry[1] != previous[1] for entry in self.entries.values()):
+            await asyncio.to_thread(self.remove_file, previous[1])
+        self.made += 1
+        self.source_bytes += len(data)
+        self.thumbnail_bytes += len(thumbnail)
+        return name
+
+    def remove_file(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    async def worker(self) -> None:
+        while True:
+            character = await self.queue.get()
+            current = catalog.get(character['id'])
+            try:
+                if current is not None and self.file(current) is None:
+                    await self.make(current)
+            except Exception as e:
+                self.failed += 1
+                # The url make() actually tried; the queued one may have been edited since.
+                self.unusable[character['id']] = current['img_url']
+                LOGGER.warning("No thumbnail for %s: %s", character['id'], e)
+            finally:
+                self.queued.discard(character['id'])
+                self.queue.task_done()
+
+    async def backfill(self) -> None:
+        await catalog.ensure_loaded()
+        for character in list(catalog.characters):
+            if self.file(character) is None:
+                self.enqueue(character)
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            await self.save()
+
+    async def save(self) -> None:
+        if self.dirty:
+            self.dirty = False
+            await asyncio.to_thread(write_manifest, os.path.join(self.directory, MANIFEST), dict(self.entries))
+
+    async def serve(self, request):
+        name = request.match_info['name']
+        if not NAME.match(name):
+            raise web.HTTPNotFound()
+        etag = f'"{name.split(".")[0]}"'
+        headers = {'Cache-Control': CACHE_CONTROL, 'ETag': etag}
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers=headers)
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+        self.served += 1
+        return web.FileResponse(path, headers=headers)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/{name}', self.serve)
+        return app
+
+    async def start(self) -> None:
+        if not self.enabled or self._tasks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.entries = {character_id: tuple(entry) for character_id, entry in
+                        (await asyncio.to_thread(read_manifest, os.path.join(self.directory, MANIFEST))).items()}
+        # Not fork: pymongo's monitors and the log listener are already running threads, and a
+        # child forked while one of them holds a lock would wait on it forever. The fork server
+        # preloads Pillow rather than the bot's __main__.
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['PIL.Image'])
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        if self.port:
+            self._runner = web.AppRunner(self.app(), access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
+            LOGGER.info("Serving %d thumbnails on port %d", len(self.entries), self.port)
+        # Downloads overlap renders, so a couple more workers than processes keep the pool busy.
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers * 2)]
+        self._tasks.append(asyncio.create_task(self.backfill()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        await self.save()
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'thumbnails': len(self.entries),
+            'queued': self.queue.qsize(),
+            'made': self.made,
+            'failed': self.failed,
+            'source_kib_avg': round(self.source_bytes / self.made / 1024, 1) if self.made else None,
+            'thumbnail_kib_avg': round(self.thumbnail_bytes / self.made / 1024, 1) if self.made else None,
+            'served': self.served,
+            'not_modified': self.not_modified,
+        }
+
+
+thumbnails = Thumbnails(THUMBNAIL_DIR, THUMBNAIL_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY, THUMBNAIL_WORKERS,
+                        THUMBNAIL_BASE_URL, THUMBNAIL_PORT)
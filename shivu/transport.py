@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import httpx
+from telegram._utils.defaultvalue import DefaultValue
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest, RequestData
+from telegram.request._baserequest import BaseRequest
+
+from shivu.ratelimit import PriorityMetrics
+
+
+class PooledRequest(HTTPXRequest):
+    """``HTTPXRequest`` with a real connection pool and metrics on it.
+
+    PTB's default pool holds one connection, so concurrent ``block=False``
+    handlers queue behind each other and hit the one-second pool timeout.
+    Here up to ``pool_size`` requests run at once (each on its own
+    connection over HTTP/1.1, as streams of fewer connections over HTTP/2),
+    ``keepalive`` idle connections are kept for ``keepalive_expiry``
+    seconds, and the time each request waits for a free slot is recorded.
+    """
+
+    def __init__(self, pool_size: int, keepalive: int, keepalive_expiry: float, http_version: str = '1.1',
+                 connect_timeout: float = 5.0, read_timeout: float = 5.0, write_timeout: float = 5.0,
+                 pool_timeout: float = 1.0):
+        # Read by _build_client, which HTTPXRequest.__init__ calls.
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=min(keepalive, pool_size),
+                                   keepalive_expiry=keepalive_expiry)
+        super().__init__(connection_pool_size=pool_size, read_timeout=read_timeout, write_timeout=write_timeout,
+                         connect_timeout=connect_timeout, pool_timeout=pool_timeout, http_version=http_version)
+        self.pool_size = pool_size
+        self.slots = asyncio.Semaphore(pool_size)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = PriorityMetrics()
+        self.pool_timeouts = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config, pool_size: int = None):
+        return cls(pool_size or config.BOT_API_POOL_SIZE, config.BOT_API_KEEPALIVE, config.BOT_API_KEEPALIVE_EXPIRY,
+                   config.BOT_API_HTTP_VERSION, config.BOT_API_CONNECT_TIMEOUT, config.BOT_API_READ_TIMEOUT,
+                   config.BOT_API_WRITE_TIMEOUT, config.BOT_API_POOL_TIMEOUT)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(**{**self._client_kwargs, 'limits': self.limits})
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        # The wait for a slot is the pool wait; httpx then always finds a connection free.
+        timeout = self._client.timeout.pool if isinstance(pool_timeout, DefaultValue) else pool_timeout
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.pool_timeouts += 1
+            raise TimedOut(f'Pool timeout: all {self.pool_size} connections stayed busy for {timeout}s; '
+                           f'request was not sent') from None
+        self.waits.record(time.monotonic() - start)
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        try:
+            return await super().do_request(url, method, request_data, read_timeout, write_timeout,
+                                             connect_timeout, pool_timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_use -= 1
+            self.slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'http_version': self.http_version,
+            'pool_size': self.pool_size,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'requests': self.waits.sent,
+            'pool_wait_p50_ms': round(self.waits.percentile(50) * 1000, 1),
+            'pool_wait_p99_ms': round(self.waits.percentile(99) * 1000, 1),
+            'pool_wait_max_ms': round(self.waits.max_wait * 1000, 1),
+            'pool_timeouts': self.pool_timeouts,
+            'errors': self.errors,
+        }